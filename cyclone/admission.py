@@ -0,0 +1,145 @@
+# coding: utf-8
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Admission control: turning requests away early under overload.
+
+When a server takes on more work than it can do, every request gets
+slower; rejecting some of them at once, with ``503 Service Unavailable``
+and a ``Retry-After`` header, keeps the others fast.  An
+`AdmissionController`, configured with the ``admission_control``
+application setting, decides which requests `cyclone.web.Application`
+runs.
+
+Requests have a priority, from the ``priority`` attribute of their
+handler (or a ``_priority`` key in the keyword arguments of their URL
+spec): `LOW` requests are shed first, `NORMAL` ones next, while
+`CRITICAL` ones (health checks, ...) are always run. ::
+
+    class HealthHandler(web.RequestHandler):
+        priority = admission.CRITICAL
+
+    application = web.Application([
+        (r"/health", HealthHandler),
+        (r"/reports", ReportsHandler, {"_priority": admission.LOW}),
+    ], admission_control={"max_in_flight": 500, "target_delay": 0.05})
+"""
+
+LOW = 0
+NORMAL = 1
+CRITICAL = 2
+
+
+class AdmissionController(object):
+    """Admits requests while the server keeps up.
+
+    Requests are shed when either:
+
+    * ``max_in_flight`` requests are already running (unfinished), or
+      ``low_priority_share`` of it for `LOW` priority ones;
+    * the reactor is overloaded: how late it runs timed calls (the time
+      events wait to be handled) stayed above ``target_delay`` seconds for
+      a whole ``interval``, CoDel style.  It is sampled every
+      ``sample_interval`` seconds, and checked at the end of each
+      interval: the server is overloaded until an interval in which the
+      smallest delay seen is back under the target.
+
+    Either check is off when its setting is None.  Shed requests get a 503
+    with a ``Retry-After`` header of ``retry_after`` seconds.  `stats`
+    returns the counters of the controller.
+    """
+    def __init__(self, max_in_flight=None, low_priority_share=0.75,
+                 target_delay=None, interval=0.1, sample_interval=0.01,
+                 retry_after=1, reactor=None):
+        self.max_in_flight = max_in_flight
+        self.low_priority_share = low_priority_share
+        self.target_delay = target_delay
+        self.interval = interval
+        self.sample_interval = sample_interval
+        self.retry_after = retry_after
+        self._reactor = reactor
+        self._call = None
+        self._expected = None
+        self._interval_end = None
+        self._min_delay = None
+        self.overloaded = False
+        self.delay = 0.0
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed_in_flight = 0
+        self.shed_delay = 0
+
+    def start(self):
+        """Starts measuring the reactor delay, if there's a target."""
+        if self.target_delay is None or self._call is not None:
+            return
+        if self._reactor is None:
+            from twisted.internet import reactor
+            self._reactor = reactor
+        now = self._reactor.seconds()
+        self._interval_end = now + self.interval
+        self._schedule(now)
+
+    def stop(self):
+        if self._call is not None:
+            self._call.cancel()
+            self._call = None
+        self.overloaded = False
+
+    def _schedule(self, now):
+        self._expected = now + self.sample_interval
+        self._call = self._reactor.callLater(self.sample_interval,
+                                             self._sample)
+
+    def _sample(self):
+        now = self._reactor.seconds()
+        self.delay = max(0.0, now - self._expected)
+        if self._min_delay is None or self.delay < self._min_delay:
+            self._min_delay = self.delay
+        if now >= self._interval_end:
+            self.overloaded = self._min_delay > self.target_delay
+            self._min_delay = None
+            self._interval_end = now + self.interval
+        self._schedule(now)
+
+    def admit(self, request, priority=NORMAL):
+        """Returns whether to run ``request``, counting it as in flight
+        until it finishes if so."""
+        if priority < CRITICAL:
+            limit = self.max_in_flight
+            if limit is not None and priority <= LOW:
+                limit *= self.low_priority_share
+            if limit is not None and self.in_flight >= limit:
+                self.shed_in_flight += 1
+                return False
+            if self.overloaded:
+                self.shed_delay += 1
+                return False
+        self.in_flight += 1
+        self.admitted += 1
+        request.notifyFinish().addBoth(self._finished)
+        return True
+
+    def _finished(self, result):
+        self.in_flight -= 1
+        return result
+
+    def stats(self):
+        """Returns the controller counters as a dict."""
+        return dict(in_flight=self.in_flight,
+                    max_in_flight=self.max_in_flight,
+                    admitted=self.admitted,
+                    shed=self.shed_in_flight + self.shed_delay,
+                    shed_in_flight=self.shed_in_flight,
+                    shed_delay=self.shed_delay, delay=self.delay,
+                    overloaded=self.overloaded)
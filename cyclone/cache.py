@@ -0,0 +1,234 @@
+# coding: utf-8
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""In-process caching helpers.
+
+`LRUCache` is a bounded mapping with per-item expiry; it is the default
+store of `cyclone.web.cached_response`.  `SingleFlight` lets concurrent
+callers asking for the same key share the work of the first one.
+`async_cached` memoizes functions returning Deferreds (or coroutines)
+with both.
+
+They are meant to be used from the reactor thread only.
+"""
+
+import collections
+import functools
+import inspect
+import time
+
+from twisted.internet import defer
+from twisted.python import failure
+
+
+class LRUCache(object):
+    """A mapping holding at most ``maxsize`` worth of items.
+
+    The size of an item is given by ``sizeof(value)``, or is 1 if
+    ``sizeof`` is None, so ``maxsize`` is either a byte budget or a number
+    of items.  The least recently used items are evicted first.  Items set
+    with a ``ttl`` (in seconds) are dropped once it is over.
+
+    This is also the interface of `cyclone.web.cached_response` stores:
+    ``get`` and ``set`` may return Deferreds in other implementations.
+    """
+    def __init__(self, maxsize=128, sizeof=None, clock=None):
+        self.maxsize = maxsize
+        self.sizeof = sizeof
+        self.clock = clock or time.time
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = collections.OrderedDict()  # key: (value, size, expires)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        item = self._items.get(key)
+        return item is not None and \
+            (item[2] is None or item[2] > self.clock())
+
+    def get(self, key, default=None):
+        item = self._items.get(key)
+        if item is not None and item[2] is not None and \
+                item[2] <= self.clock():
+            self.delete(key)
+            item = None
+        if item is None:
+            self.misses += 1
+            return default
+        self._items.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def set(self, key, value, ttl=None):
+        size = 1 if self.sizeof is None else self.sizeof(value)
+        self.delete(key)
+        if size > self.maxsize:
+            return
+        expires = None if ttl is None else self.clock() + ttl
+        self._items[key] = (value, size, expires)
+        self.size += size
+        while self.size > self.maxsize:
+            key, item = self._items.popitem(last=False)
+            self.size -= item[1]
+            self.evictions += 1
+
+    def delete(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.size -= item[1]
+
+    def clear(self):
+        self._items.clear()
+        self.size = 0
+
+    def stats(self):
+        """Returns the cache counters and current size as a dict."""
+        return dict(hits=self.hits, misses=self.misses,
+                    evictions=self.evictions, items=len(self._items),
+                    size=self.size, maxsize=self.maxsize)
+
+
+class SingleFlight(object):
+    """Keeps track of pending work by key.
+
+    The first caller for a key calls `start` and does the work; callers
+    finding the key already in flight `wait` for it instead.  `done` (or
+    `fail`) hands the outcome to every waiter and forgets the key. ::
+
+        if key in flights:
+            result = yield flights.wait(key)
+        else:
+            flights.start(key)
+            try:
+                result = yield compute()
+            except Exception:
+                flights.fail(key)
+                raise
+            flights.done(key, result)
+    """
+    def __init__(self):
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __contains__(self, key):
+        return key in self._pending
+
+    def start(self, key):
+        assert key not in self._pending, "%r is already in flight" % (key,)
+        self._pending[key] = []
+
+    def wait(self, key):
+        """Returns a Deferred firing with the outcome of ``key``."""
+        d = defer.Deferred()
+        self._pending[key].append(d)
+        return d
+
+    def done(self, key, result=None):
+        for d in self._pending.pop(key, ()):
+            d.callback(result)
+
+    def fail(self, key, reason=None):
+        """Errbacks the waiters of ``key`` with ``reason``, a Failure
+        (the current exception if None)."""
+        waiters = self._pending.pop(key, ())
+        if waiters:
+            if reason is None:
+                reason = failure.Failure()
+            for d in waiters:
+                d.errback(reason)
+
+
+_MISSING = object()
+
+
+def _make_key(args, kwargs):
+    if kwargs:
+        return args + (_MISSING,) + tuple(sorted(kwargs.items()))
+    return args
+
+
+def _call(function, args, kwargs):
+    try:
+        result = function(*args, **kwargs)
+    except Exception:
+        return defer.fail()
+    if isinstance(result, defer.Deferred):
+        return result
+    elif inspect.isawaitable(result):
+        return defer.ensureDeferred(result)
+    return defer.succeed(result)
+
+
+def async_cached(ttl=None, maxsize=128):
+    """Memoizes a function returning a Deferred, or an ``async def``.
+
+    The values the function resolves to are kept for ``ttl`` seconds
+    (forever if None), for the ``maxsize`` most recently used argument
+    lists; arguments must be hashable.  Concurrent calls with the same
+    arguments share one pending call, and failures are passed on to the
+    callers without being kept.  The decorated function always returns a
+    Deferred of its own: cancelling it does not cancel the shared call. ::
+
+        @cache.async_cached(ttl=60, maxsize=1000)
+        @defer.inlineCallbacks
+        def get_user(user_id):
+            user = yield db.runQuery("SELECT ...", (user_id,))
+            defer.returnValue(user)
+
+    Every caller gets the same value object, so don't modify it.  The
+    wrapper has ``cache_info()``, returning the hit, miss and eviction
+    counters as a dict, ``cache_clear()`` and ``invalidate(*args,
+    **kwargs)`` to drop the value kept for some arguments.
+    """
+    def decorator(function):
+        store = LRUCache(maxsize)
+        flights = SingleFlight()
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            key = _make_key(args, kwargs)
+            value = store.get(key, _MISSING)
+            if value is not _MISSING:
+                return defer.succeed(value)
+            if key in flights:
+                return flights.wait(key)
+
+            def done(value):
+                store.set(key, value, ttl)
+                flights.done(key, value)
+
+            def failed(reason):
+                flights.fail(key, reason)
+
+            # The first caller waits like the others, so that cancelling
+            # its Deferred (e.g. on a timeout) leaves the call running.
+            flights.start(key)
+            d = flights.wait(key)
+            _call(function, args, kwargs).addCallbacks(done, failed)
+            return d
+
+        def invalidate(*args, **kwargs):
+            store.delete(_make_key(args, kwargs))
+
+        wrapper.cache_info = store.stats
+        wrapper.cache_clear = store.clear
+        wrapper.invalidate = invalidate
+        return wrapper
+    return decorator
@@ -35,14 +35,12 @@ _json_decode = json.loads
 _json_encode = json.dumps
 
 
-
-_XHTML_ESCAPE_RE = re.compile('[&<>"\']')
-_XHTML_ESCAPE_DICT = {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": "&#39;"}
-
-
 def xhtml_escape(value):
     """Escapes a string so it is valid within XML or XHTML."""
-    return _XHTML_ESCAPE_RE.sub(lambda match: _XHTML_ESCAPE_DICT[match.group(0)], to_basestring(value))
+    # Replacing each character in turn is faster than a regex substitution.
+    return to_basestring(value).replace("&", "&amp;").replace(
+        "<", "&lt;").replace(">", "&gt;").replace('"', "&quot;").replace(
+        "'", "&#39;")
 
 
 def xhtml_unescape(value):
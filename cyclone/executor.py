@@ -0,0 +1,346 @@
+# coding: utf-8
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Running blocking code off the reactor thread.
+
+`ThreadPool` is a named pool of threads with a bounded queue, which
+`cyclone.web.run_on_executor` runs handler methods on.  Giving each slow
+dependency its own pool keeps it from starving the others, and from
+taking the threads of Twisted's global pool (which also resolves names)
+the way ``deferToThread`` does.
+
+`ProcessPool` runs CPU-bound functions (image transforms, encoding big
+documents, ...) in worker processes, so they neither hold the GIL of the
+server process nor block the reactor.
+
+Pools are driven from the reactor thread: their ``submit`` methods must be
+called from it, and the Deferreds they return fire in it.
+"""
+
+import collections
+from concurrent.futures import process
+import multiprocessing
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+import os
+import time
+
+from twisted.internet import defer
+from twisted.python import threadpool
+
+
+class RejectedError(Exception):
+    """Raised when a pool can't take any more work."""
+
+
+class ThreadPool(object):
+    """Runs blocking calls in up to ``size`` threads.
+
+    Calls submitted while every thread is busy wait in a queue of at most
+    ``max_queue`` calls.  When it is full the ``reject`` policy applies:
+    ``"abort"`` fails the new call with `RejectedError`, while
+    ``"discard_oldest"`` fails the call that has been waiting the longest
+    instead and queues the new one.
+
+    Threads are started on first use and stopped when the reactor shuts
+    down.  `stats` returns the counters of the pool, which include the
+    time calls spent queued and running, in seconds.
+    """
+    REJECT_POLICIES = ("abort", "discard_oldest")
+
+    def __init__(self, name, size=10, max_queue=100, reject="abort",
+                 reactor=None, clock=None):
+        if reject not in self.REJECT_POLICIES:
+            raise ValueError("Unknown reject policy: %r" % reject)
+        self.name = name
+        self.size = size
+        self.max_queue = max_queue
+        self.reject = reject
+        self.clock = clock or time.monotonic
+        self._reactor = reactor
+        self._threads = None
+        self._queue = collections.deque()
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.saturated = 0
+        self.max_queued = 0
+        self.queue_time = 0.0
+        self.max_queue_time = 0.0
+        self.run_time = 0.0
+        self.max_run_time = 0.0
+
+    def __repr__(self):
+        return "<%s %r size=%d max_queue=%d>" % (
+            self.__class__.__name__, self.name, self.size, self.max_queue)
+
+    def start(self):
+        if self._threads is not None:
+            return
+        if self._reactor is None:
+            from twisted.internet import reactor
+            self._reactor = reactor
+        self._threads = threadpool.ThreadPool(0, self.size, name=self.name)
+        self._threads.start()
+        self._reactor.addSystemEventTrigger("during", "shutdown", self.stop)
+
+    def stop(self):
+        """Fails the queued calls and waits for the running ones."""
+        while self._queue:
+            self._queue.popleft()[0].errback(
+                RejectedError("%s pool is stopped" % self.name))
+        if self._threads is not None:
+            self._threads.stop()
+            self._threads = None
+
+    def submit(self, function, *args, **kwargs):
+        """Calls ``function(*args, **kwargs)`` in a thread of the pool.
+
+        Returns a Deferred firing with the result, or failing with
+        `RejectedError` when the queue is full.  Cancelling it drops the
+        call if it is still queued; a running call is left to finish.
+        """
+        def cancel(d):
+            try:
+                self._queue.remove(call)
+            except ValueError:
+                pass
+
+        self.submitted += 1
+        d = defer.Deferred(cancel)
+        call = (d, function, args, kwargs, self.clock())
+        if self.running < self.size:
+            self._run(call)
+            return d
+        self.saturated += 1
+        if len(self._queue) >= self.max_queue:
+            self.rejected += 1
+            if self.reject == "abort" or not self._queue:
+                return defer.fail(RejectedError(
+                    "%s pool queue is full" % self.name))
+            self._queue.popleft()[0].errback(RejectedError(
+                "discarded from the %s pool queue" % self.name))
+        self._queue.append(call)
+        self.max_queued = max(self.max_queued, len(self._queue))
+        return d
+
+    def _run(self, call):
+        d, function, args, kwargs, queued = call
+        started = self.clock()
+        self.queue_time += started - queued
+        self.max_queue_time = max(self.max_queue_time, started - queued)
+        self.running += 1
+        self.start()
+
+        def finished(success, result):
+            # in the pool thread
+            self._reactor.callFromThread(self._finished, d, started,
+                                         self.clock(), success, result)
+        self._threads.callInThreadWithCallback(finished, function,
+                                               *args, **kwargs)
+
+    def _finished(self, d, started, stopped, success, result):
+        self.running -= 1
+        self.run_time += stopped - started
+        self.max_run_time = max(self.max_run_time, stopped - started)
+        while self._queue and self.running < self.size:
+            self._run(self._queue.popleft())
+        if success:
+            self.completed += 1
+            d.callback(result)
+        else:
+            self.failed += 1
+            d.errback(result)
+
+    def stats(self):
+        """Returns the pool counters as a dict."""
+        return dict(name=self.name, size=self.size,
+                    max_queue=self.max_queue, running=self.running,
+                    queued=len(self._queue), max_queued=self.max_queued,
+                    submitted=self.submitted, completed=self.completed,
+                    failed=self.failed, rejected=self.rejected,
+                    saturated=self.saturated, queue_time=self.queue_time,
+                    max_queue_time=self.max_queue_time,
+                    run_time=self.run_time, max_run_time=self.max_run_time)
+
+
+class _SharedBytes(object):
+    """Stands for a bytes result left in shared memory by a worker."""
+    __slots__ = ("name", "size")
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+    def __reduce__(self):
+        return (_SharedBytes, (self.name, self.size))
+
+    def read(self):
+        """Returns the bytes and frees the shared memory."""
+        segment = shared_memory.SharedMemory(name=self.name)
+        try:
+            with segment.buf[:self.size] as view:
+                return bytes(view)
+        finally:
+            segment.close()
+            segment.unlink()
+
+
+def _call(function, args, kwargs, shared_memory_min_size):
+    # in the worker process
+    result = function(*args, **kwargs)
+    if isinstance(result, (bytes, bytearray, memoryview)) and \
+            shared_memory_min_size is not None and \
+            len(result) >= shared_memory_min_size:
+        segment = shared_memory.SharedMemory(create=True, size=len(result))
+        segment.buf[:len(result)] = result
+        # The server process frees it once read, the worker must not.
+        resource_tracker.unregister(segment._name, "shared_memory")
+        segment.close()
+        return _SharedBytes(segment.name, len(result))
+    return result
+
+
+class ProcessPool(object):
+    """Runs picklable functions in ``size`` worker processes (one per CPU
+    by default), using a ``concurrent.futures.ProcessPoolExecutor``.
+
+    `start` warms the pool up: it launches the workers, which run
+    ``initializer(*initargs)`` first, e.g. to import heavy modules.  Pools
+    of the ``process_pools`` application setting are started when the
+    application starts listening; others start on first use.
+
+    Calls running longer than ``timeout`` seconds fail with
+    ``twisted.internet.defer.TimeoutError``; ``addTimeout`` on the
+    Deferred returned by `submit` sets a timeout for a single call.  A
+    call which times out (or is cancelled) before it is handed to a worker
+    never runs, but one already running is not interrupted: its worker is
+    busy until it returns, and its result is dropped.
+
+    Results of ``shared_memory_min_size`` bytes or more (1MB by default)
+    are handed over through shared memory instead of being pickled
+    through a pipe.  None disables it.
+    """
+    def __init__(self, name, size=None, timeout=None,
+                 shared_memory_min_size=1024 * 1024, initializer=None,
+                 initargs=(), context=None, reactor=None):
+        self.name = name
+        self.size = size or os.cpu_count() or 1
+        self.timeout = timeout
+        self.shared_memory_min_size = shared_memory_min_size
+        self.initializer = initializer
+        self.initargs = initargs
+        self.context = context
+        self._reactor = reactor
+        self._executor = None
+        self.pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.shared = 0
+
+    def __repr__(self):
+        return "<%s %r size=%d>" % (self.__class__.__name__, self.name,
+                                    self.size)
+
+    def _start_executor(self):
+        context = self.context
+        if isinstance(context, str):
+            context = multiprocessing.get_context(context)
+        self._executor = process.ProcessPoolExecutor(
+            self.size, mp_context=context, initializer=self.initializer,
+            initargs=self.initargs)
+
+    def start(self):
+        """Starts the worker processes.
+
+        Returns a Deferred firing once every worker answered, or at once
+        if the pool is already running.
+        """
+        if self._executor is not None:
+            return defer.succeed(None)
+        if self._reactor is None:
+            from twisted.internet import reactor
+            self._reactor = reactor
+        self._start_executor()
+        self._reactor.addSystemEventTrigger("during", "shutdown", self.stop)
+        return defer.gatherResults([self.submit(os.getpid)
+                                    for i in range(self.size)])
+
+    def stop(self):
+        """Drops the queued calls and waits for the running ones."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def submit(self, function, *args, **kwargs):
+        """Calls ``function(*args, **kwargs)`` in a worker process.
+
+        ``function``, its arguments and its result must be picklable:
+        module level functions of importable modules, not methods of
+        request handlers.  Returns a Deferred firing with the result.
+        """
+        if self._executor is None:
+            self.start().addErrback(lambda reason: None)
+        call = (_call, function, args, kwargs, self.shared_memory_min_size)
+        try:
+            future = self._executor.submit(*call)
+        except process.BrokenProcessPool:
+            # A worker died (killed, or crashed the interpreter): the
+            # executor is unusable, replace it.
+            self._executor.shutdown(wait=False)
+            self._start_executor()
+            future = self._executor.submit(*call)
+        self.submitted += 1
+        self.pending += 1
+        d = defer.Deferred(lambda d: future.cancel())
+        future.add_done_callback(
+            lambda future: self._reactor.callFromThread(self._done, d,
+                                                        future))
+        if self.timeout is not None:
+            d.addTimeout(self.timeout, self._reactor)
+        return d
+
+    def _done(self, d, future):
+        self.pending -= 1
+        if future.cancelled():
+            self.cancelled += 1
+            if not d.called:
+                # dropped from the queue by stop()
+                d.cancel()
+            return
+        error = future.exception()
+        result = None if error is not None else future.result()
+        if isinstance(result, _SharedBytes):
+            self.shared += 1
+            result = result.read()
+        if d.called:
+            # timed out or cancelled while running
+            self.cancelled += 1
+        elif error is not None:
+            self.failed += 1
+            d.errback(error)
+        else:
+            self.completed += 1
+            d.callback(result)
+
+    def stats(self):
+        """Returns the pool counters as a dict."""
+        return dict(name=self.name, size=self.size, pending=self.pending,
+                    submitted=self.submitted, completed=self.completed,
+                    failed=self.failed, cancelled=self.cancelled,
+                    shared=self.shared)
@@ -30,7 +30,7 @@ This module also defines the `HTTPRequest` class which is exposed via
 """
 
 
-from http import cookies as http_cookies
+import os
 import socket
 import time
 
@@ -38,9 +38,12 @@ from io import BytesIO as StringIO
 from tempfile import TemporaryFile
 from twisted.python import log
 from twisted.protocols import basic
+from twisted.internet import abstract
 from twisted.internet import address
 from twisted.internet import defer
+from twisted.internet import error
 from twisted.internet import interfaces
+from zope.interface import implementer
 
 from cyclone.escape import utf8, native_str, parse_qs_bytes, to_unicode
 from cyclone import httputil
@@ -52,6 +55,106 @@ class _BadRequestException(Exception):
     pass
 
 
+@implementer(interfaces.IPullProducer)
+class _FileProducer(object):
+    """Pull producer that streams a window of a file to a transport.
+
+    On plain TCP transports the bytes go from the page cache straight to
+    the socket with ``os.sendfile``.  Other transports (TLS in particular)
+    get ``CHUNK_SIZE`` reads through ``transport.write``, as do transports
+    which don't pull from producers (``StringTransport``), at once.  The
+    returned Deferred fires once the window is sent, or fails with
+    ``ConnectionLost`` if the connection is lost first.
+    """
+    CHUNK_SIZE = 2 ** 16
+
+    def __init__(self, file, offset, count):
+        self.fd = file.fileno()
+        self.offset = offset
+        self.remaining = count
+        self.transport = None
+        self.deferred = defer.Deferred()
+        self._sendfile = False
+        self._started = False
+
+    def begin(self, transport):
+        if not self.remaining:
+            self.deferred.callback(None)
+            return self.deferred
+        self.transport = transport
+        self._sendfile = (hasattr(os, "sendfile") and
+                          isinstance(transport, abstract.FileDescriptor) and
+                          not interfaces.ISSLTransport.providedBy(transport))
+        transport.registerProducer(self, False)
+        if not self._started and \
+                not interfaces.ISSLTransport.providedBy(transport):
+            # Transports pulling from producers resume them right away,
+            # but for TLS, which does it on the next reactor iteration.
+            self._sendfile = False
+            while self.transport is not None:
+                self.resumeProducing()
+        return self.deferred
+
+    def resumeProducing(self):
+        if self.transport is None:
+            return
+        # registerProducer calls us right away, while the response headers
+        # may still sit in the transport's buffer, so the first chunk always
+        # goes through write() to keep the output in order.  Later calls
+        # come from the transport once its buffer is empty.
+        if self._sendfile and self._started:
+            self._send()
+        else:
+            self._started = True
+            data = os.pread(self.fd, min(self.CHUNK_SIZE, self.remaining),
+                            self.offset)
+            self._advance(len(data))
+            self.transport.write(data)
+            if not data:
+                # The file shrank under us; there's nothing more to send.
+                self.remaining = 0
+        if self.transport is not None and self.remaining <= 0:
+            self._finish()
+
+    def _send(self):
+        try:
+            sent = os.sendfile(self.transport.fileno(), self.fd,
+                               self.offset, self.remaining)
+        except BlockingIOError:
+            sent = None
+        except OSError as e:
+            log.msg("sendfile failed, falling back to reads: %s" % e)
+            self._sendfile = False
+            self.resumeProducing()
+            return
+        if sent == 0:
+            self.remaining = 0
+            return
+        if sent:
+            self._advance(sent)
+        if self.remaining > 0:
+            # Ask to be resumed once the socket is writable again.
+            self.transport.startWriting()
+
+    def _advance(self, count):
+        self.offset += count
+        self.remaining -= count
+
+    def _finish(self):
+        transport, self.transport = self.transport, None
+        transport.unregisterProducer()
+        self.deferred.callback(None)
+
+    def pauseProducing(self):
+        pass
+
+    def stopProducing(self):
+        if self.transport is not None:
+            self.transport = None
+            self.deferred.errback(error.ConnectionLost(
+                "connection lost while sending a file"))
+
+
 class HTTPConnection(basic.LineReceiver):
     """Handles a connection to an HTTP client, executing HTTP requests.
 
@@ -112,6 +215,19 @@ class HTTPConnection(basic.LineReceiver):
         assert self._request, "Request closed"
         self.transport.write(chunk)
 
+    def writeSequence(self, chunks):
+        assert self._request, "Request closed"
+        self.transport.writeSequence(chunks)
+
+    def sendfile(self, file, offset, count):
+        """Sends ``count`` bytes of ``file`` starting at ``offset``.
+
+        Returns a Deferred that fires when the data was handed over to the
+        transport, or fails with ``ConnectionLost``.
+        """
+        assert self._request, "Request closed"
+        return _FileProducer(file, offset, count).begin(self.transport)
+
     def finish(self):
         assert self._request, "Request closed"
         self._request_finished = True
@@ -329,14 +445,15 @@ class HTTPRequest(object):
 
     @property
     def cookies(self):
-        """A dictionary of Cookie.Morsel objects."""
+        """A dictionary of Cookie.Morsel objects.
+
+        A `cyclone.httputil.RequestCookies` mapping, which parses the
+        ``Cookie`` header leniently (see `cyclone.httputil.parse_cookie`)
+        and builds Morsels on demand.
+        """
         if not hasattr(self, "_cookies"):
-            self._cookies = http_cookies.SimpleCookie()
-            if "Cookie" in self.headers:
-                try:
-                    self._cookies.load(native_str(self.headers["Cookie"]))
-                except Exception:
-                    self._cookies = {}
+            self._cookies = httputil.RequestCookies(httputil.parse_cookie(
+                native_str(self.headers.get("Cookie", ""))))
         return self._cookies
 
     def write(self, chunk):
@@ -344,6 +461,20 @@ class HTTPRequest(object):
         assert isinstance(chunk, bytes_type)
         self.connection.write(chunk)
 
+    def writeSequence(self, chunks):
+        """Writes a list of byte strings to the response stream, in order,
+        without joining them first."""
+        self.connection.writeSequence(chunks)
+
+    def sendfile(self, file, offset, count):
+        """Streams ``count`` bytes of ``file`` from ``offset`` to the client.
+
+        The file is read (or sent with ``os.sendfile``) as the transport
+        drains, without loading it in memory.  Returns a Deferred fired
+        when done.
+        """
+        return self.connection.sendfile(file, offset, count)
+
     def finish(self):
         """Finishes this HTTP request on the open connection."""
         self.connection.finish()
@@ -18,6 +18,8 @@
 """HTTP utility code shared by clients and servers."""
 
 
+from collections import abc as collections_abc
+from http import cookies as http_cookies
 import re
 
 from cyclone.util import ObjectDict
@@ -201,6 +203,159 @@ def url_concat(url, args):
     return url + urllib_parse.urlencode(args)
 
 
+def parse_accept_encoding(value):
+    """Parses an ``Accept-Encoding`` header into a ``{coding: qvalue}`` dict.
+
+    Codings are lowercased, a missing q-value means 1.0 and malformed
+    q-values are treated as 0 (not acceptable).
+
+    >>> sorted(parse_accept_encoding("gzip;q=0.5, BR, *;q=0").items())
+    [('*', 0.0), ('br', 1.0), ('gzip', 0.5)]
+    """
+    codings = {}
+    for item in (value or "").split(","):
+        coding, sep, params = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        qvalue = 1.0
+        for param in params.split(";"):
+            k, sep, v = param.strip().partition("=")
+            if k.strip().lower() == "q":
+                try:
+                    qvalue = min(max(float(v), 0.0), 1.0)
+                except ValueError:
+                    qvalue = 0.0
+        codings[coding] = qvalue
+    return codings
+
+
+def parse_cookie(value):
+    """Parses a ``Cookie`` header into a ``{name: value}`` dict.
+
+    Unlike ``http.cookies.SimpleCookie`` it is lenient, the way browsers
+    are: pairs without a name or an ``=`` are skipped instead of dropping
+    every cookie, and values are taken as sent, only unquoted if they are
+    in double quotes.  The last of repeated names wins.
+
+    >>> sorted(parse_cookie('a=1; junk; b="x y"; c=a=b; =x').items())
+    [('a', '1'), ('b', 'x y'), ('c', 'a=b')]
+    """
+    cookies = {}
+    for chunk in value.split(";"):
+        name, sep, val = chunk.partition("=")
+        name = name.strip()
+        if not sep or not name:
+            continue
+        val = val.strip()
+        if len(val) > 1 and val[0] == val[-1] == '"':
+            val = http_cookies._unquote(val)
+        cookies[name] = val
+    return cookies
+
+
+class RequestCookies(collections_abc.Mapping):
+    """The cookies of a request: a read-only mapping of names to
+    ``http.cookies.Morsel`` objects, over the plain dict of values
+    returned by `parse_cookie`.
+
+    Morsels are only built for the cookies looked up; `get_value` returns
+    a value without building one.
+    """
+    __slots__ = ("_values", "_morsels")
+
+    def __init__(self, values):
+        self._values = values
+        self._morsels = {}
+
+    def __getitem__(self, name):
+        morsel = self._morsels.get(name)
+        if morsel is None:
+            value = self._values[name]
+            morsel = http_cookies.Morsel()
+            # Morsel.set() would reject the names browsers accept
+            morsel.__setstate__({"key": name, "value": value,
+                                 "coded_value": value})
+            self._morsels[name] = morsel
+        return morsel
+
+    def __contains__(self, name):
+        return name in self._values
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self._values)
+
+    def get_value(self, name, default=None):
+        """Returns the value of the cookie ``name``, else ``default``."""
+        return self._values.get(name, default)
+
+
+# ASCII digits only, unlike str.isdigit()
+_DIGITS_RE = re.compile(r"[0-9]*\Z")
+
+
+def parse_byte_ranges(value, size):
+    """Parses a ``Range`` header for a representation of ``size`` bytes.
+
+    Returns a sorted list of ``(start, stop)`` tuples, ``stop`` being
+    exclusive, with overlapping and adjacent ranges merged.  Returns an
+    empty list if no range is satisfiable, or ``None`` if the header is
+    not a valid ``bytes`` range (in which case it must be ignored).
+
+    >>> parse_byte_ranges("bytes=0-99", 1000)
+    [(0, 100)]
+    >>> parse_byte_ranges("bytes=500-599, -100, 0-9", 1000)
+    [(0, 10), (500, 600), (900, 1000)]
+    >>> parse_byte_ranges("bytes=0-9, 5-19", 1000)
+    [(0, 20)]
+    >>> parse_byte_ranges("bytes=2000-", 1000)
+    []
+    >>> parse_byte_ranges("bytes=9-0", 1000) is None
+    True
+    >>> parse_byte_ranges("bytes=\u00b2-", 1000) is None
+    True
+    """
+    unit, sep, specs = (value or "").partition("=")
+    if unit.strip().lower() != "bytes" or not sep:
+        return None
+    ranges = []
+    for spec in specs.split(","):
+        spec = spec.strip()
+        if not spec:
+            continue
+        first, sep, last = spec.partition("-")
+        first, last = first.strip(), last.strip()
+        if not sep or not (first or last) or \
+                not _DIGITS_RE.match(first) or not _DIGITS_RE.match(last):
+            return None
+        if not first:
+            # suffix range: the last N bytes
+            if int(last) == 0:
+                continue
+            start, stop = max(size - int(last), 0), size
+        else:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            stop = min(int(last) + 1, size) if last else size
+        if start < size:
+            ranges.append((start, stop))
+    ranges.sort()
+    merged = []
+    for start, stop in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
 class HTTPFile(ObjectDict):
     """Represents an HTTP file. For backwards compatibility, its instance
     attributes are also accessible as dictionary keys.
@@ -48,7 +48,6 @@ import os
 import re
 
 from twisted.python import log
-from twisted.internet import reactor
 
 _default_locale = "en_US"
 _translations = {}
@@ -187,6 +186,7 @@ def load_gettext_translations(directory, domain):
     _supported_locales = frozenset(list(_translations.keys()) +
                                     [_default_locale])
     _use_gettext = True
+    from twisted.internet import reactor
     reactor.callWhenRunning(log.msg,
                         "Supported locales: %s" % sorted(_supported_locales))
 
@@ -0,0 +1,201 @@
+# coding: utf-8
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Token bucket rate limiting.
+
+A `RateLimiter` gives every key (a client address, a user, a route...) a
+bucket of ``burst`` tokens, refilled at ``rate`` tokens per second; each
+request takes one, and requests finding their bucket empty are answered
+with ``429 Too Many Requests``.  Limiters are used by
+`cyclone.web.rate_limited` on handler methods, or for every request with
+the ``rate_limit`` application setting::
+
+    class LoginHandler(web.RequestHandler):
+        @web.rate_limited(rate=1, burst=5)  # per client address
+        def post(self):
+            ...
+
+    application = web.Application(handlers,
+                                  rate_limit={"rate": 100, "key": "user"})
+
+Responses carry the ``RateLimit-Limit``, ``RateLimit-Remaining`` and
+``RateLimit-Reset`` headers, and a ``Retry-After`` header when limited.
+
+Limiters are meant to be used from the reactor thread only.
+"""
+
+import array
+import collections
+import math
+import time
+
+
+def by_ip(handler):
+    """Keys requests by client address."""
+    return handler.request.remote_ip
+
+
+def by_user(handler):
+    """Keys requests by ``current_user``, which must be hashable (an id),
+    or by client address for anonymous ones."""
+    user = handler.current_user
+    if user is None:
+        return by_ip(handler)
+    return ("user", user)
+
+
+def by_route(handler):
+    """Keys requests by handler class: all the clients of a route share
+    its bucket."""
+    return handler.__class__
+
+
+KEYS = {"ip": by_ip, "user": by_user, "route": by_route}
+
+
+class Limit(collections.namedtuple(
+        "Limit", "allowed limit remaining reset retry_after")):
+    """The outcome of `RateLimiter.consume`.
+
+    ``remaining`` is the number of tokens left, ``reset`` the seconds
+    until the bucket is full again and ``retry_after`` the seconds until
+    it holds enough tokens for a denied request (0 when allowed).
+    """
+    def headers(self):
+        """Returns the rate limit response headers as a dict."""
+        headers = {"RateLimit-Limit": str(self.limit),
+                   "RateLimit-Remaining": str(self.remaining),
+                   "RateLimit-Reset": str(int(math.ceil(self.reset)))}
+        if not self.allowed:
+            headers["Retry-After"] = str(int(math.ceil(self.retry_after)))
+        return headers
+
+
+class RateLimiter(object):
+    """Token buckets of ``burst`` tokens (``rate`` by default), refilled
+    at ``rate`` tokens per second.
+
+    ``key`` is ``"ip"``, ``"user"``, ``"route"`` (see `by_ip`, `by_user`
+    and `by_route`) or a function returning the bucket key of a request
+    handler.
+
+    Buckets are refilled lazily, when used, so idle keys cost nothing but
+    their memory: each takes a dict entry mapping the key to a slot of two
+    arrays of doubles (tokens left and last update).  Every
+    ``sweep_interval`` seconds the slots are scanned for buckets which
+    refilled completely, ``sweep_batch`` slots per call to `consume`, and
+    those are dropped, as a new bucket is the same as a full one.  At most
+    ``max_keys`` buckets are kept: past that, the least recently used ones
+    are dropped, giving their keys a full bucket again.
+    """
+    def __init__(self, rate, burst=None, key="ip", max_keys=1000000,
+                 sweep_interval=60, sweep_batch=5000, clock=None):
+        if not callable(key):
+            if key not in KEYS:
+                raise ValueError("Unknown rate limit key: %r" % key)
+            key = KEYS[key]
+        self.rate = float(rate)
+        self.burst = int(burst if burst is not None else rate)
+        self.key = key
+        self.max_keys = max_keys
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+        self.clock = clock or time.monotonic
+        # key: index in _tokens and _stamps, least recently used first
+        self._slots = collections.OrderedDict()
+        self._tokens = array.array("d")
+        self._stamps = array.array("d")
+        self._keys = []  # the key of each slot, None if free
+        self._free = []
+        self._cursor = None  # the next slot to sweep
+        self._next_sweep = self.clock() + sweep_interval
+        self.allowed = 0
+        self.limited = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __repr__(self):
+        return "<%s rate=%g burst=%d keys=%d>" % (
+            self.__class__.__name__, self.rate, self.burst, len(self._slots))
+
+    def consume(self, key, cost=1):
+        """Takes ``cost`` tokens from the bucket of ``key``, if it holds
+        enough, and returns a `Limit` telling whether it did."""
+        now = self.clock()
+        if now >= self._next_sweep:
+            self._next_sweep = now + self.sweep_interval
+            self._cursor = 0
+        if self._cursor is not None:
+            self._sweep(now)
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._allocate(key)
+            tokens = self.burst
+        else:
+            self._slots.move_to_end(key)
+            tokens = min(self.burst, self._tokens[slot] +
+                         (now - self._stamps[slot]) * self.rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+            self.allowed += 1
+            retry_after = 0
+        else:
+            self.limited += 1
+            retry_after = (cost - tokens) / self.rate
+        self._tokens[slot] = tokens
+        self._stamps[slot] = now
+        return Limit(allowed, self.burst, int(tokens),
+                     (self.burst - tokens) / self.rate, retry_after)
+
+    def _allocate(self, key):
+        if len(self._slots) >= self.max_keys:
+            # drop the least recently used bucket
+            self._free_slot(self._slots.popitem(last=False)[1])
+            self.evictions += 1
+        if self._free:
+            slot = self._free.pop()
+            self._keys[slot] = key
+        else:
+            slot = len(self._tokens)
+            self._tokens.append(0.0)
+            self._stamps.append(0.0)
+            self._keys.append(key)
+        self._slots[key] = slot
+        return slot
+
+    def _free_slot(self, slot):
+        self._keys[slot] = None
+        self._free.append(slot)
+
+    def _sweep(self, now):
+        start = self._cursor
+        end = min(start + self.sweep_batch, len(self._tokens))
+        keys, tokens, stamps = self._keys, self._tokens, self._stamps
+        for slot in range(start, end):
+            key = keys[slot]
+            if key is not None and tokens[slot] + \
+                    (now - stamps[slot]) * self.rate >= self.burst:
+                del self._slots[key]
+                self._free_slot(slot)
+        self._cursor = end if end < len(tokens) else None
+
+    def stats(self):
+        """Returns the limiter counters as a dict."""
+        return dict(rate=self.rate, burst=self.burst,
+                    keys=len(self._slots), max_keys=self.max_keys,
+                    allowed=self.allowed, limited=self.limited,
+                    evictions=self.evictions)
@@ -0,0 +1,187 @@
+# coding: utf-8
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Command-line tool for running cyclone applications. ::
+
+    usage: cyclone run [options] [FILE]
+    Options:
+     -h --help              Show this help.
+     -p --port=PORT         TCP port to listen on [default: 8888]
+     -l --listen=ADDRESS    Interface to listen on [default: 127.0.0.1]
+     -u --unix=PATH         Listen on a unix socket instead of TCP.
+     -a --app=NAME          Application to run, as module.Application
+     -r --reactor=NAME      Reactor to run on [default: default]
+
+    REACTORS:
+      default              Twisted's default for the platform (epoll on Linux)
+      select, poll, epoll, kqueue
+      asyncio              Twisted's asyncio reactor, on the stdlib event loop
+      uvloop               The asyncio reactor on a uvloop event loop
+
+    Examples:
+     $ cyclone run hello.py
+     $ cyclone run --reactor=asyncio --app=hello.Application
+
+``FILE`` is a Python file with a subclass of `cyclone.web.Application`
+(or an instance of it) at module level.
+
+Nothing in cyclone installs a reactor when imported, so applications may
+also pick one themselves with `install_reactor`, before anything imports
+``twisted.internet.reactor``.  On the ``asyncio`` and ``uvloop`` reactors,
+``async def`` handlers run as asyncio Tasks and can await asyncio-native
+libraries (asyncpg, aiohttp, ...) directly, on the reactor thread, along
+with Deferreds.
+"""
+
+import asyncio
+import getopt
+import importlib
+import os
+import runpy
+import sys
+
+from cyclone import web
+from cyclone.util import import_object
+from twisted.python import log
+
+REACTORS = ("default", "select", "poll", "epoll", "kqueue", "asyncio",
+            "uvloop")
+
+
+def install_reactor(name="default"):
+    """Installs the reactor called ``name`` (one of `REACTORS`) and
+    returns it.
+
+    Must be called before ``twisted.internet.reactor`` is imported;
+    Twisted raises ``ReactorAlreadyInstalledError`` otherwise.  ``uvloop``
+    raises ImportError when the module is not installed.
+    """
+    if name not in REACTORS:
+        raise ValueError("Unknown reactor: %r" % name)
+    if name in ("asyncio", "uvloop"):
+        from twisted.internet import asyncioreactor
+        if name == "uvloop":
+            import uvloop
+            loop = uvloop.new_event_loop()
+        else:
+            loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        asyncioreactor.install(loop)
+    elif name != "default":
+        importlib.import_module("twisted.internet.%sreactor" % name).install()
+    from twisted.internet import reactor
+    return reactor
+
+
+def load_application(filename=None, app=None):
+    """Returns the application to run.
+
+    ``app`` is the fully qualified name of a `cyclone.web.Application`
+    subclass or instance; otherwise the first one found at module level of
+    the Python file ``filename`` is used.  Classes are instantiated
+    without arguments.
+    """
+    if app is not None:
+        obj = import_object(app)
+    else:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(filename)))
+        namespace = runpy.run_path(filename, run_name="__cyclone__")
+        for obj in namespace.values():
+            if isinstance(obj, web.Application) or \
+                    (isinstance(obj, type) and
+                     issubclass(obj, web.Application) and
+                     obj is not web.Application):
+                break
+        else:
+            raise ValueError("No cyclone.web.Application in %s" % filename)
+    if isinstance(obj, type):
+        obj = obj()
+    return obj
+
+
+def usage():
+    print("""\
+usage: cyclone run [options] [FILE]
+Options:
+ -h --help              Show this help.
+ -p --port=PORT         TCP port to listen on [default: 8888]
+ -l --listen=ADDRESS    Interface to listen on [default: 127.0.0.1]
+ -u --unix=PATH         Listen on a unix socket instead of TCP.
+ -a --app=NAME          Application to run, as module.Application
+ -r --reactor=NAME      Reactor to run on [default: default]
+
+REACTORS:
+  default              Twisted's default for the platform (epoll on Linux)
+  select, poll, epoll, kqueue
+  asyncio              Twisted's asyncio reactor, on the stdlib event loop
+  uvloop               The asyncio reactor on a uvloop event loop
+
+Examples:
+ $ cyclone run hello.py
+ $ cyclone run --reactor=asyncio --app=hello.Application""")
+    sys.exit(0)
+
+
+def main():
+    port = 8888
+    interface = "127.0.0.1"
+    unix = None
+    app = None
+    reactor_name = "default"
+
+    shortopts = "hp:l:u:a:r:"
+    longopts = ["help", "port=", "listen=", "unix=", "app=", "reactor="]
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], shortopts, longopts)
+    except getopt.GetoptError:
+        usage()
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+        elif o in ("-p", "--port"):
+            port = int(a)
+        elif o in ("-l", "--listen"):
+            interface = a
+        elif o in ("-u", "--unix"):
+            unix = a
+        elif o in ("-a", "--app"):
+            app = a
+        elif o in ("-r", "--reactor"):
+            reactor_name = a
+
+    if (app is None) == (len(args) != 1):
+        usage()
+
+    try:
+        reactor = install_reactor(reactor_name)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    except ImportError as e:
+        print("Cannot install the %s reactor: %s" % (reactor_name, e))
+        sys.exit(1)
+
+    log.startLogging(sys.stdout)
+    application = load_application(args[0] if args else None, app)
+    if unix is not None:
+        reactor.listenUNIX(unix, application)
+    else:
+        reactor.listenTCP(port, application, interface=interface)
+    reactor.run()
+
+
+if __name__ == "__main__":
+    main()
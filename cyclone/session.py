@@ -0,0 +1,314 @@
+# coding: utf-8
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Server-side sessions.
+
+Session data is kept on the server, and the client only holds a random
+session ID in a cookie, so requests neither carry the data nor have it
+verified.  Sessions are enabled with the ``session`` application setting,
+the options of a `SessionStore`, and used through
+`cyclone.web.RequestHandler.session`, a dict::
+
+    class LoginHandler(web.RequestHandler):
+        def post(self):
+            user = self.check_password()
+            self.session.regenerate()
+            self.session["user"] = user.id
+
+    application = web.Application(handlers, session={
+        "ttl": 7 * 86400,
+        "persistent": session.SQLiteStore("/var/lib/app/sessions.db")})
+
+Sessions are kept in memory, in a `cyclone.cache.LRUCache`, and, when a
+``persistent`` store is given, in a `SQLiteStore` or a `DBMStore` too, so
+they survive restarts and the memory tier may only hold the active ones.
+Persistent stores do their I/O in a thread of their own.
+
+A session is loaded before the request's ``prepare``, if the request has
+the session cookie, and saved once when the response is finished, if it
+was changed.  Only changes made through the dict methods are seen: after
+changing a value in place, e.g. a list, call `Session.changed`.  Values
+must be JSON serializable to be persisted.
+"""
+
+import dbm
+import json
+import secrets
+import sqlite3
+import time
+
+from twisted.internet import defer
+
+from cyclone import cache
+from cyclone import executor
+
+
+class Session(dict):
+    """The data of a session, with its ``id``.
+
+    ``id`` is None until a new session is first saved.  ``modified`` is
+    set by the dict methods changing it.
+    """
+    def __init__(self, session_id=None, data=None):
+        dict.__init__(self, data or ())
+        self.id = session_id
+        self.modified = False
+        self.invalidated = False
+        self.previous_ids = []
+
+    def changed(self):
+        """Marks the session as modified, to be saved."""
+        self.modified = True
+
+    def invalidate(self):
+        """Deletes the session, and clears its cookie."""
+        dict.clear(self)
+        self.invalidated = True
+        self.modified = False
+
+    def regenerate(self):
+        """Gives the session a new ID, e.g. on login, so an ID known
+        before (a fixated one) doesn't give access to it."""
+        if self.id is not None:
+            self.previous_ids.append(self.id)
+            self.id = None
+        self.modified = True
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.modified = True
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.modified = True
+
+    def clear(self):
+        dict.clear(self)
+        self.modified = True
+
+    def pop(self, *args):
+        self.modified = True
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self.modified = True
+        return dict.popitem(self)
+
+    def setdefault(self, key, default=None):
+        self.modified = True
+        return dict.setdefault(self, key, default)
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self.modified = True
+
+
+def new_session_id():
+    """Returns a random session ID, 256 bits in URL safe base64."""
+    return secrets.token_urlsafe(32)
+
+
+class SessionStore(object):
+    """Keeps sessions for ``ttl`` seconds after they were last saved.
+
+    Up to ``maxsize`` sessions are kept in memory, the least recently used
+    being evicted first; with a ``persistent`` store, sessions are also
+    written to it and looked up there when not in memory.
+
+    The session ID cookie is named ``cookie_name``.  ``cookie_options``
+    are passed to `cyclone.web.RequestHandler.set_cookie`; they default
+    to ``httponly=True``.  The cookie lasts ``ttl`` seconds, and is set
+    again whenever the session is kept for another ``ttl``: when it is
+    saved, or read back into memory from the persistent store.
+    """
+    def __init__(self, maxsize=10000, ttl=14 * 86400, persistent=None,
+                 cookie_name="session", cookie_options=None, clock=None):
+        self.ttl = ttl
+        self.persistent = persistent
+        self.cookie_name = cookie_name
+        self.cookie_options = cookie_options \
+            if cookie_options is not None else {"httponly": True}
+        self.memory = cache.LRUCache(maxsize, clock=clock)
+
+    def load(self, session_id):
+        """Returns the data of the session ``session_id``, or None.
+
+        Returns a Deferred when the session is looked up in the persistent
+        store.
+        """
+        data = self.memory.get(session_id)
+        if data is not None or self.persistent is None:
+            return data
+        return self.persistent.get(session_id).addCallback(
+            self._loaded, session_id)
+
+    def _loaded(self, data, session_id):
+        if data is not None:
+            self.memory.set(session_id, data, self.ttl)
+        return data
+
+    def save(self, session_id, data):
+        """Saves the data of a session.  Returns a Deferred firing once
+        it is written to the persistent store, if any."""
+        self.memory.set(session_id, data, self.ttl)
+        if self.persistent is None:
+            return defer.succeed(None)
+        return self.persistent.set(session_id, data, self.ttl)
+
+    def delete(self, session_id):
+        """Deletes a session.  Returns a Deferred, like `save`."""
+        self.memory.delete(session_id)
+        if self.persistent is None:
+            return defer.succeed(None)
+        return self.persistent.delete(session_id)
+
+
+class _ThreadedStore(object):
+    # Runs the I/O of a persistent store in a pool of one thread, so the
+    # database is only ever used from that thread.
+    def __init__(self, path, pool=None):
+        self.path = path
+        self.pool = pool or executor.ThreadPool(
+            "sessions", size=1, max_queue=10000)
+        self._db = None
+
+    def __repr__(self):
+        return "<%s %r>" % (self.__class__.__name__, self.path)
+
+    def get(self, session_id):
+        """Returns a Deferred firing with the data of a session, or None."""
+        return self.pool.submit(self._get, session_id, time.time())
+
+    def set(self, session_id, data, ttl):
+        """Saves the data of a session for ``ttl`` seconds."""
+        try:
+            # serialized here, while the data can't change under us
+            data = json.dumps(data)
+        except Exception:
+            return defer.fail()
+        return self.pool.submit(self._set, session_id, data,
+                                time.time() + ttl)
+
+    def delete(self, session_id):
+        """Deletes a session."""
+        return self.pool.submit(self._delete, session_id)
+
+    def purge(self):
+        """Deletes the expired sessions.
+
+        Expired sessions are never returned, but stay on disk until purged;
+        call it periodically, e.g. with a ``LoopingCall``.  Returns a
+        Deferred firing with the number of sessions deleted.
+        """
+        return self.pool.submit(self._purge, time.time())
+
+    def close(self):
+        """Closes the database.  Returns a Deferred."""
+        return self.pool.submit(self._close)
+
+
+class SQLiteStore(_ThreadedStore):
+    """Persists sessions in the ``table`` of the SQLite database at
+    ``path``.
+
+    Its I/O runs in ``pool``, a `cyclone.executor.ThreadPool` which must
+    have a single thread, by default one of its own.
+    """
+    def __init__(self, path, table="sessions", pool=None):
+        _ThreadedStore.__init__(self, path, pool)
+        self.table = table
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS %s (id TEXT PRIMARY KEY, "
+                "data TEXT NOT NULL, expires REAL NOT NULL)" % self.table)
+            self._db.commit()
+        return self._db
+
+    def _get(self, session_id, now):
+        row = self._connect().execute(
+            "SELECT data FROM %s WHERE id = ? AND expires > ?" % self.table,
+            (session_id, now)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def _set(self, session_id, data, expires):
+        db = self._connect()
+        db.execute("INSERT OR REPLACE INTO %s (id, data, expires) "
+                   "VALUES (?, ?, ?)" % self.table,
+                   (session_id, data, expires))
+        db.commit()
+
+    def _delete(self, session_id):
+        db = self._connect()
+        db.execute("DELETE FROM %s WHERE id = ?" % self.table, (session_id,))
+        db.commit()
+
+    def _purge(self, now):
+        db = self._connect()
+        count = db.execute("DELETE FROM %s WHERE expires <= ?" % self.table,
+                           (now,)).rowcount
+        db.commit()
+        return count
+
+    def _close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class DBMStore(_ThreadedStore):
+    """Persists sessions in the `dbm` database at ``path``, created if
+    missing, in whichever format `dbm.open` picks.
+
+    Its I/O runs in ``pool``, like that of `SQLiteStore`.
+    """
+    def _connect(self):
+        if self._db is None:
+            self._db = dbm.open(self.path, "c")
+        return self._db
+
+    def _get(self, session_id, now):
+        value = self._connect().get(session_id)
+        if value is None:
+            return None
+        expires, data = json.loads(value)
+        return data if expires > now else None
+
+    def _set(self, session_id, data, expires):
+        db = self._connect()
+        db[session_id] = '[%r, %s]' % (expires, data)
+        if hasattr(db, "sync"):
+            db.sync()
+
+    def _delete(self, session_id):
+        db = self._connect()
+        try:
+            del db[session_id]
+        except KeyError:
+            pass
+
+    def _purge(self, now):
+        db = self._connect()
+        expired = [key for key in db.keys()
+                   if json.loads(db[key])[0] <= now]
+        for key in expired:
+            del db[key]
+        return len(expired)
+
+    def _close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
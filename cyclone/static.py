@@ -0,0 +1,366 @@
+# coding: utf-8
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Helpers for static file trees served by `cyclone.web.StaticFileHandler`:
+build-time precompression, version manifests and an in-memory file
+cache. ::
+
+    usage: python -m cyclone.static [options] precompress|manifest PATH
+    Options:
+     -h --help              Show this help.
+     -f --force             Recompress files even if they are up to date.
+     -m --min-size=BYTES    Skip files smaller than this [default: 1024]
+     -o --output=FILE       Manifest file [default: static-manifest.json]
+
+``precompress`` writes a ``.gz`` sibling (and a ``.br`` one when the
+``brotli`` module is installed) next to every compressible file, at the
+maximum compression level.  The static handler sends those instead of the
+original when it is configured with ``precompressed=True`` and the client
+accepts the encoding, so the same asset is not compressed again on every
+request.
+
+``manifest`` writes the content hash of every file to a JSON file, which
+the ``static_manifest`` application setting loads at startup so that
+`cyclone.web.RequestHandler.static_url` never has to hash files while
+serving requests.
+
+`StaticFileCache` keeps small files and their response metadata in memory
+so hot assets are served without touching the filesystem; see the
+``static_cache_size`` application setting.
+"""
+
+import collections
+from concurrent import futures
+import getopt
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import sys
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+#: Sibling file extension for each precompressed content coding.
+SIDECAR_EXTENSIONS = {"br": ".br", "gzip": ".gz"}
+
+_COMPRESSIBLE_TYPES = set([
+    "application/javascript", "application/x-javascript", "application/json",
+    "application/xml", "application/xhtml+xml", "application/atom+xml",
+    "application/rss+xml", "application/wasm", "image/svg+xml",
+    "image/x-icon", "image/vnd.microsoft.icon", "font/ttf", "font/otf",
+    "application/vnd.ms-fontobject"])
+
+
+def is_compressible(path):
+    """Returns True if the file's mime type is worth compressing."""
+    mime_type, encoding = mimetypes.guess_type(path)
+    if mime_type is None or encoding is not None:
+        return False
+    return mime_type.startswith("text/") or mime_type in _COMPRESSIBLE_TYPES
+
+
+def _compress(encoding, data):
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    # mtime=0 keeps the output reproducible across builds
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def precompress_file(path, encodings=None, force=False):
+    """Writes precompressed siblings of ``path``.
+
+    Siblings which would not be smaller than the original are not kept.
+    A sibling is considered up to date when its modification time matches
+    the original's; it is rewritten otherwise, or always with ``force``.
+    Returns the list of sidecar paths written.
+    """
+    if encodings is None:
+        encodings = available_encodings()
+    st = os.stat(path)
+    data = None
+    written = []
+    for encoding in encodings:
+        sidecar = path + SIDECAR_EXTENSIONS[encoding]
+        if not force:
+            try:
+                if os.stat(sidecar).st_mtime == st.st_mtime:
+                    continue
+            except OSError:
+                pass
+        if data is None:
+            with open(path, "rb") as f:
+                data = f.read()
+        compressed = _compress(encoding, data)
+        if len(compressed) >= len(data):
+            if os.path.exists(sidecar):
+                os.unlink(sidecar)
+            continue
+        tmp = sidecar + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(compressed)
+        os.utime(tmp, (st.st_atime, st.st_mtime))
+        os.replace(tmp, sidecar)
+        written.append(sidecar)
+    return written
+
+
+def precompress(root, min_size=1024, force=False):
+    """Precompresses every compressible file under ``root``.
+
+    Returns the list of sidecar paths written.
+    """
+    encodings = available_encodings()
+    sidecar_exts = tuple(SIDECAR_EXTENSIONS.values())
+    written = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            if name.endswith(sidecar_exts):
+                continue
+            path = os.path.join(dirpath, name)
+            if not is_compressible(path) or os.path.islink(path) or \
+                    os.path.getsize(path) < min_size:
+                continue
+            written.extend(precompress_file(path, encodings, force=force))
+    return written
+
+
+class StaticFile(object):
+    """What `cyclone.web.StaticFileHandler` knows about a file on disk.
+
+    ``last_modified`` and ``etag`` are the rendered header values, and
+    ``content`` holds the whole file, or is ``None`` when it is read (or
+    streamed) from disk on each request.  ``sidecars`` maps content
+    codings to the path of the usable precompressed sibling, or ``None``,
+    once looked up.
+    """
+    __slots__ = ("abspath", "stat_result", "mime_type", "modified",
+                 "last_modified", "etag", "content", "checked", "sidecars")
+
+    def __init__(self, abspath, stat_result, mime_type, modified,
+                 last_modified, etag, content=None):
+        self.abspath = abspath
+        self.stat_result = stat_result
+        self.mime_type = mime_type
+        self.modified = modified
+        self.last_modified = last_modified
+        self.etag = etag
+        self.content = content
+        self.checked = None
+        self.sidecars = {}
+
+
+class StaticFileCache(object):
+    """An LRU cache of `StaticFile` objects, keyed by absolute path.
+
+    Only files with their ``content`` loaded and no bigger than
+    ``max_file_size`` are kept, up to ``max_bytes`` of content in total;
+    the least recently used files are evicted first.  A cached file is
+    checked with ``os.stat`` at most once every ``check_interval``
+    seconds, and dropped if its modification time, size or inode changed.
+
+    The cache is meant to be shared by every static handler of the
+    process (the ``static_cache_size`` application setting creates one),
+    and is not thread safe: use it from the reactor thread only.
+    ``hits``, ``misses`` and ``evictions`` count what it has been doing.
+    """
+    def __init__(self, max_bytes=16 * 1024 * 1024, max_file_size=None,
+                 check_interval=2.0, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        if max_file_size is None:
+            max_file_size = max_bytes // 16
+        self.max_file_size = min(max_file_size, max_bytes)
+        self.check_interval = check_interval
+        self.clock = clock
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._files = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._files)
+
+    def __contains__(self, abspath):
+        return abspath in self._files
+
+    def get(self, abspath):
+        """Returns the cached `StaticFile` for ``abspath``, or ``None``."""
+        entry = self._files.get(abspath)
+        if entry is None:
+            self.misses += 1
+            return None
+        now = self.clock()
+        if now - entry.checked >= self.check_interval:
+            try:
+                st = os.stat(abspath)
+            except OSError:
+                st = None
+            old = entry.stat_result
+            if st is None or (st.st_mtime, st.st_size, st.st_ino) != \
+                    (old.st_mtime, old.st_size, old.st_ino):
+                self.remove(abspath)
+                self.misses += 1
+                return None
+            entry.checked = now
+            # precompressed siblings are looked up again with the file
+            entry.sidecars.clear()
+        self._files.move_to_end(abspath)
+        self.hits += 1
+        return entry
+
+    def put(self, entry):
+        """Adds ``entry`` to the cache, evicting older files as needed.
+
+        Returns False if the file can not be cached (no content loaded,
+        or too big).
+        """
+        if entry.content is None or len(entry.content) > self.max_file_size:
+            return False
+        self.remove(entry.abspath)
+        entry.checked = self.clock()
+        self._files[entry.abspath] = entry
+        self.size += len(entry.content)
+        while self.size > self.max_bytes:
+            abspath, evicted = self._files.popitem(last=False)
+            self.size -= len(evicted.content)
+            self.evictions += 1
+        return True
+
+    def remove(self, abspath):
+        entry = self._files.pop(abspath, None)
+        if entry is not None:
+            self.size -= len(entry.content)
+
+    def clear(self):
+        self._files.clear()
+        self.size = 0
+
+    def stats(self):
+        """Returns the cache counters and current size as a dict."""
+        return dict(hits=self.hits, misses=self.misses,
+                    evictions=self.evictions, files=len(self._files),
+                    size=self.size, max_bytes=self.max_bytes)
+
+
+def file_hash(path):
+    """Returns the md5 hex digest of a file's content."""
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(65536), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def build_manifest(root, max_workers=None):
+    """Hashes every file under ``root`` with a pool of threads.
+
+    Returns a ``{relative path: md5 hex digest}`` dict, paths being
+    ``/``-separated as in static URLs.  Precompressed siblings are left
+    out.
+    """
+    sidecar_exts = tuple(SIDECAR_EXTENSIONS.values())
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            if not name.endswith(sidecar_exts):
+                paths.append(os.path.join(dirpath, name))
+    with futures.ThreadPoolExecutor(max_workers) as pool:
+        hashes = pool.map(file_hash, paths)
+        return dict((os.path.relpath(path, root).replace(os.path.sep, "/"),
+                     hsh) for path, hsh in zip(paths, hashes))
+
+
+def write_manifest(manifest, filename):
+    """Writes a manifest from `build_manifest` as JSON."""
+    tmp = filename + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, filename)
+
+
+def load_manifest(filename):
+    """Reads a manifest written by `write_manifest`."""
+    with open(filename) as f:
+        return json.load(f)
+
+
+def available_encodings():
+    """Returns the content codings we can precompress to."""
+    if brotli is not None:
+        return ["br", "gzip"]
+    return ["gzip"]
+
+
+def usage():
+    print("""\
+usage: python -m cyclone.static [options] precompress|manifest PATH
+Options:
+ -h --help              Show this help.
+ -f --force             Recompress files even if they are up to date.
+ -m --min-size=BYTES    Skip files smaller than this [default: 1024]
+ -o --output=FILE       Manifest file [default: static-manifest.json]""")
+    sys.exit(0)
+
+
+def main():
+    force = False
+    min_size = 1024
+    output = "static-manifest.json"
+
+    shortopts = "hfm:o:"
+    longopts = ["help", "force", "min-size=", "output="]
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], shortopts, longopts)
+    except getopt.GetoptError:
+        usage()
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+        elif o in ("-f", "--force"):
+            force = True
+        elif o in ("-m", "--min-size"):
+            min_size = int(a)
+        elif o in ("-o", "--output"):
+            output = a
+
+    if len(args) != 2:
+        usage()
+
+    command, path = args
+    if not os.path.isdir(path):
+        print("No such directory: %s" % path)
+        sys.exit(1)
+
+    if command == "precompress":
+        written = precompress(path, min_size=min_size, force=force)
+        print("%d precompressed files written" % len(written))
+    elif command == "manifest":
+        manifest = build_manifest(path)
+        write_manifest(manifest, output)
+        print("%d files hashed into %s" % (len(manifest), output))
+    else:
+        print("Unknown command: %s" % command)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -84,6 +84,16 @@ hand, but instead use the `render` and `render_string` methods of
 `cyclone.web.RequestHandler`, which load templates automatically based
 on the ``template_path`` `Application` setting.
 
+Expressions may evaluate to Deferreds, in which case `Template.generate`
+returns a Deferred firing with the output once they all fired.  Templates
+are compiled into plain functions, and expressions following a Deferred
+are evaluated without waiting for it; once a template met a Deferred, it
+is also compiled into a generator waiting for each Deferred before
+evaluating the next expression, used by its later renders.  Templates
+created with ``asynchronous=True`` (or by a loader created with it),
+templates with ``{% try %}`` blocks, and streamed renders always use the
+generator.
+
 Syntax Reference
 ----------------
 
@@ -143,6 +153,13 @@ with ``{# ... #}``.
     This statement is allowed only inside ``{% block %}`` statement.
     Inserts value of the appropriate block from the parent template.
 
+``{% flush %}``
+    Sends the output rendered so far to the client, when the template is
+    rendered with `cyclone.web.RequestHandler.render_stream` (or
+    `Template.stream`), e.g. after the ``<head>`` of a page, so the
+    browser fetches its resources while the rest is rendered.  Ignored
+    otherwise, and within ``apply`` blocks.
+
 ``{% for *var* in *expr* %}...{% end %}``
     Same as the python ``for`` statement.  ``{% break %}`` and
     ``{% continue %}`` may be used inside the loop.
@@ -187,6 +204,7 @@ with ``{# ... #}``.
 import collections
 import contextlib
 import datetime
+import functools
 import linecache
 import os.path
 import posixpath
@@ -194,6 +212,7 @@ import re
 import sys
 import threading
 import traceback
+import types
 from io import StringIO
 from cyclone import escape
 from cyclone.util import ObjectDict
@@ -202,6 +221,9 @@ from cyclone.util import unicode_type
 
 from twisted.python.failure import Failure
 from twisted.internet.defer import Deferred
+from twisted.internet.defer import FirstError
+from twisted.internet.defer import gatherResults
+from twisted.internet.defer import inlineCallbacks
 
 _DEFAULT_AUTOESCAPE = "xhtml_escape"
 _UNSET = object()
@@ -214,7 +236,8 @@ class Template(object):
     the template from variables with generate().
     """
     def __init__(self, template_string, name="<string>", loader=None,
-                 compress_whitespace=None, autoescape=_UNSET):
+                 compress_whitespace=None, autoescape=_UNSET,
+                 asynchronous=None):
         self.name = name
         if compress_whitespace is None:
             compress_whitespace = name.endswith(".html") or \
@@ -225,29 +248,12 @@ class Template(object):
             self.autoescape = loader.autoescape
         else:
             self.autoescape = _DEFAULT_AUTOESCAPE
+        if asynchronous is None:
+            asynchronous = loader.asynchronous if loader else False
         self.namespace = loader.namespace if loader else {}
-        reader = _TemplateReader(name, escape.native_str(template_string))
-        try:
-            self.file = _File(self, _parse(reader, self))
-            self.code = self._generate_python(loader, compress_whitespace)
-        except ParseError as e:
-            raise TemplateError("Error parsing template %s, line %d: %s" %(name, reader.line, str(e)))
-
         self.loader = loader
-        try:
-            # Under python2.5, the fake filename used here must match
-            # the module name used in __name__ below.
-            self.compiled = compile(
-                escape.to_unicode(self.code),
-                "%s.generated.py" % self.name.replace('.', '_'),
-                "exec")
-        except Exception:
-            raise TemplateError("Error compiling template " + name + ":\n" +
-                                _format_code(self.code).rstrip())
-
-    def generate(self, **kwargs):
-        """Generate this template with the given arguments."""
-        namespace = {
+        self.compress_whitespace = compress_whitespace
+        self._namespace = {
             "escape": escape.xhtml_escape,
             "xhtml_escape": escape.xhtml_escape,
             "url_escape": escape.url_escape,
@@ -255,35 +261,110 @@ class Template(object):
             "squeeze": escape.squeeze,
             "linkify": escape.linkify,
             "datetime": datetime,
-            "_utf8": escape.utf8,  # for internal use
-            "_string_types": (unicode_type, bytes_type),
+            "Deferred": Deferred,
+            "_to_str": _to_str,  # for internal use
+            "_join": _join,
+            "_apply": _apply,
+            "_flush": _skip_flush,
             # __name__ and __loader__ allow the traceback mechanism to find
-            # the generated source code.
+            # the generated source code, should linecache be cleared.
             "__name__": self.name.replace('.', '_'),
             "__loader__": ObjectDict(get_source=lambda name: self.code),
         }
+        reader = _TemplateReader(name, escape.native_str(template_string))
+        try:
+            self.file = _File(self, _parse(reader, self))
+            self.asynchronous = asynchronous
+            compiled = self._compile(asynchronous)
+            if not asynchronous and self._catches:
+                # {% try %} blocks must see the failures of the Deferreds
+                # in them, which a synchronous render doesn't wait for.
+                self.asynchronous = asynchronous = True
+                compiled = self._compile(True)
+            self.code, self.compiled, self._execute_code = compiled
+            # The generator variant of synchronous templates is compiled
+            # when they first meet a Deferred.
+            self._async_code = self._execute_code if asynchronous else None
+        except ParseError as e:
+            raise TemplateError("Error parsing template %s, line %d: %s" %(name, reader.line, str(e)))
+
+    def _compile(self, asynchronous):
+        # Returns the source, the compiled module and the code of its
+        # _execute function, plain or a generator waiting for Deferreds.
+        code = self._generate_python(self.loader, self.compress_whitespace,
+                                     asynchronous)
+        filename = "%s%s.generated.py" % (
+            self.name.replace('.', '_'),
+            ".async" if asynchronous and not self.asynchronous else "")
+        try:
+            compiled = compile(escape.to_unicode(code), filename, "exec")
+        except Exception:
+            raise TemplateError("Error compiling template " + self.name +
+                                ":\n" + _format_code(code).rstrip())
+        # The module only defines _execute: keep the code of that function,
+        # to be bound to the namespace of each call.
+        module = {}
+        exec(compiled, module)
+        self.modules = frozenset(self._modules)
+        # Register the source once, replacing that of a previous template
+        # of the same name; entries without an mtime are never invalidated.
+        linecache.cache[filename] = (len(code), None,
+                                     code.splitlines(True), filename)
+        return code, compiled, module["_execute"].__code__
+
+    def generate(self, **kwargs):
+        """Generate this template with the given arguments.
+
+        Returns the output, as bytes, or a Deferred firing with it if
+        expressions evaluated to Deferreds which have not fired yet.
+        """
+        return self._generate(kwargs, _skip_flush)
+
+    def stream(self, write, **kwargs):
+        """Generate this template, passing its output to ``write`` as it
+        is rendered.
+
+        ``write`` is called with the output rendered so far, as bytes, at
+        each ``{% flush %}``.  Returns the rest of the output like
+        `generate`.  Streamed renders always use the generator, so that
+        the output flushed never waits for Deferreds.
+        """
+        return self._generate(kwargs, functools.partial(_flush, write))
+
+    def _generate(self, kwargs, flush):
+        namespace = self._namespace.copy()
         namespace.update(self.namespace)
         namespace.update(kwargs)
-        exec(self.compiled, namespace, namespace)
-        execute = namespace["_execute"]
-        # Clear the traceback module's cache of source data now that
-        # we've generated a new template (mainly for this module's
-        # unittests, where different tests reuse the same name).
-        linecache.clearcache()
+        namespace["_flush"] = flush
         try:
-            rv = execute()
-            assert isinstance(rv, Deferred), rv
-            if hasattr(rv, "result"):
+            if self._async_code is not None or flush is not _skip_flush:
+                rv = _render(self._get_async_code(), namespace)
+            else:
+                rv = types.FunctionType(self._execute_code, namespace)()
+                if isinstance(rv, Deferred):
+                    # The render met a Deferred, and evaluated the
+                    # expressions following it without waiting: later
+                    # calls use the generator, which waits for each one.
+                    self._get_async_code()
+            if isinstance(rv, Deferred) and hasattr(rv, "result"):
                 # Deferred is already resolved.
                 # Return the result immidiatly to avoid compatibility problems.
-                rv = rv.result
-                if isinstance(rv, Failure):
-                    rv.raiseException()
+                result = rv.result
+                if isinstance(result, Failure):
+                    # raised here, not an unhandled error of the Deferred
+                    rv.addErrback(lambda failure: None)
+                    result.raiseException()
+                rv = result
             return rv
         except Exception:
             raise TemplateError("Error executing template " + self.name + ":\n" + _format_code(traceback.format_exception(*sys.exc_info())))
 
-    def _generate_python(self, loader, compress_whitespace):
+    def _get_async_code(self):
+        if self._async_code is None:
+            self._async_code = self._compile(True)[2]
+        return self._async_code
+
+    def _generate_python(self, loader, compress_whitespace, asynchronous):
         buffer = StringIO()
         try:
             # named_blocks maps from names to _NamedBlock objects
@@ -296,8 +377,11 @@ class Template(object):
             self.file.find_named_blocks(loader, named_blocks)
             writer = _CodeWriter(buffer, named_blocks, loader,
                                  ancestors[0].template,
-                                 compress_whitespace)
+                                 compress_whitespace, asynchronous)
             ancestors[0].generate(writer)
+            # the names of the UI modules it renders
+            self._modules = writer.modules
+            self._catches = writer.catches
             return buffer.getvalue()
         finally:
             buffer.close()
@@ -314,9 +398,75 @@ class Template(object):
         return ancestors
 
 
+@inlineCallbacks
+def _render(code, namespace):
+    # Runs the _execute code of a template with the given globals.
+    return (yield from types.FunctionType(code, namespace)())
+
+
+def _to_str(value, autoescape):
+    # The output of an expression whose value is not a str.  Bytes which
+    # are not UTF-8 are kept as they are, as surrogates until encoded.
+    if isinstance(value, bytes_type):
+        value = value.decode("utf-8", "surrogateescape")
+    elif not isinstance(value, unicode_type):
+        if isinstance(value, Deferred):
+            # A synchronous render met a Deferred: it is appended to the
+            # buffer, and replaced by its output in _join.
+            return value.addCallback(_to_str, autoescape)
+        value = str(value)
+    if autoescape is not None:
+        value = autoescape(value)
+    return value
+
+
+def _apply(function, value):
+    # Applies the function of an apply block to its output, which is a
+    # Deferred if it holds Deferreds, in synchronous renders.
+    if isinstance(value, Deferred):
+        return value.addCallback(function)
+    return function(value)
+
+
+def _skip_flush(buffer):
+    pass
+
+
+def _flush(write, buffer):
+    # Writes the buffer of a streamed render.
+    if buffer:
+        write(_join(buffer))
+        del buffer[:]
+
+
+def _join(buffer, encode=True):
+    # Joins the buffer of a render holding bytes, which the functions of
+    # apply blocks or autoescape may return, or Deferreds: it returns a
+    # Deferred then, firing once they all fired.
+    def join(results):
+        results = iter(results)
+        text = "".join(
+            _text(next(results) if isinstance(part, Deferred) else part)
+            for part in buffer)
+        return text.encode("utf-8", "surrogateescape") if encode else text
+    deferreds = [part for part in buffer if isinstance(part, Deferred)]
+    if not deferreds:
+        return join(())
+    return gatherResults(deferreds, consumeErrors=True).addCallbacks(
+        join, lambda failure: failure.value.subFailure
+        if failure.check(FirstError) else failure)
+
+
+def _text(part):
+    if isinstance(part, unicode_type):
+        return part
+    return part.decode("utf-8", "surrogateescape")
+
+
 class BaseLoader(object):
     """Base class for template loaders."""
-    def __init__(self, autoescape=_DEFAULT_AUTOESCAPE, namespace=None):
+    def __init__(self, autoescape=_DEFAULT_AUTOESCAPE, namespace=None,
+                 asynchronous=False):
         """Creates a template loader.
 
         root_directory may be the empty string if this loader does not
@@ -324,9 +474,12 @@ class BaseLoader(object):
 
         autoescape must be either None or a string naming a function
         in the template namespace, such as "xhtml_escape".
+
+        asynchronous is passed to the templates it loads.
         """
         self.autoescape = autoescape
         self.namespace = namespace or {}
+        self.asynchronous = asynchronous
         self.templates = {}
         # self.lock protects self.templates.  It's a reentrant lock
         # because templates may load other templates via `include` or
@@ -416,6 +569,8 @@ class _Node(object):
             child.find_named_blocks(loader, named_blocks)
 
     def maybe_deferred(self, varName, writer):
+        if not writer.asynchronous:
+            return
         writer.write_line("while isinstance(%s, Deferred):" % varName, self.line)
         with writer.indent():
             writer.write_line("%s = yield %s" % (varName, varName), self.line)
@@ -429,19 +584,18 @@ class _File(_Node):
 
     def generate(self, writer):
         _write_line = lambda txt: writer.write_line(txt, self.line)
-        _write_line("from twisted.internet.defer import inlineCallbacks, returnValue, Deferred")
-        _write_line("")
-        _write_line("@inlineCallbacks")
         _write_line("def _execute():")
         with writer.indent():
-            # A workaround for the function to be considered a generator
-            _write_line("if 0:")
-            with writer.indent():
-                _write_line("yield None")
+            if writer.asynchronous:
+                # A workaround for the function to be considered a generator
+                _write_line("if 0:")
+                with writer.indent():
+                    _write_line("yield None")
             _write_line("_buffer = []")
             _write_line("_append = _buffer.append")
             self.body.generate(writer)
-            _write_line("returnValue(_utf8('').join(_buffer))")
+            # The output is built in str, and encoded once.
+            writer.write_return(True, self.line)
 
     def each_child(self):
         return (self.body,)
@@ -542,12 +696,23 @@ class _ApplyBlock(_Node):
         method_name = "apply%d" % writer.apply_counter
         writer.apply_counter += 1
         writer.write_line("def %s():" % method_name, self.line)
+        writer.apply_depth += 1
         with writer.indent():
+            if writer.asynchronous:
+                # A generator too, delegated to by the render
+                writer.write_line("if 0: yield None", self.line)
             writer.write_line("_buffer = []", self.line)
             writer.write_line("_append = _buffer.append", self.line)
             self.body.generate(writer)
-            writer.write_line("return _utf8('').join(_buffer)", self.line)
-        writer.write_line("_append(_utf8(%s(%s())))" % (self.method, method_name), self.line)
+            writer.write_return(False, self.line)
+        writer.apply_depth -= 1
+        if writer.asynchronous:
+            writer.write_line("_tmp = yield from %s()" % method_name,
+                              self.line)
+            writer.write_line("_append(%s(_tmp))" % self.method, self.line)
+        else:
+            writer.write_line("_append(_apply(%s, %s()))" %
+                              (self.method, method_name), self.line)
 
 
 class _ControlBlock(_Node):
@@ -560,6 +725,8 @@ class _ControlBlock(_Node):
         return (self.body,)
 
     def generate(self, writer):
+        if self.statement.startswith("try"):
+            writer.catches = True
         writer.write_line("%s:" % self.statement, self.line)
         with writer.indent():
             self.body.generate(writer)
@@ -594,23 +761,37 @@ class _Expression(_Node):
         self.raw = raw
 
     def generate(self, writer):
+        autoescape = writer.current_template.autoescape
+        if self.raw:
+            autoescape = None
         writer.write_line("_tmp = %s" % self.expression, self.line)
         self.maybe_deferred("_tmp", writer)
-        writer.write_line("if isinstance(_tmp, _string_types):"
-                          " _tmp = _utf8(_tmp)", self.line)
-        writer.write_line("else: _tmp = _utf8(str(_tmp))", self.line)
-        if not self.raw and writer.current_template.autoescape is not None:
-            # In python3 functions like xhtml_escape return unicode,
-            # so we have to convert to utf8 again.
-            writer.write_line("_tmp = _utf8(%s(_tmp))" %
-                              writer.current_template.autoescape, self.line)
-        writer.write_line("_append(_tmp)", self.line)
+        writer.write_line("if isinstance(_tmp, str): _append(%s)" %
+                          ("_tmp" if autoescape is None
+                           else "%s(_tmp)" % autoescape), self.line)
+        # Deferreds too, in synchronous renders.
+        writer.write_line("else: _append(_to_str(_tmp, %s))" % autoescape,
+                          self.line)
 
 
 class _Module(_Expression):
     def __init__(self, expression, line):
         super(_Module, self).__init__("_modules." + expression, line,
                                       raw=True)
+        self.name = re.match(r"\w*", expression).group(0)
+
+    def generate(self, writer):
+        writer.modules.add(self.name)
+        _Expression.generate(self, writer)
+
+
+class _Flush(_Node):
+    def __init__(self, line):
+        self.line = line
+
+    def generate(self, writer):
+        if not writer.apply_depth:
+            writer.write_line("_flush(_buffer)", self.line)
 
 
 class _Text(_Node):
@@ -629,7 +810,7 @@ class _Text(_Node):
             value = re.sub(r"(\s*\n\s*)", "\n", value)
 
         if value:
-            writer.write_line('_append(%r)' % escape.utf8(value), self.line)
+            writer.write_text(value, self.line)
 
 
 class ParseError(Exception):
@@ -643,15 +824,20 @@ class TemplateError(Exception):
 
 class _CodeWriter(object):
     def __init__(self, file, named_blocks, loader, current_template,
-                 compress_whitespace):
+                 compress_whitespace, asynchronous=False):
         self.file = file
+        self.asynchronous = asynchronous
         self.named_blocks = named_blocks
         self.loader = loader
         self.current_template = current_template
         self.compress_whitespace = compress_whitespace
         self.apply_counter = 0
+        self.apply_depth = 0
+        self.modules = set()
+        self.catches = False  # whether it has {% try %} blocks
         self.include_stack = []
         self._indent = 0
+        self._text = None
 
     def indent_size(self):
         return self._indent
@@ -675,14 +861,50 @@ class _CodeWriter(object):
             self.current_template = self.include_stack.pop()[0]
 
     def write_line(self, line, line_number, indent=None):
+        self._write_text()
         if indent is None:
             indent = self._indent
+        self.file.write("    " * indent + line +
+                        self._line_comment(line_number) + "\n")
+
+    def write_text(self, text, line_number):
+        # Adjacent text, e.g. around a block or an include, is appended
+        # at once.
+        if self._text is not None and self._text[2] == self._indent:
+            self._text[0] += text
+        else:
+            self._write_text()
+            self._text = [text, self._line_comment(line_number),
+                          self._indent]
+
+    def _write_text(self):
+        if self._text is not None:
+            text, line_comment, indent = self._text
+            self._text = None
+            self.file.write("    " * indent + "_append(%r)" % text +
+                            line_comment + "\n")
+
+    def write_return(self, encode, line_number):
+        # The buffer holds str, unless a function of an apply block or
+        # autoescape returned bytes, or an expression gave a Deferred.
+        if encode:
+            self.write_line("try: return ''.join(_buffer)"
+                            ".encode('utf-8', 'surrogateescape')",
+                            line_number)
+            self.write_line("except TypeError: return _join(_buffer)",
+                            line_number)
+        else:
+            self.write_line("try: return ''.join(_buffer)", line_number)
+            self.write_line("except TypeError: return _join(_buffer, False)",
+                            line_number)
+
+    def _line_comment(self, line_number):
         line_comment = '  # %s:%d' % (self.current_template.name, line_number)
         if self.include_stack:
             ancestors = ["%s:%d" % (tmpl.name, lineno)
                          for (tmpl, lineno) in self.include_stack]
             line_comment += ' (via %s)' % ', '.join(reversed(ancestors))
-        self.file.write("    " * indent + line + line_comment + "\n")
+        return line_comment
 
 
 class _TemplateReader(object):
@@ -852,7 +1074,8 @@ def _parse(reader, template, in_block=None, in_loop=None):
             return body
 
         elif operator in ("extends", "include", "set", "import", "from",
-                          "comment", "autoescape", "raw", "module", "super"):
+                          "comment", "autoescape", "raw", "module", "super",
+                          "flush"):
             if operator == "comment":
                 continue
             if operator == "extends":
@@ -886,6 +1109,8 @@ def _parse(reader, template, in_block=None, in_loop=None):
                 block = _Expression(suffix, line, raw=True)
             elif operator == "module":
                 block = _Module(suffix, line)
+            elif operator == "flush":
+                block = _Flush(line)
             elif operator == "super":
                 if in_block != "block":
                     raise ParseError("'super' block cannot be attached to 'block' block")
@@ -26,13 +26,14 @@ class DecodingSimpleCookie(SimpleCookie):
     def __init__(self, app, *args, **kwargs):
         self.app = app
 
-    def get_secure_cookie(self, name, value=None, max_age_days=31):
+    def get_secure_cookie(self, name, value=None, max_age_days=31,
+                          min_version=None):
 
         if value is None and name in self:
             value = self[name].value
         return decode_signed_value(
             self.app.settings["cookie_secret"],
-            name, value, max_age_days=max_age_days)
+            name, value, max_age_days=max_age_days, min_version=min_version)
 
 
 class Client(object):
@@ -97,7 +98,7 @@ class Client(object):
         if not connection:
             connection = HTTPConnection()
             connection.xheaders = False
-            kwargs['connection'] = connection
+        kwargs['connection'] = connection
         connection.factory = self.app
         cookie_value = self.cookies.output(header="")
         if cookie_value.strip():
@@ -0,0 +1,95 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from twisted.internet import defer
+from twisted.internet import task
+from twisted.trial import unittest
+
+from cyclone import admission
+
+
+class FakeRequest(object):
+    def __init__(self):
+        self.finished = defer.Deferred()
+
+    def notifyFinish(self):
+        return self.finished
+
+
+class AdmissionControllerTest(unittest.TestCase):
+    def test_in_flight(self):
+        controller = admission.AdmissionController(max_in_flight=2)
+        requests = [FakeRequest() for i in range(3)]
+        self.assertTrue(controller.admit(requests[0]))
+        self.assertTrue(controller.admit(requests[1]))
+        self.assertFalse(controller.admit(requests[2]))
+        requests[0].finished.callback(None)
+        self.assertTrue(controller.admit(requests[2]))
+        stats = controller.stats()
+        self.assertEqual((stats["in_flight"], stats["admitted"],
+                          stats["shed_in_flight"]), (2, 3, 1))
+
+    def test_priorities(self):
+        controller = admission.AdmissionController(max_in_flight=4,
+                                                   low_priority_share=0.5)
+        self.assertTrue(controller.admit(FakeRequest(), admission.LOW))
+        self.assertTrue(controller.admit(FakeRequest(), admission.LOW))
+        self.assertFalse(controller.admit(FakeRequest(), admission.LOW))
+        self.assertTrue(controller.admit(FakeRequest()))
+        self.assertTrue(controller.admit(FakeRequest()))
+        self.assertFalse(controller.admit(FakeRequest()))
+        self.assertTrue(controller.admit(FakeRequest(), admission.CRITICAL))
+        self.assertEqual(controller.stats()["in_flight"], 5)
+
+    def test_finished_result(self):
+        controller = admission.AdmissionController()
+        request = FakeRequest()
+        controller.admit(request)
+        request.finished.callback("connection lost")
+        self.assertEqual(self.successResultOf(request.finished),
+                         "connection lost")
+        self.assertEqual(controller.in_flight, 0)
+
+    def test_overload(self):
+        clock = task.Clock()
+        controller = admission.AdmissionController(
+            target_delay=0.05, interval=0.1, sample_interval=0.01,
+            reactor=clock)
+        controller.start()
+        self.addCleanup(controller.stop)
+        clock.pump([0.01] * 20)
+        self.assertFalse(controller.overloaded)
+        # a single stall is not overload
+        clock.advance(0.2)
+        clock.pump([0.01] * 2)
+        self.assertFalse(controller.overloaded)
+        # but every call being 60ms late for a whole interval is
+        clock.pump([0.07] * 4)
+        self.assertTrue(controller.overloaded)
+        self.assertFalse(controller.admit(FakeRequest()))
+        self.assertTrue(controller.admit(FakeRequest(), admission.CRITICAL))
+        clock.pump([0.01] * 11)
+        self.assertFalse(controller.overloaded)
+        self.assertTrue(controller.admit(FakeRequest()))
+        stats = controller.stats()
+        self.assertEqual((stats["shed"], stats["shed_delay"]), (1, 1))
+
+    def test_stop(self):
+        clock = task.Clock()
+        controller = admission.AdmissionController(target_delay=0.05,
+                                                   reactor=clock)
+        controller.start()
+        controller.stop()
+        self.assertEqual(clock.getDelayedCalls(), [])
+        admission.AdmissionController(reactor=clock).start()
+        self.assertEqual(clock.getDelayedCalls(), [])
@@ -0,0 +1,176 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from unittest import mock
+
+from twisted.internet import defer
+from twisted.internet import task
+from twisted.trial import unittest
+
+from cyclone import cache
+
+
+class LRUCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.cache = cache.LRUCache(maxsize=10, sizeof=len,
+                                    clock=lambda: self.now)
+
+    def test_eviction(self):
+        self.cache.set("a", b"aaaa")
+        self.cache.set("b", b"bbbb")
+        self.assertEqual(self.cache.get("a"), b"aaaa")
+        self.cache.set("c", b"cccc")
+        self.assertNotIn("b", self.cache)
+        self.assertIn("a", self.cache)
+        self.assertEqual(self.cache.size, 8)
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_too_big(self):
+        self.cache.set("a", b"a" * 11)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_ttl(self):
+        self.cache.set("a", b"a", ttl=5)
+        self.cache.set("b", b"b")
+        self.now = 5
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.get("b"), b"b")
+        self.assertEqual(self.cache.stats()["size"], 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_count_bound(self):
+        lru = cache.LRUCache(maxsize=2)
+        for key in "abc":
+            lru.set(key, key)
+        self.assertEqual(sorted(lru._items), ["b", "c"])
+
+
+class SingleFlightTest(unittest.TestCase):
+    def test_done(self):
+        flights = cache.SingleFlight()
+        flights.start("k")
+        self.assertIn("k", flights)
+        waiters = [flights.wait("k"), flights.wait("k")]
+        flights.done("k", 42)
+        self.assertNotIn("k", flights)
+        self.assertEqual([self.successResultOf(d) for d in waiters],
+                         [42, 42])
+
+    def test_fail(self):
+        flights = cache.SingleFlight()
+        flights.start("k")
+        d = flights.wait("k")
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            flights.fail("k")
+        self.failureResultOf(d, ZeroDivisionError)
+        self.assertEqual(len(flights), 0)
+
+
+class AsyncCachedTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.pending = []
+
+    def _function(self, **options):
+        @cache.async_cached(**options)
+        def lookup(key, suffix=""):
+            self.calls.append(key)
+            d = defer.Deferred()
+            self.pending.append(d)
+            return d.addCallback(lambda ign: key + suffix)
+        return lookup
+
+    def test_value_cached(self):
+        lookup = self._function()
+        d = lookup("a")
+        self.pending.pop().callback(None)
+        self.assertEqual(self.successResultOf(d), "a")
+        self.assertEqual(self.successResultOf(lookup("a")), "a")
+        self.assertEqual(self.successResultOf(lookup("a")), "a")
+        self.assertEqual(self.calls, ["a"])
+        info = lookup.cache_info()
+        self.assertEqual((info["hits"], info["misses"]), (2, 1))
+
+    def test_kwargs(self):
+        lookup = self._function()
+        lookup("a")
+        lookup("a", suffix="!")
+        lookup("a", "!")
+        self.assertEqual(self.calls, ["a", "a", "a"])
+
+    def test_concurrent_calls_shared(self):
+        lookup = self._function()
+        first, second = lookup("a"), lookup("a")
+        self.assertEqual(self.calls, ["a"])
+        self.pending.pop().callback(None)
+        self.assertEqual(self.successResultOf(first), "a")
+        self.assertEqual(self.successResultOf(second), "a")
+
+    def test_first_caller_timeout(self):
+        clock = task.Clock()
+        lookup = self._function()
+        first = lookup("a").addTimeout(1, clock)
+        second = lookup("a")
+        clock.advance(1)
+        self.failureResultOf(first, defer.TimeoutError)
+        self.assertNoResult(second)
+        self.pending.pop().callback(None)
+        self.assertEqual(self.successResultOf(second), "a")
+        self.assertEqual(self.calls, ["a"])
+
+    def test_failure_not_cached(self):
+        lookup = self._function()
+        first, second = lookup("a"), lookup("a")
+        self.pending.pop().errback(ValueError("boom"))
+        self.failureResultOf(first, ValueError)
+        self.failureResultOf(second, ValueError)
+        d = lookup("a")
+        self.assertEqual(len(self.calls), 2)
+        self.pending.pop().callback(None)
+        self.assertEqual(self.successResultOf(d), "a")
+
+    def test_ttl_and_eviction(self):
+        clock = task.Clock()
+        with mock.patch("time.time", clock.seconds):
+            lookup = self._function(ttl=10, maxsize=1)
+            for key in ("a", "b", "b"):
+                lookup(key)
+                if self.pending:
+                    self.pending.pop().callback(None)
+            self.assertEqual(lookup.cache_info()["evictions"], 1)
+            clock.advance(10)
+            lookup("b")
+        self.assertEqual(self.calls, ["a", "b", "b"])
+
+    def test_invalidate(self):
+        lookup = self._function()
+        lookup("a")
+        self.pending.pop().callback(None)
+        lookup.invalidate("a")
+        lookup("a")
+        self.assertEqual(self.calls, ["a", "a"])
+
+    def test_coroutine(self):
+        calls = []
+
+        @cache.async_cached()
+        async def double(value):
+            calls.append(value)
+            return value * 2
+
+        self.assertEqual(self.successResultOf(double(2)), 4)
+        self.assertEqual(self.successResultOf(double(2)), 4)
+        self.assertEqual(calls, [2])
@@ -0,0 +1,167 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import threading
+import time
+
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.trial import unittest
+
+from cyclone import executor
+
+
+def big_result(size):
+    return b"x" * size
+
+
+def fail():
+    raise ValueError("in a worker")
+
+
+class ThreadPoolTest(unittest.TestCase):
+    def make_pool(self, **kwargs):
+        pool = executor.ThreadPool("test", **kwargs)
+        self.addCleanup(pool.stop)
+        return pool
+
+    def blocked(self):
+        event = threading.Event()
+        self.addCleanup(event.set)
+        return event
+
+    @defer.inlineCallbacks
+    def test_submit(self):
+        pool = self.make_pool(size=2)
+        name = yield pool.submit(lambda: threading.current_thread().name)
+        self.assertNotEqual(name, threading.current_thread().name)
+        stats = pool.stats()
+        self.assertEqual((stats["submitted"], stats["completed"],
+                          stats["running"]), (1, 1, 0))
+
+    @defer.inlineCallbacks
+    def test_failure(self):
+        pool = self.make_pool()
+        yield self.assertFailure(pool.submit(int, "x"), ValueError)
+        self.assertEqual(pool.stats()["failed"], 1)
+
+    @defer.inlineCallbacks
+    def test_queue(self):
+        pool = self.make_pool(size=1, max_queue=2)
+        event = self.blocked()
+        running = pool.submit(event.wait, 10)
+        queued = [pool.submit(lambda i=i: i) for i in range(2)]
+        stats = pool.stats()
+        self.assertEqual((stats["running"], stats["queued"],
+                          stats["saturated"]), (1, 2, 2))
+        event.set()
+        results = yield defer.gatherResults([running] + queued)
+        self.assertEqual(results, [True, 0, 1])
+        stats = pool.stats()
+        self.assertEqual((stats["queued"], stats["max_queued"],
+                          stats["completed"]), (0, 2, 3))
+        self.assertTrue(stats["max_queue_time"] > 0)
+        self.assertTrue(stats["run_time"] >= stats["max_run_time"] > 0)
+
+    @defer.inlineCallbacks
+    def test_abort(self):
+        pool = self.make_pool(size=1, max_queue=1)
+        event = self.blocked()
+        running = pool.submit(event.wait, 10)
+        queued = pool.submit(lambda: "queued")
+        yield self.assertFailure(pool.submit(lambda: "rejected"),
+                                 executor.RejectedError)
+        event.set()
+        self.assertEqual((yield queued), "queued")
+        yield running
+        self.assertEqual(pool.stats()["rejected"], 1)
+
+    @defer.inlineCallbacks
+    def test_discard_oldest(self):
+        pool = self.make_pool(size=1, max_queue=1, reject="discard_oldest")
+        event = self.blocked()
+        running = pool.submit(event.wait, 10)
+        oldest = pool.submit(lambda: "oldest")
+        newest = pool.submit(lambda: "newest")
+        yield self.assertFailure(oldest, executor.RejectedError)
+        event.set()
+        self.assertEqual((yield newest), "newest")
+        yield running
+
+    @defer.inlineCallbacks
+    def test_cancel_queued(self):
+        pool = self.make_pool(size=1)
+        event = self.blocked()
+        called = []
+        running = pool.submit(event.wait, 10)
+        queued = pool.submit(called.append, "queued")
+        queued.cancel()
+        self.assertEqual(pool.stats()["queued"], 0)
+        yield self.assertFailure(queued, defer.CancelledError)
+        event.set()
+        yield running
+        self.assertEqual(called, [])
+
+    def test_reject_policy(self):
+        self.assertRaises(ValueError, executor.ThreadPool, "test",
+                          reject="wait")
+
+
+class ProcessPoolTest(unittest.TestCase):
+    def make_pool(self, **kwargs):
+        kwargs.setdefault("size", 2)
+        pool = executor.ProcessPool("test", **kwargs)
+        self.addCleanup(pool.stop)
+        return pool
+
+    @defer.inlineCallbacks
+    def test_submit(self):
+        pool = self.make_pool()
+        yield pool.start()
+        pid = yield pool.submit(os.getpid)
+        self.assertNotEqual(pid, os.getpid())
+        self.assertEqual((yield pool.submit(divmod, 7, 2)), (3, 1))
+        self.assertEqual(pool.stats()["completed"], 2 + 2)  # and warmup
+
+    @defer.inlineCallbacks
+    def test_failure(self):
+        pool = self.make_pool()
+        yield self.assertFailure(pool.submit(fail), ValueError)
+        self.assertEqual(pool.stats()["failed"], 1)
+
+    @defer.inlineCallbacks
+    def test_shared_memory(self):
+        pool = self.make_pool(shared_memory_min_size=1024)
+        data = yield pool.submit(big_result, 1024 * 1024)
+        self.assertEqual(data, b"x" * 1024 * 1024)
+        data = yield pool.submit(big_result, 1023)
+        self.assertEqual(data, b"x" * 1023)
+        self.assertEqual(pool.stats()["shared"], 1)
+
+    @defer.inlineCallbacks
+    def test_timeout(self):
+        pool = self.make_pool(size=1)
+        running = pool.submit(time.sleep, 0.5).addTimeout(0.05, reactor)
+        queued = pool.submit(os.getpid).addTimeout(0.05, reactor)
+        yield self.assertFailure(running, defer.TimeoutError)
+        yield self.assertFailure(queued, defer.TimeoutError)
+        # the worker is available again once the running call returns
+        self.assertNotEqual((yield pool.submit(os.getpid)), os.getpid())
+        self.assertEqual(pool.stats()["cancelled"], 2)
+
+    @defer.inlineCallbacks
+    def test_pool_timeout(self):
+        pool = self.make_pool(timeout=0.05)
+        yield self.assertFailure(pool.submit(time.sleep, 0.5),
+                                 defer.TimeoutError)
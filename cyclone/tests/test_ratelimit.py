@@ -0,0 +1,108 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from unittest.mock import Mock
+
+from twisted.trial import unittest
+
+from cyclone import ratelimit
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class RateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+
+    def limiter(self, **kwargs):
+        return ratelimit.RateLimiter(clock=self.clock, **kwargs)
+
+    def test_consume(self):
+        limiter = self.limiter(rate=2, burst=3)
+        results = [limiter.consume("a").allowed for i in range(4)]
+        self.assertEqual(results, [True, True, True, False])
+        limit = limiter.consume("a")
+        self.assertEqual((limit.remaining, limit.reset, limit.retry_after),
+                         (0, 1.5, 0.5))
+        self.assertTrue(limiter.consume("b").allowed)
+        self.clock.now = 0.5
+        limit = limiter.consume("a")
+        self.assertEqual((limit.allowed, limit.remaining), (True, 0))
+        self.assertEqual(limiter.stats()["limited"], 2)
+
+    def test_refill(self):
+        limiter = self.limiter(rate=1, burst=2)
+        limiter.consume("a", cost=2)
+        self.clock.now = 100
+        # refilled up to the burst only
+        self.assertEqual(limiter.consume("a").remaining, 1)
+
+    def test_headers(self):
+        limiter = self.limiter(rate=1, burst=1)
+        self.assertEqual(limiter.consume("a").headers(),
+                         {"RateLimit-Limit": "1", "RateLimit-Remaining": "0",
+                          "RateLimit-Reset": "1"})
+        self.clock.now = 0.25
+        self.assertEqual(limiter.consume("a").headers()["Retry-After"], "1")
+
+    def test_sweep(self):
+        limiter = self.limiter(rate=1, burst=5, sweep_interval=10,
+                               sweep_batch=2)
+        for key in "abcd":
+            limiter.consume(key)
+        self.clock.now = 8
+        limiter.consume("d", cost=4)
+        self.clock.now = 10
+        limiter.consume("e")
+        limiter.consume("e")
+        # a, b and c had refilled: dropped; d hadn't
+        self.assertEqual(sorted(limiter._slots), ["d", "e"])
+        # the slots of dropped buckets are reused
+        for key in "fgh":
+            limiter.consume(key)
+        self.assertEqual(len(limiter._tokens), 5)
+
+    def test_max_keys(self):
+        limiter = self.limiter(rate=1, burst=1, max_keys=2)
+        for key in "abc":
+            limiter.consume(key)
+        self.assertEqual(sorted(limiter._slots), ["b", "c"])
+        self.assertEqual(limiter.stats()["evictions"], 1)
+        self.assertTrue(limiter.consume("a").allowed)
+
+    def test_max_keys_lru(self):
+        limiter = self.limiter(rate=1, burst=2, max_keys=2)
+        limiter.consume("a")
+        limiter.consume("b")
+        limiter.consume("a")
+        limiter.consume("c")
+        # b was the least recently used
+        self.assertEqual(sorted(limiter._slots), ["a", "c"])
+        self.assertEqual(limiter.consume("a").remaining, 0)
+
+    def test_keys(self):
+        handler = Mock()
+        handler.request.remote_ip = "10.0.0.1"
+        handler.current_user = None
+        self.assertEqual(ratelimit.by_user(handler), "10.0.0.1")
+        handler.current_user = "alice"
+        self.assertEqual(ratelimit.by_user(handler), ("user", "alice"))
+        self.assertEqual(self.limiter(rate=1, key="ip").key(handler),
+                         "10.0.0.1")
+        self.assertRaises(ValueError, self.limiter, rate=1, key="cookie")
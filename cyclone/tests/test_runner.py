@@ -0,0 +1,106 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import subprocess
+import sys
+
+from twisted.trial import unittest
+
+import cyclone
+from cyclone import runner
+from cyclone import web
+
+ASYNCIO_SERVER = """
+from cyclone import runner
+reactor = runner.install_reactor("asyncio")
+
+import asyncio
+from twisted.internet import defer
+from cyclone import web
+from cyclone.testing import Client
+
+
+class Handler(web.RequestHandler):
+    async def get(self):
+        await asyncio.sleep(0.01)
+        value = await defer.succeed("deferred")
+        self.write("%s %s" % (value, asyncio.current_task() is not None))
+
+
+@defer.inlineCallbacks
+def main():
+    try:
+        response = yield Client(web.Application([(r"/", Handler)])).get("/")
+        print(response.get_status(), response.content.decode())
+    finally:
+        reactor.stop()
+
+reactor.callWhenRunning(main)
+reactor.run()
+"""
+
+
+def run_python(source):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(cyclone.__file__))
+    return subprocess.run([sys.executable, "-c", source], env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                          timeout=60).stdout.decode()
+
+
+class InstallReactorTest(unittest.TestCase):
+    def test_import_does_not_install_reactor(self):
+        output = run_python(
+            "import sys, cyclone.web, cyclone.runner, cyclone.sse\n"
+            "print('twisted.internet.reactor' in sys.modules)")
+        self.assertEqual(output.strip(), "False")
+
+    def test_asyncio_reactor(self):
+        output = run_python(ASYNCIO_SERVER)
+        self.assertEqual(output.strip(), "200 deferred True")
+
+    def test_unknown_reactor(self):
+        self.assertRaises(ValueError, runner.install_reactor, "bogus")
+
+
+class LoadApplicationTest(unittest.TestCase):
+    def write_server(self, source):
+        path = self.mktemp()
+        os.makedirs(path)
+        filename = os.path.join(path, "server.py")
+        with open(filename, "w") as f:
+            f.write("import cyclone.web\n\n" + source)
+        return filename
+
+    def test_class(self):
+        filename = self.write_server(
+            "class Application(cyclone.web.Application):\n"
+            "    def __init__(self):\n"
+            "        cyclone.web.Application.__init__(self, [], foo=1)\n")
+        app = runner.load_application(filename)
+        self.assertIsInstance(app, web.Application)
+        self.assertEqual(app.settings.foo, 1)
+
+    def test_instance(self):
+        filename = self.write_server(
+            "application = cyclone.web.Application([], foo=2)\n")
+        self.assertEqual(runner.load_application(filename).settings.foo, 2)
+
+    def test_missing(self):
+        filename = self.write_server("x = 1\n")
+        self.assertRaises(ValueError, runner.load_application, filename)
+
+    def test_by_name(self):
+        app = runner.load_application(app="cyclone.web.Application")
+        self.assertIsInstance(app, web.Application)
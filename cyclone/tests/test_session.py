@@ -0,0 +1,132 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from cyclone import session
+
+
+class SessionTest(unittest.TestCase):
+    def test_modified(self):
+        s = session.Session("id", {"a": 1})
+        self.assertFalse(s.modified)
+        self.assertEqual(s["a"], 1)
+        self.assertFalse(s.modified)
+        for change in (lambda: s.__setitem__("b", 2),
+                       lambda: s.pop("b"),
+                       lambda: s.setdefault("c", []),
+                       lambda: s.update(d=4),
+                       s.changed):
+            s.modified = False
+            change()
+            self.assertTrue(s.modified)
+
+    def test_regenerate(self):
+        s = session.Session("old", {"a": 1})
+        s.regenerate()
+        self.assertEqual((s.id, s.previous_ids, s.modified),
+                         (None, ["old"], True))
+        s.invalidate()
+        self.assertEqual((dict(s), s.invalidated, s.modified),
+                         ({}, True, False))
+
+    def test_new_session_id(self):
+        ids = set(session.new_session_id() for i in range(100))
+        self.assertEqual(len(ids), 100)
+        self.assertTrue(all(len(i) == 43 for i in ids))
+
+
+class Clock(object):
+    now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class SessionStoreTest(unittest.TestCase):
+    def test_memory(self):
+        clock = Clock()
+        store = session.SessionStore(ttl=10, clock=clock)
+        self.assertIsNone(store.load("a"))
+        store.save("a", {"user": 1})
+        self.assertEqual(store.load("a"), {"user": 1})
+        clock.now = 11
+        self.assertIsNone(store.load("a"))
+        store.save("b", {})
+        store.delete("b")
+        self.assertIsNone(store.load("b"))
+
+    @defer.inlineCallbacks
+    def test_persistent(self):
+        persistent = session.SQLiteStore(self.mktemp())
+        self.addCleanup(persistent.pool.stop)
+        store = session.SessionStore(maxsize=1, persistent=persistent)
+        yield store.save("a", {"user": 1})
+        yield store.save("b", {"user": 2})
+        # "a" was evicted from memory, not from disk
+        self.assertEqual(store.load("b"), {"user": 2})
+        self.assertEqual((yield store.load("a")), {"user": 1})
+        self.assertEqual(store.load("a"), {"user": 1})
+        yield store.delete("a")
+        self.assertIsNone((yield store.load("a")))
+        yield persistent.close()
+
+
+class PersistentStoreTests(object):
+    def make_store(self):
+        raise NotImplementedError
+
+    @defer.inlineCallbacks
+    def test_round_trip(self):
+        store = self.make_store()
+        self.addCleanup(store.pool.stop)
+        yield store.set("a", {"user": 1, "tags": ["x"]}, 60)
+        self.assertEqual((yield store.get("a")), {"user": 1, "tags": ["x"]})
+        yield store.set("a", {"user": 2}, 60)
+        self.assertEqual((yield store.get("a")), {"user": 2})
+        self.assertIsNone((yield store.get("b")))
+        yield store.delete("a")
+        yield store.delete("a")
+        self.assertIsNone((yield store.get("a")))
+        yield store.close()
+
+    @defer.inlineCallbacks
+    def test_expiry(self):
+        store = self.make_store()
+        self.addCleanup(store.pool.stop)
+        yield store.set("old", {}, -1)
+        yield store.set("new", {}, 60)
+        self.assertIsNone((yield store.get("old")))
+        self.assertEqual((yield store.purge()), 1)
+        self.assertEqual((yield store.get("new")), {})
+        yield store.close()
+
+    @defer.inlineCallbacks
+    def test_not_serializable(self):
+        store = self.make_store()
+        self.addCleanup(store.pool.stop)
+        yield self.assertFailure(store.set("a", {"user": object()}, 60),
+                                 TypeError)
+        self.assertIsNone((yield store.get("a")))
+        yield store.close()
+
+
+class SQLiteStoreTest(PersistentStoreTests, unittest.TestCase):
+    def make_store(self):
+        return session.SQLiteStore(self.mktemp())
+
+
+class DBMStoreTest(PersistentStoreTests, unittest.TestCase):
+    def make_store(self):
+        return session.DBMStore(self.mktemp())
@@ -0,0 +1,131 @@
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import gzip
+import hashlib
+import os
+
+from twisted.trial import unittest
+
+from cyclone import static
+
+
+class PrecompressTest(unittest.TestCase):
+    def setUp(self):
+        self.path = self.mktemp()
+        os.makedirs(os.path.join(self.path, "css"))
+        self.files = {
+            "app.js": b"function f() { return 1; }\n" * 100,
+            "css/site.css": b"body { margin: 0; }\n" * 100,
+            "small.txt": b"hi",
+            "logo.png": b"\x89PNG" * 1000,
+        }
+        for name, data in self.files.items():
+            with open(os.path.join(self.path, name), "wb") as f:
+                f.write(data)
+
+    def test_precompress(self):
+        written = static.precompress(self.path)
+        gz = [w for w in written if w.endswith(".gz")]
+        self.assertEqual(sorted(os.path.relpath(w, self.path) for w in gz),
+                         ["app.js.gz", os.path.join("css", "site.css.gz")])
+        with open(os.path.join(self.path, "app.js.gz"), "rb") as f:
+            self.assertEqual(gzip.decompress(f.read()),
+                             self.files["app.js"])
+
+    def test_up_to_date_files_skipped(self):
+        self.assertTrue(static.precompress(self.path))
+        self.assertEqual(static.precompress(self.path), [])
+        self.assertTrue(static.precompress(self.path, force=True))
+
+    def test_is_compressible(self):
+        self.assertTrue(static.is_compressible("a.css"))
+        self.assertTrue(static.is_compressible("a.svg"))
+        self.assertFalse(static.is_compressible("a.png"))
+        self.assertFalse(static.is_compressible("a.js.gz"))
+
+
+class StaticFileCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.path = self.mktemp()
+        os.mkdir(self.path)
+        self.now = 0.0
+        self.cache = static.StaticFileCache(
+            max_bytes=250, max_file_size=100, check_interval=5,
+            clock=lambda: self.now)
+
+    def _entry(self, name, content):
+        abspath = os.path.join(self.path, name)
+        with open(abspath, "wb") as f:
+            f.write(content)
+        return static.StaticFile(abspath, os.stat(abspath), None, None,
+                                 None, None, content)
+
+    def test_lru_eviction(self):
+        a = self._entry("a", b"a" * 100)
+        b = self._entry("b", b"b" * 100)
+        self.assertTrue(self.cache.put(a))
+        self.assertTrue(self.cache.put(b))
+        self.assertIs(self.cache.get(a.abspath), a)
+        self.cache.put(self._entry("c", b"c" * 100))
+        # b was the least recently used
+        self.assertNotIn(b.abspath, self.cache)
+        self.assertIn(a.abspath, self.cache)
+        self.assertEqual(self.cache.size, 200)
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_too_big_not_cached(self):
+        self.assertFalse(self.cache.put(self._entry("a", b"a" * 101)))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_revalidation(self):
+        a = self._entry("a", b"a" * 10)
+        self.cache.put(a)
+        with open(a.abspath, "wb") as f:
+            f.write(b"changed")
+        # not checked again before the interval is over
+        self.assertIs(self.cache.get(a.abspath), a)
+        self.now = 5
+        self.assertIsNone(self.cache.get(a.abspath))
+        self.assertEqual(self.cache.size, 0)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_removed_file_dropped(self):
+        a = self._entry("a", b"a" * 10)
+        self.cache.put(a)
+        os.unlink(a.abspath)
+        self.now = 10
+        self.assertIsNone(self.cache.get(a.abspath))
+        self.assertNotIn(a.abspath, self.cache)
+
+
+class ManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.path = self.mktemp()
+        os.makedirs(os.path.join(self.path, "css"))
+        for name in ("app.js", "css/site.css"):
+            with open(os.path.join(self.path, name), "wb") as f:
+                f.write(name.encode() * 100)
+
+    def test_build_manifest(self):
+        static.precompress(self.path)
+        manifest = static.build_manifest(self.path, max_workers=2)
+        self.assertEqual(sorted(manifest), ["app.js", "css/site.css"])
+        self.assertEqual(manifest["css/site.css"], hashlib.md5(
+            b"css/site.css" * 100).hexdigest())
+
+    def test_write_and_load(self):
+        manifest = static.build_manifest(self.path)
+        filename = self.mktemp()
+        static.write_manifest(manifest, filename)
+        self.assertEqual(static.load_manifest(filename), manifest)
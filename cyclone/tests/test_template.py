@@ -18,6 +18,7 @@ from twisted.trial import unittest
 from twisted.internet import reactor
 
 from unittest.mock import Mock
+import linecache
 
 from cyclone import template
 
@@ -72,6 +73,131 @@ class TestTemplates(unittest.TestCase):
         self.assertEqual(t.generate(a=42.5), b"Unknown")
         self.assertEqual(t.generate(a="meow"), b"String")
 
+    def test_isolated_calls(self):
+        t = template.Template(
+            "{% if first %}{% set x = 1 %}{% end %}{{ first }}"
+            "{{ globals().get('x') }}{{ globals().get('y') }}")
+        self.assertEqual(t.generate(first=True, y=2), b"TrueNone2")
+        self.assertEqual(t.generate(first=False), b"FalseNoneNone")
+
+    def test_linecache(self):
+        linecache.cache["other.py"] = (1, None, ["x\n"], "other.py")
+        self.addCleanup(linecache.cache.pop, "other.py", None)
+        t = template.Template("{{ 1 / x }}", name="linecache.html")
+        self.assertIn("1 / x", "".join(
+            linecache.getlines("linecache_html.generated.py")))
+        self.assertEqual(t.generate(x=1), b"1.0")
+        # rendering no longer clears the cache of the whole process
+        self.assertIn("other.py", linecache.cache)
+        error = self.assertRaises(template.TemplateError, t.generate, x=0)
+        self.assertIn("1 / x", str(error))
+
+    def test_synchronous(self):
+        t = template.Template("{% apply linkify %}{{ url }}{% end %}")
+        self.assertFalse(t.asynchronous)
+        self.assertNotIn("yield", t.code)
+        self.assertEqual(t.generate(url="http://a.com"),
+                         b'<a href="http://a.com">http://a.com</a>')
+
+    def test_bytes_not_utf8(self):
+        # written as they are, like before output was built in str
+        t = template.Template(
+            "{% raw v %}{{ v }}{% apply f %}{{ v }}{% end %}")
+        self.assertEqual(t.generate(v=b"\xff", f=lambda s: s.encode(
+            "utf-8", "surrogateescape")), b"\xff\xff\xff")
+
+    def test_met_deferred(self):
+        d = defer.Deferred()
+        calls = []
+        t = template.Template("{{ x }}-{{ count() }}")
+        rv = t.generate(x=d, count=lambda: calls.append(1) or len(calls))
+        self.assertTrue(isinstance(rv, defer.Deferred), rv)
+        # evaluated once, without waiting for the Deferred
+        self.assertEqual(calls, [1])
+        d.callback("<a>")
+        self.assertEqual(self.successResultOf(rv), b"&lt;a&gt;-1")
+        # later calls wait for each Deferred, with the same code
+        self.assertFalse(t.asynchronous)
+        self.assertNotIn("yield", t.code)
+        self.assertEqual(
+            t.generate(x=defer.succeed(1), count=lambda: 2), b"1-2")
+        self.assertEqual(t.generate(x=1, count=lambda: 2), b"1-2")
+        self.assertRaises(template.TemplateError, t.generate,
+                          x=defer.fail(ValueError()), count=int)
+
+    def test_deferred_not_evaluated_twice(self):
+        calls = []
+
+        def g():
+            calls.append(1)
+            return defer.Deferred()
+        t = template.Template("{{ g() }}")
+        rv = t.generate(g=g)
+        self.assertEqual(calls, [1])
+        # the Deferred rendered is the one g returned
+        self.assertNoResult(rv)
+
+    def test_met_deferred_apply(self):
+        t = template.Template(
+            "{% apply upper %}a{{ x }}b{% end %}-{{ y }}")
+        for i in range(3):
+            self.assertEqual(
+                self.successResultOf(defer.maybeDeferred(
+                    t.generate, x="y", y=defer.succeed("z"),
+                    upper=str.upper)), b"AYB-z")
+        t = template.Template("{% apply upper %}a{{ x }}b{% end %}")
+        for i in range(3):
+            self.assertEqual(
+                t.generate(x=defer.succeed("y"), upper=str.upper), b"AYB")
+
+    def test_met_deferred_in_try(self):
+        t = template.Template(
+            "{{ f() }}{% try %}{{ d }}{% except %}CAUGHT{% end %}end")
+        self.assertTrue(t.asynchronous)
+        d = defer.Deferred()
+        rv = t.generate(f=lambda: "f", d=d)
+        d.callback("D")
+        self.assertEqual(self.successResultOf(rv), b"fDend")
+        # failures are caught by the template
+        self.assertEqual(
+            t.generate(f=lambda: "f", d=defer.fail(ValueError())),
+            b"fCAUGHTend")
+
+    def test_asynchronous(self):
+        loader = template.DictLoader({"a.html": "{{ x }}"},
+                                     asynchronous=True)
+        t = loader.load("a.html")
+        self.assertTrue(t.asynchronous)
+        self.assertEqual(t.generate(x=defer.succeed("a")), b"a")
+
+    def test_text_merged(self):
+        loader = template.DictLoader({
+            "base.html": "<p>{% block a %}{% end %}</p>",
+            "page.html": '{% extends "base.html" %}'
+                         '{% block a %}a{# b #}c{% end %}'})
+        t = loader.load("page.html")
+        self.assertEqual(t.code.count("_append("), 1)
+        self.assertEqual(t.generate(), b"<p>ac</p>")
+
+    def test_bytes_output(self):
+        t = template.Template("{{ x }}{% raw y %}{{ z }}\u00e9",
+                              autoescape="to_bytes")
+        t.namespace["to_bytes"] = lambda value: value.encode("utf-8")
+        self.assertEqual(t.generate(x="\u00e9", y=b"\xc3\xa9", z=1),
+                         "\u00e9\u00e91\u00e9".encode("utf-8"))
+
+    def test_stream(self):
+        t = template.Template("<head>{% block h %}{{ x }}{% end %}</head>"
+                              "{% flush %}{% apply squeeze %}a {% flush %}"
+                              " b{% end %}{{ y }}")
+        chunks = []
+        d = defer.Deferred()
+        rv = t.stream(chunks.append, x=1, y=d)
+        self.assertEqual(chunks, [b"<head>1</head>"])
+        d.callback(2)
+        self.assertEqual(self.successResultOf(rv), b"a b2")
+        self.assertEqual(t.generate(x=1, y=2), b"<head>1</head>a b2")
+
     def test_comment(self):
         self.assertEqual(
             template.Template(r"{% comment blah! %}42").generate(),
@@ -17,14 +17,33 @@
 from twisted.trial import unittest
 from cyclone.web import RequestHandler, HTTPError
 from cyclone.web import Application, URLSpec, URLReverseError
+from cyclone.web import GZipContentEncoding, StaticFileHandler
+from cyclone.web import ChunkedTransferEncoding, cached_response, coalesced
+from cyclone import admission
+from cyclone import httpserver
+from cyclone import ratelimit
+from cyclone import session
+from cyclone import static
+from cyclone import web
+from cyclone.testing import Client
+from cyclone.httputil import HTTPHeaders
 from cyclone.escape import unicode_type
 from unittest.mock import Mock
+from unittest import mock
 from datetime import datetime
 from http import cookies as http_cookies
 import email.utils
+import gzip
+import hashlib
+import os
+import re
+import threading
+import asyncio
 import calendar
 import time
-from twisted.internet import defer, reactor
+import zlib
+from twisted.internet import defer, error, protocol, reactor, task
+from twisted.python import failure
 from cyclone.template import DictLoader
 
 
@@ -200,6 +219,63 @@ class RequestHandlerTest(unittest.TestCase):
             time.gmtime(),
         )
 
+    def test_set_cookie_output(self):
+        # Same Set-Cookie headers as a SimpleCookie would send
+        expires = datetime(2030, 1, 2, 3, 4, 5)
+        cases = [
+            ("plain", "value", {}),
+            ("quoted", 'a"b";c,d', {"domain": "foo.com", "path": None}),
+            ("session", "abc", {"expires_days": 30, "httponly": True,
+                                "secure": True, "samesite": "Lax"}),
+            ("dated", "", {"expires": expires, "max_age": 60,
+                           "comment": "a comment", "secure": False}),
+            ("relative", "x", {"expires_days": None, "max_age": "60",
+                               "version": 1}),
+        ]
+        for name, value, kwargs in cases:
+            with mock.patch("time.time", return_value=1700000000.5):
+                self.rh.set_cookie(name, value, **kwargs)
+            kwargs = dict(kwargs)
+            morsel = http_cookies.SimpleCookie()
+            morsel[name] = value
+            morsel = morsel[name]
+            if kwargs.pop("domain", None):
+                morsel["domain"] = "foo.com"
+            if kwargs.get("expires_days"):
+                morsel["expires"] = email.utils.formatdate(
+                    1700000000 + kwargs["expires_days"] * 86400,
+                    usegmt=True)
+            kwargs.pop("expires_days", None)
+            if kwargs.get("expires"):
+                morsel["expires"] = email.utils.formatdate(
+                    calendar.timegm(kwargs["expires"].utctimetuple()),
+                    usegmt=True)
+            kwargs.pop("expires", None)
+            path = kwargs.pop("path", "/")
+            if path:
+                morsel["path"] = path
+            for k, v in kwargs.items():
+                morsel[k.replace("_", "-")] = v
+            self.assertEqual(self.rh._new_cookie[name].OutputString(None),
+                             morsel.OutputString(None))
+        self.assertRaises(http_cookies.CookieError, self.rh.set_cookie,
+                          "a", "b", bogus=1)
+        self.assertRaises(http_cookies.CookieError, self.rh.set_cookie,
+                          "path", "b")
+        self.assertRaises(http_cookies.CookieError, self.rh.set_cookie,
+                          "a(b)", "b")
+
+    def test_set_cookie_flags(self):
+        # all the flags of this Python's Morsel, "partitioned" on 3.14
+        for flag in http_cookies.Morsel._flags:
+            self.rh.set_cookie("flagged", "x", path=None, **{flag: True})
+            morsel = http_cookies.SimpleCookie()
+            morsel["flagged"] = "x"
+            morsel["flagged"][flag] = True
+            self.assertEqual(
+                self.rh._new_cookie["flagged"].OutputString(None),
+                morsel["flagged"].OutputString(None))
+
     def test_clear_cookie(self):
         morsel = Mock()
         self.rh.request.cookies = {"testcookie": morsel}
@@ -361,6 +437,146 @@ class TestUrlSpec(unittest.TestCase):
             "/page/11/22/33?hello=world")
 
 
+class ChunkedTransferEncodingTest(unittest.TestCase):
+    def _transform(self, http_1_1=True):
+        request = Mock()
+        request.supports_http_1_1.return_value = http_1_1
+        return ChunkedTransferEncoding(request)
+
+    def test_segments(self):
+        t = self._transform()
+        status, headers, chunk = t.transform_first_chunk(
+            200, {}, b"hello", False)
+        self.assertEqual(headers["Transfer-Encoding"], "chunked")
+        self.assertEqual(chunk, b"5\r\nhello\r\n")
+        payload = b"x" * 300
+        segments = t.transform_chunk_segments(payload, False)
+        self.assertEqual(segments, [b"12c\r\n", payload, b"\r\n"])
+        self.assertIs(segments[1], payload)
+        self.assertEqual(t.transform_chunk_segments(b"", True),
+                         [b"0\r\n\r\n"])
+
+    def test_trailers(self):
+        t = self._transform()
+        t.transform_first_chunk(200, {}, b"", False)
+        t.trailers = [("X-Checksum", "abc"), ("X-Count", "2")]
+        self.assertEqual(t.transform_chunk(b"ab", True),
+                         b"2\r\nab\r\n0\r\nX-Checksum: abc\r\n"
+                         b"X-Count: 2\r\n\r\n")
+
+    def test_not_chunked(self):
+        t = self._transform(http_1_1=False)
+        status, headers, chunk = t.transform_first_chunk(
+            200, {}, b"hello", False)
+        self.assertNotIn("Transfer-Encoding", headers)
+        self.assertEqual(t.transform_chunk_segments(b"more", True),
+                         [b"more"])
+
+    @defer.inlineCallbacks
+    def test_streamed_response(self):
+        class StreamHandler(RequestHandler):
+            def get(self):
+                self.set_header("Trailer", "X-Parts")
+                for i in range(3):
+                    self.write("part %d;" % i)
+                    self.flush()
+                self.set_trailer("X-Parts", 3)
+
+        port = reactor.listenTCP(0, Application([(r"/", StreamHandler)]),
+                                 interface="127.0.0.1")
+        self.addCleanup(port.stopListening)
+        received = yield _fetch(
+            port.getHost().port,
+            b"GET / HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+        headers, body = received.split(b"\r\n\r\n", 1)
+        self.assertIn(b"Transfer-Encoding: chunked", headers)
+        self.assertEqual(body, b"7\r\npart 0;\r\n7\r\npart 1;\r\n"
+                               b"7\r\npart 2;\r\n0\r\nX-Parts: 3\r\n\r\n")
+
+
+class GZipContentEncodingTest(unittest.TestCase):
+    def _request(self, accept_encoding="gzip", http_1_1=True):
+        request = Mock()
+        request.headers = HTTPHeaders()
+        if accept_encoding is not None:
+            request.headers["Accept-Encoding"] = accept_encoding
+        request.supports_http_1_1.return_value = http_1_1
+        return request
+
+    def _transform(self, body, accept_encoding="gzip", **kwargs):
+        transform = GZipContentEncoding(self._request(accept_encoding),
+                                        **kwargs)
+        headers = {"Content-Type": "text/html; charset=UTF-8"}
+        status, headers, chunk = transform.transform_first_chunk(
+            200, headers, body, True)
+        return headers, chunk
+
+    def test_select_coding(self):
+        select = GZipContentEncoding.select_coding
+        self.assertEqual(select("gzip, deflate"), "gzip")
+        self.assertEqual(select("x-gzip"), "gzip")
+        self.assertEqual(select("gzip;q=0"), None)
+        self.assertEqual(select("deflate"), None)
+        self.assertEqual(select("*;q=0.5"), "gzip")
+        self.assertNotEqual(select("*, gzip;q=0"), "gzip")
+        self.assertEqual(select(None), None)
+
+    def test_compress_whole_response(self):
+        body = b"<p>hello world</p>" * 200
+        headers, chunk = self._transform(body)
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        self.assertEqual(headers["Vary"], "Accept-Encoding")
+        self.assertEqual(zlib.decompress(chunk, 16 + zlib.MAX_WBITS), body)
+
+    def test_small_response_not_compressed(self):
+        headers, chunk = self._transform(b"tiny")
+        self.assertNotIn("Content-Encoding", headers)
+        self.assertEqual(chunk, b"tiny")
+        headers, chunk = self._transform(b"tiny", min_length=1)
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+
+    def test_not_accepted(self):
+        headers, chunk = self._transform(b"x" * 4096, "identity")
+        self.assertNotIn("Content-Encoding", headers)
+        self.assertEqual(headers["Vary"], "Accept-Encoding")
+
+    def test_vary_not_duplicated(self):
+        transform = GZipContentEncoding(self._request())
+        headers = {"Content-Type": "text/plain",
+                   "Vary": "Accept-Encoding"}
+        status, headers, chunk = transform.transform_first_chunk(
+            200, headers, b"", True)
+        self.assertEqual(headers["Vary"], "Accept-Encoding")
+
+    def test_streaming_flushes(self):
+        transform = GZipContentEncoding(self._request())
+        headers = {"Content-Type": "text/plain"}
+        status, headers, first = transform.transform_first_chunk(
+            200, headers, b"a" * 100, False)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        # sync-flushed output is decodable on its own
+        self.assertEqual(decompressor.decompress(first), b"a" * 100)
+        self.assertEqual(transform.transform_chunk(b"", False), b"")
+        last = transform.transform_chunk(b"b" * 100, True)
+        self.assertEqual(decompressor.decompress(last), b"b" * 100)
+        self.assertTrue(decompressor.eof)
+
+    def test_application_settings(self):
+        app = Application(gzip=True, gzip_level=9, gzip_min_length=10)
+        transform = app.transforms[0](self._request())
+        self.assertEqual(transform.GZIP_LEVEL, 9)
+        self.assertEqual(transform.MIN_LENGTH, 10)
+        self.assertEqual(GZipContentEncoding.MIN_LENGTH, 1024)
+
+
+class _BoxModule(web.UIModule):
+    def render(self):
+        return "[]"
+
+    def css_files(self):
+        return "/box.css"
+
+
 class TestRequestHandler(unittest.TestCase):
 
     @defer.inlineCallbacks
@@ -411,13 +627,51 @@ class TestRequestHandler(unittest.TestCase):
         page = yield self._execute_request(False)
         self.assertEqual(page, b"simple: it works!")
 
+    @defer.inlineCallbacks
+    def test_render_stream(self):
+        body = self._mkDeferred("world", 0.1)
+        self.handler.get = lambda: self.handler.render_stream(
+            "stream.html", body=body)
+        page = yield self._execute_request(False)
+        writes = [args[0] for args, kwargs in
+                  self.request.write.call_args_list]
+        # the head was sent before the Deferred fired, with the CSS of
+        # the module rendered after it
+        self.assertEqual(writes, [
+            b'<head><link href="/box.css" type="text/css" '
+            b'rel="stylesheet"/>\n</head>',
+            b"<body>[]world</body>"])
+        self.assertEqual(page, b"".join(writes))
+
+    @defer.inlineCallbacks
+    def test_render_stream_split_tag(self):
+        self.handler.get = lambda: self.handler.render_stream(
+            "split.html", body=self._mkDeferred("world", 0.1))
+        page = yield self._execute_request(False)
+        writes = [args[0] for args, kwargs in
+                  self.request.write.call_args_list]
+        # the "<" of "</head>" is held back with the next chunk
+        self.assertEqual(writes[0], b"<head>")
+        self.assertEqual(page, b'<head><link href="/box.css" '
+                               b'type="text/css" rel="stylesheet"/>\n'
+                               b'</head>[]world')
+
+    def test_render_stream_missing(self):
+        # errors are handled like those of the template
+        self.handler.render_stream("missing.html")
+        self.assertEqual(self.handler.get_status(), 500)
+
     def setUp(self):
         self.app = app = Mock()
         app.ui_methods = {}
-        app.ui_modules = {}
+        app.ui_modules = {"Box": _BoxModule}
         app.settings = {
             "template_loader": DictLoader({
                 "simple.html": "simple: {{msg}}",
+                "stream.html": "<head></head>{% flush %}"
+                               "<body>{% module Box() %}{{ body }}</body>",
+                "split.html": "<head><{% flush %}/head>"
+                              "{% module Box() %}{{ body }}",
             }),
         }
 
@@ -464,3 +718,1048 @@ class TestRequestHandler(unittest.TestCase):
             self.assertEqual(len(args), 1)
             out += args[0]
         defer.returnValue(out)
+
+
+class _Fetcher(protocol.Protocol):
+    def __init__(self, request, finished):
+        self.request = request
+        self.finished = finished
+        self.received = []
+
+    def connectionMade(self):
+        self.transport.write(self.request)
+
+    def dataReceived(self, data):
+        self.received.append(data)
+
+    def connectionLost(self, reason):
+        self.finished.callback(b"".join(self.received))
+
+
+def _fetch(port, request):
+    finished = defer.Deferred()
+    protocol.ClientCreator(reactor, _Fetcher, request, finished).connectTCP(
+        "127.0.0.1", port)
+    return finished
+
+
+class StaticFileHandlerTest(unittest.TestCase):
+    def setUp(self):
+        self.path = self.mktemp()
+        os.mkdir(self.path)
+        self.body = b"body { margin: 0; }\n" * 200
+        with open(os.path.join(self.path, "site.css"), "wb") as f:
+            f.write(self.body)
+
+    def _client(self, **handler_args):
+        handler_args["path"] = self.path
+        return Client(Application([
+            (r"/static/(.*)", StaticFileHandler, handler_args)]))
+
+    @defer.inlineCallbacks
+    def test_get(self):
+        response = yield self._client().get("/static/site.css")
+        self.assertEqual(response.content, self.body)
+        self.assertEqual(response.headers["Content-Type"],
+                         "text/css")
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    @defer.inlineCallbacks
+    def test_precompressed_sidecar(self):
+        static.precompress(self.path)
+        client = self._client(precompressed=True)
+        response = yield client.get(
+            "/static/site.css", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+        self.assertEqual(response.headers["Content-Type"],
+                         "text/css")
+        self.assertEqual(gzip.decompress(response.content), self.body)
+
+        response = yield client.get(
+            "/static/site.css", headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+        self.assertEqual(response.content, self.body)
+
+    @defer.inlineCallbacks
+    def test_head_does_not_read_file(self):
+        client = self._client()
+        with mock.patch("builtins.open") as m:
+            response = yield client.head("/static/site.css")
+        self.assertFalse(m.called)
+        self.assertEqual(response.headers["Content-Length"],
+                         str(len(self.body)))
+        self.assertEqual(response.content, b"")
+
+    @defer.inlineCallbacks
+    def test_etag(self):
+        client = self._client()
+        response = yield client.get("/static/site.css")
+        etag = response.headers["Etag"]
+        response = yield client.get("/static/site.css",
+                                    headers={"If-None-Match": etag})
+        self.assertEqual(response.get_status(), 304)
+        self.assertEqual(response.content, b"")
+        response = yield client.get("/static/site.css",
+                                    headers={"If-None-Match": '"other"'})
+        self.assertEqual(response.get_status(), 200)
+
+    @defer.inlineCallbacks
+    def test_streamed_over_tcp(self):
+        class StreamingHandler(StaticFileHandler):
+            STREAM_MIN_SIZE = 1
+
+        body = os.urandom(3 * 1024 * 1024)
+        with open(os.path.join(self.path, "big.bin"), "wb") as f:
+            f.write(body)
+        app = Application([(r"/static/(.*)", StreamingHandler,
+                            {"path": self.path})])
+        port = reactor.listenTCP(0, app, interface="127.0.0.1")
+        self.addCleanup(port.stopListening)
+        received = yield _fetch(port.getHost().port,
+                                b"GET /static/big.bin HTTP/1.0\r\n\r\n")
+        headers, content = received.split(b"\r\n\r\n", 1)
+        self.assertIn(b"Content-Length: %d" % len(body), headers)
+        self.assertEqual(content, body)
+
+    @defer.inlineCallbacks
+    def test_streamed_with_client(self):
+        body = os.urandom(StaticFileHandler.STREAM_MIN_SIZE + 1)
+        with open(os.path.join(self.path, "big.bin"), "wb") as f:
+            f.write(body)
+        response = yield self._client().get("/static/big.bin")
+        self.assertEqual(response.headers["Content-Length"], str(len(body)))
+        self.assertEqual(response.content, body)
+
+    @defer.inlineCallbacks
+    def test_stale_sidecar_ignored(self):
+        static.precompress(self.path)
+        abspath = os.path.join(self.path, "site.css")
+        st = os.stat(abspath)
+        os.utime(abspath, (st.st_atime, st.st_mtime + 10))
+        response = yield self._client(precompressed=True).get(
+            "/static/site.css", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.content, self.body)
+
+    @defer.inlineCallbacks
+    def test_cache(self):
+        cache = static.StaticFileCache(check_interval=3600)
+        client = self._client(cache=cache)
+        response = yield client.get("/static/site.css")
+        self.assertEqual(response.content, self.body)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        with mock.patch("builtins.open") as m, \
+                mock.patch("os.stat") as s:
+            response = yield client.get("/static/site.css",
+                                        headers={"Range": "bytes=0-9"})
+        self.assertFalse(m.called or s.called)
+        self.assertEqual(response.content, self.body[:10])
+        self.assertEqual(response.headers["Content-Type"], "text/css")
+        self.assertIn("Last-Modified", response.headers)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    @defer.inlineCallbacks
+    def test_cache_precompressed(self):
+        static.precompress(self.path)
+        cache = static.StaticFileCache(check_interval=3600)
+        client = self._client(cache=cache, precompressed=True)
+        yield client.get("/static/site.css",
+                         headers={"Accept-Encoding": "gzip"})
+        with mock.patch("os.stat") as s:
+            response = yield client.get(
+                "/static/site.css", headers={"Accept-Encoding": "gzip"})
+        self.assertFalse(s.called)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content), self.body)
+
+    def test_cache_setting(self):
+        app = Application(static_path=self.path, static_cache_size=1024)
+        handler_args = app.handlers[0][1][0].kwargs
+        self.assertEqual(handler_args["cache"].max_bytes, 1024)
+
+    def test_version_manifest(self):
+        self.addCleanup(StaticFileHandler.reset)
+        app = Application(static_path=self.path, static_manifest=True)
+        version = hashlib.md5(self.body).hexdigest()[:5]
+        with mock.patch("cyclone.static.file_hash") as file_hash:
+            url = StaticFileHandler.make_static_url(app.settings, "site.css")
+        self.assertFalse(file_hash.called)
+        self.assertEqual(url, "/static/site.css?v=" + version)
+
+    def test_no_manifest_by_default(self):
+        self.addCleanup(StaticFileHandler.reset)
+        with mock.patch("cyclone.static.build_manifest") as build_manifest:
+            Application(static_path=self.path)
+        self.assertFalse(build_manifest.called)
+
+    def test_prebuilt_manifest(self):
+        self.addCleanup(StaticFileHandler.reset)
+        filename = self.mktemp()
+        static.write_manifest({"site.css": "0123456789"}, filename)
+        app = Application(static_path=self.path, static_manifest=filename)
+        self.assertEqual(
+            StaticFileHandler.make_static_url(app.settings, "site.css"),
+            "/static/site.css?v=01234")
+
+    def test_version_debug_mode(self):
+        self.addCleanup(StaticFileHandler.reset)
+        settings = {"static_path": self.path, "debug": True}
+        Application(**settings)
+        abspath = os.path.join(self.path, "site.css")
+        first = StaticFileHandler.get_version(settings, "site.css")
+        with mock.patch("cyclone.static.file_hash") as file_hash:
+            self.assertEqual(
+                StaticFileHandler.get_version(settings, "site.css"), first)
+        self.assertFalse(file_hash.called)
+        with open(abspath, "ab") as f:
+            f.write(b"/* changed */")
+        self.assertNotEqual(
+            StaticFileHandler.get_version(settings, "site.css"), first)
+
+    @defer.inlineCallbacks
+    def test_single_range(self):
+        client = Client(Application([
+            (r"/static/(.*)", StaticFileHandler, {"path": self.path})],
+            gzip=True))
+        response = yield client.get(
+            "/static/site.css",
+            headers={"Range": "bytes=10-29", "Accept-Encoding": "gzip"})
+        self.assertEqual(response.get_status(), 206)
+        self.assertEqual(response.headers["Content-Range"],
+                         "bytes 10-29/%d" % len(self.body))
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.content, self.body[10:30])
+
+        response = yield client.get("/static/site.css",
+                                    headers={"Range": "bytes=-5"})
+        self.assertEqual(response.get_status(), 206)
+        self.assertEqual(response.content, self.body[-5:])
+
+    @defer.inlineCallbacks
+    def test_invalid_range(self):
+        # not ASCII digits: the header is ignored
+        for value in ("bytes=\u00b2-", "bytes=0-\u00b9", "bytes=a-"):
+            response = yield self._client().get(
+                "/static/site.css", headers={"Range": value})
+            self.assertEqual(response.get_status(), 200, value)
+            self.assertEqual(response.content, self.body)
+
+    @defer.inlineCallbacks
+    def test_multiple_ranges(self):
+        response = yield self._client().get(
+            "/static/site.css", headers={"Range": "bytes=0-4,100-109"})
+        self.assertEqual(response.get_status(), 206)
+        ctype = response.headers["Content-Type"]
+        self.assertTrue(ctype.startswith("multipart/byteranges; boundary="))
+        boundary = ctype.split("=", 1)[1].encode()
+        size = len(self.body)
+        self.assertEqual(response.content, b"".join([
+            b"--", boundary, b"\r\nContent-Type: text/css\r\n",
+            b"Content-Range: bytes 0-4/%d\r\n\r\n" % size, self.body[:5],
+            b"\r\n--", boundary, b"\r\nContent-Type: text/css\r\n",
+            b"Content-Range: bytes 100-109/%d\r\n\r\n" % size,
+            self.body[100:110], b"\r\n--", boundary, b"--\r\n"]))
+
+    @defer.inlineCallbacks
+    def test_if_range(self):
+        client = self._client()
+        response = yield client.get("/static/site.css")
+        etag = response.headers["Etag"]
+        modified = response.headers["Last-Modified"]
+        for validator, status in ((etag, 206), ('"other"', 200),
+                                  ("W/" + etag, 200), (modified, 206),
+                                  ("Thu, 01 Jan 1970 00:00:00 GMT", 200)):
+            response = yield client.get(
+                "/static/site.css",
+                headers={"Range": "bytes=0-9", "If-Range": validator})
+            self.assertEqual(response.get_status(), status, validator)
+
+    @defer.inlineCallbacks
+    def test_unsatisfiable_range(self):
+        client = self._client()
+        response = yield client.get("/static/site.css",
+                                    headers={"Range": "bytes=99999-"})
+        self.assertEqual(response.get_status(), 416)
+        self.assertEqual(response.headers["Content-Range"],
+                         "bytes */%d" % len(self.body))
+        # a malformed header is ignored
+        response = yield client.get("/static/site.css",
+                                    headers={"Range": "bytes=9-0"})
+        self.assertEqual(response.get_status(), 200)
+        self.assertEqual(response.headers["Accept-Ranges"], "bytes")
+        self.assertEqual(response.content, self.body)
+
+    @defer.inlineCallbacks
+    def test_ranges_streamed_over_tcp(self):
+        class StreamingHandler(StaticFileHandler):
+            STREAM_MIN_SIZE = 1
+
+        body = os.urandom(3 * 1024 * 1024)
+        with open(os.path.join(self.path, "big.bin"), "wb") as f:
+            f.write(body)
+        app = Application([(r"/static/(.*)", StreamingHandler,
+                            {"path": self.path})])
+        port = reactor.listenTCP(0, app, interface="127.0.0.1")
+        self.addCleanup(port.stopListening)
+        received = yield _fetch(
+            port.getHost().port, b"GET /static/big.bin HTTP/1.0\r\n"
+            b"Range: bytes=100-199999,2000000-\r\n\r\n")
+        headers, content = received.split(b"\r\n\r\n", 1)
+        self.assertIn(b"206", headers.split(b"\r\n")[0])
+        self.assertIn(b"Content-Length: %d" % len(content), headers)
+        boundary = re.search(b"boundary=(\\w+)", headers).group(1)
+        parts = content.split(b"--" + boundary)
+        self.assertEqual(parts[0], b"")
+        self.assertEqual(parts[-1], b"--\r\n")
+        self.assertEqual(parts[1].split(b"\r\n\r\n", 1)[1],
+                         body[100:200000] + b"\r\n")
+        self.assertEqual(parts[2].split(b"\r\n\r\n", 1)[1],
+                         body[2000000:] + b"\r\n")
+
+
+class CachedResponseTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.pending = None
+        test = self
+
+        class PageHandler(RequestHandler):
+            @cached_response(ttl=60, vary=["Accept-Language"],
+                             stale_while_revalidate=60)
+            def get(self, name):
+                test.calls.append(name)
+                if name == "cookie":
+                    self.set_cookie("a", "b")
+                elif name == "error":
+                    raise HTTPError(503)
+                elif name == "slow":
+                    test.pending = defer.Deferred()
+                    return test.pending.addCallback(
+                        lambda body: self.write(body))
+                self.set_header("X-Name", name)
+                self.add_header("X-List", "1")
+                self.write("page %s %d" % (name, len(test.calls)))
+
+        self.app = Application([(r"/(\w+)", PageHandler)])
+        self.client = Client(self.app)
+
+    @defer.inlineCallbacks
+    def test_hit(self):
+        first = yield self.client.get("/home?a=1")
+        second = yield self.client.get("/home?a=1")
+        self.assertEqual(self.calls, ["home"])
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second.content, b"page home 1")
+        self.assertEqual(second.headers["X-Name"], "home")
+        self.assertEqual(second.headers.get_list("X-List"), ["1"])
+        self.assertEqual(second.headers["Etag"], first.headers["Etag"])
+        response = yield self.client.get(
+            "/home?a=1", headers={"If-None-Match": first.headers["Etag"]})
+        self.assertEqual(response.get_status(), 304)
+        self.assertEqual(self.calls, ["home"])
+
+    @defer.inlineCallbacks
+    def test_key(self):
+        yield self.client.get("/home")
+        yield self.client.get("/home?a=2")
+        yield self.client.get("/home", headers={"Accept-Language": "pt"})
+        yield self.client.get("/other")
+        self.assertEqual(len(self.calls), 4)
+
+    @defer.inlineCallbacks
+    def test_not_cached(self):
+        for name in ("cookie", "cookie", "error", "error"):
+            yield self.client.get("/" + name)
+        self.assertEqual(len(self.calls), 4)
+        self.assertEqual(len(self.app.response_cache), 0)
+
+    @defer.inlineCallbacks
+    def test_concurrent_misses(self):
+        first = self.client.get("/slow")
+        second = self.client.get("/slow")
+        self.assertEqual(self.calls, ["slow"])
+        self.pending.callback("done")
+        responses = yield defer.gatherResults([first, second])
+        self.assertEqual([r.content for r in responses], [b"done", b"done"])
+        self.assertEqual(self.calls, ["slow"])
+
+    @defer.inlineCallbacks
+    def test_stale_while_revalidate(self):
+        first = self.client.get("/slow")
+        self.pending.callback("old")
+        yield first
+        key = ("GET", "127.0.0.1", "/slow", "", None)
+        self.app.response_cache.get(key).expires = 0
+        regenerating = self.client.get("/slow")
+        stale = yield self.client.get("/slow")
+        self.assertEqual(stale.content, b"old")
+        self.pending.callback("new")
+        response = yield regenerating
+        self.assertEqual(response.content, b"new")
+        response = yield self.client.get("/slow")
+        self.assertEqual(response.content, b"new")
+        self.assertEqual(self.calls, ["slow", "slow"])
+
+    @defer.inlineCallbacks
+    def test_deferred_store(self):
+        class Store(dict):
+            def get(self, key):
+                return defer.succeed(dict.get(self, key))
+
+            def set(self, key, value, ttl):
+                self[key] = value
+                return defer.succeed(None)
+
+        self.app.response_cache = Store()
+        yield self.client.get("/home")
+        response = yield self.client.get("/home")
+        self.assertEqual(response.content, b"page home 1")
+        self.assertEqual(len(self.app.response_cache), 1)
+
+
+class CoalescedTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.pending = []
+        test = self
+
+        class FeedHandler(RequestHandler):
+            def get(self, name):
+                test.calls.append(name)
+                d = defer.Deferred()
+                test.pending.append(d)
+                if name == "cookie":
+                    self.set_cookie("a", "b")
+                elif name == "error":
+                    def fail(ign):
+                        raise HTTPError(502)
+                    return d.addCallback(fail)
+                return d.addCallback(lambda ign: self.write(
+                    "%s %d" % (name, len(test.calls))))
+
+        self.handler_class = FeedHandler
+
+    def _client(self, **settings):
+        class DecoratedHandler(self.handler_class):
+            get = coalesced(self.handler_class.get)
+
+        handler_class = self.handler_class if settings else DecoratedHandler
+        return Client(Application([(r"/(\w+)", handler_class)], **settings))
+
+    def _finish_all(self):
+        while self.pending:
+            self.pending.pop(0).callback(None)
+
+    @defer.inlineCallbacks
+    def _get_concurrently(self, client, *requests):
+        ds = [client.get(uri, headers=headers) for uri, headers in requests]
+        self._finish_all()
+        responses = yield defer.gatherResults(ds)
+        defer.returnValue(responses)
+
+    @defer.inlineCallbacks
+    def test_coalesced(self):
+        client = self._client()
+        responses = yield self._get_concurrently(
+            client, ("/feed", None), ("/feed", None), ("/feed", None))
+        self.assertEqual(self.calls, ["feed"])
+        self.assertEqual(set(r.content for r in responses), set([b"feed 1"]))
+        # nothing is kept afterwards
+        yield self._get_concurrently(client, ("/feed", None))
+        self.assertEqual(self.calls, ["feed", "feed"])
+
+    @defer.inlineCallbacks
+    def test_key(self):
+        yield self._get_concurrently(
+            self._client(), ("/feed", None), ("/feed?page=2", None),
+            ("/feed", {"Cookie": "user=1"}), ("/other", None))
+        self.assertEqual(len(self.calls), 4)
+
+    @defer.inlineCallbacks
+    def test_application_setting(self):
+        client = self._client(coalesce_requests=True)
+        responses = yield self._get_concurrently(
+            client, ("/feed", None), ("/feed", None))
+        self.assertEqual(self.calls, ["feed"])
+        self.assertEqual(responses[1].content, b"feed 1")
+
+    @defer.inlineCallbacks
+    def test_error_shared(self):
+        responses = yield self._get_concurrently(
+            self._client(), ("/error", None), ("/error", None))
+        self.assertEqual(self.calls, ["error"])
+        self.assertEqual([r.get_status() for r in responses], [502, 502])
+
+    @defer.inlineCallbacks
+    def test_cookies_not_shared(self):
+        client = self._client()
+        first = client.get("/cookie")
+        second = client.get("/cookie")
+        self._finish_all()
+        yield first
+        # the waiting request runs the method itself
+        self._finish_all()
+        yield second
+        self.assertEqual(self.calls, ["cookie", "cookie"])
+
+    @defer.inlineCallbacks
+    def test_first_request_timeout(self):
+        class TimedHandler(self.handler_class):
+            def initialize(self):
+                if not self.application.handled:
+                    self.request_timeout = 0.05
+                self.application.handled += 1
+
+            get = coalesced(self.handler_class.get)
+
+        app = Application([(r"/(\w+)", TimedHandler)])
+        app.handled = 0
+        client = Client(app)
+        first = client.get("/feed")
+        second = client.get("/feed")
+        response = yield first
+        self.assertEqual(response.get_status(), 503)
+        # the waiting request is not sent the timeout error, it runs
+        self._finish_all()
+        response = yield second
+        self.assertEqual(response.content, b"feed 2")
+
+
+class CoroutineHandlerTest(unittest.TestCase):
+    @defer.inlineCallbacks
+    def test_async_def(self):
+        class AsyncHandler(RequestHandler):
+            async def prepare(self):
+                self.greeting = await defer.succeed("hello")
+
+            async def get(self):
+                d = defer.Deferred()
+                reactor.callLater(0, d.callback, "world")
+                name = await d
+                self.write("%s %s" % (self.greeting, name))
+
+        response = yield Client(Application([(r"/", AsyncHandler)])).get("/")
+        self.assertEqual(response.content, b"hello world")
+
+    @defer.inlineCallbacks
+    def test_async_def_error(self):
+        class AsyncHandler(RequestHandler):
+            async def get(self):
+                await defer.succeed(None)
+                raise HTTPError(418)
+
+        response = yield Client(Application([(r"/", AsyncHandler)])).get("/")
+        self.assertEqual(response.get_status(), 418)
+
+    @defer.inlineCallbacks
+    def test_sync_fast_path(self):
+        class SyncHandler(RequestHandler):
+            def get(self):
+                self.write("sync")
+
+        client = Client(Application([(r"/", SyncHandler)]))
+        with mock.patch.object(RequestHandler, "_result_deferred") as m:
+            response = yield client.get("/")
+        self.assertFalse(m.called)
+        self.assertEqual(response.content, b"sync")
+
+    @defer.inlineCallbacks
+    def test_sync_error(self):
+        class SyncHandler(RequestHandler):
+            def get(self):
+                raise HTTPError(404)
+
+        response = yield Client(Application([(r"/", SyncHandler)])).get("/")
+        self.assertEqual(response.get_status(), 404)
+
+    def test_asyncio_task(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        async def handler():
+            a = await asyncio.sleep(0, "a")
+            b = await defer.succeed("b")
+            d = defer.Deferred()
+            loop.call_soon(d.errback, ValueError("c"))
+            try:
+                await d
+            except ValueError as e:
+                c = str(e)
+            self.assertIsNotNone(asyncio.current_task())
+            return a + b + c
+
+        async def main():
+            return await web._run_coroutine(handler()).asFuture(loop)
+
+        self.assertEqual(loop.run_until_complete(main()), "abc")
+
+    def test_asyncio_task_cancelled(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        pending = defer.Deferred()
+
+        async def handler():
+            await pending
+
+        async def main():
+            d = web._run_coroutine(handler())
+            await asyncio.sleep(0)
+            d.cancel()
+            try:
+                await d.asFuture(loop)
+            except defer.CancelledError:
+                # raised by the Deferred the handler awaited
+                return pending.called
+
+        self.assertTrue(loop.run_until_complete(main()))
+
+
+class RunOnExecutorTest(unittest.TestCase):
+    def make_app(self, handler, **settings):
+        app = Application([(r"/", handler)], **settings)
+        for pool in app.thread_pools.values():
+            self.addCleanup(pool.stop)
+        return app
+
+    @defer.inlineCallbacks
+    def test_named_pool(self):
+        class BlockingHandler(RequestHandler):
+            @web.run_on_executor(pool="db")
+            def lookup(self, key):
+                return "%s from %s" % (key, threading.current_thread().name)
+
+            @defer.inlineCallbacks
+            def get(self):
+                value = yield self.lookup("x")
+                self.write(value)
+
+        app = self.make_app(BlockingHandler,
+                            thread_pools={"db": {"size": 2}})
+        response = yield Client(app).get("/")
+        self.assertEqual(response.content, b"x from PoolThread-db-0")
+        self.assertEqual(app.thread_pools["db"].stats()["completed"], 1)
+        self.assertEqual(app.thread_pools["default"].stats()["submitted"], 0)
+
+    @defer.inlineCallbacks
+    def test_rejected(self):
+        event = threading.Event()
+        self.addCleanup(event.set)
+
+        class BlockingHandler(RequestHandler):
+            @web.run_on_executor
+            def wait(self):
+                return event.wait(10)
+
+            def get(self):
+                return self.wait()
+
+        app = self.make_app(BlockingHandler, thread_pools={
+            "default": {"size": 1, "max_queue": 0}})
+        client = Client(app)
+        first = client.get("/")
+        response = yield client.get("/")
+        self.assertEqual(response.get_status(), 503)
+        event.set()
+        response = yield first
+        self.assertEqual(response.get_status(), 200)
+
+    @defer.inlineCallbacks
+    def test_process_pool(self):
+        class CPUHandler(RequestHandler):
+            @defer.inlineCallbacks
+            def get(self):
+                pool = self.application.process_pools["cpu"]
+                result = yield pool.submit(divmod, 7, 2)
+                self.write({"result": result})
+
+        app = self.make_app(CPUHandler, process_pools={"cpu": {"size": 1}})
+        pool = app.process_pools["cpu"]
+        self.addCleanup(pool.stop)
+        app.startFactory()  # warms the pool up
+        self.assertEqual(pool.stats()["submitted"], 1)
+        response = yield Client(app).get("/")
+        self.assertEqual(response.content, b'{"result": [3, 1]}')
+
+
+class RequestTimeoutTest(unittest.TestCase):
+    def hanging_handler(self):
+        test = self
+        test.cancelled = []
+
+        class HangingHandler(RequestHandler):
+            @defer.inlineCallbacks
+            def get(self):
+                test.deadline = self.deadline
+                d = defer.Deferred(test.cancelled.append)
+                yield d
+                self.write("unreachable")
+
+        return HangingHandler
+
+    @defer.inlineCallbacks
+    def test_timeout(self):
+        app = Application([(r"/", self.hanging_handler())],
+                          request_timeout=0.05)
+        response = yield Client(app).get("/")
+        self.assertEqual(response.get_status(), 503)
+        self.assertEqual(len(self.cancelled), 1)
+        self.assertTrue(self.deadline.expired)
+        self.assertEqual(self.deadline.remaining(), 0)
+
+    @defer.inlineCallbacks
+    def test_route_timeout(self):
+        app = Application([(r"/", self.hanging_handler(),
+                            {"_request_timeout": 0.05})],
+                          request_timeout_status=504)
+        response = yield Client(app).get("/")
+        self.assertEqual(response.get_status(), 504)
+        self.assertEqual(len(self.cancelled), 1)
+
+    @defer.inlineCallbacks
+    def test_timeout_in_prepare(self):
+        class HangingHandler(RequestHandler):
+            request_timeout = 0.05
+
+            async def prepare(self):
+                await defer.Deferred()
+
+            def get(self):
+                self.write("unreachable")
+
+        response = yield Client(Application([(r"/", HangingHandler)])).get(
+            "/")
+        self.assertEqual(response.get_status(), 503)
+
+    @defer.inlineCallbacks
+    def test_fast_handler(self):
+        class FastHandler(RequestHandler):
+            @defer.inlineCallbacks
+            def get(self):
+                value = yield defer.succeed("fast")
+                self.write("%s %s" % (value, self.deadline.remaining() > 0))
+
+        app = Application([(r"/", FastHandler)], request_timeout=10)
+        response = yield Client(app).get("/")
+        # trial fails the test if the timeout call is left pending
+        self.assertEqual(response.content, b"fast True")
+
+    def test_cancel_on_disconnect(self):
+        app = Application([(r"/", self.hanging_handler())],
+                          cancel_on_disconnect=True)
+        connection = httpserver.HTTPConnection()
+        connection.xheaders = False
+        Client(app).get("/", connection=connection).addErrback(
+            lambda reason: None)
+        self.assertEqual(self.cancelled, [])
+        connection.connectionLost(failure.Failure(error.ConnectionDone()))
+        self.assertEqual(len(self.cancelled), 1)
+
+    def test_deadline(self):
+        clock = task.Clock()
+        deadline = web.Deadline(10, clock)
+        clock.advance(4)
+        self.assertEqual(deadline.remaining(), 6)
+        d = deadline.limit(defer.Deferred())
+        clock.advance(6)
+        self.assertTrue(deadline.expired)
+        self.failureResultOf(d, defer.TimeoutError)
+        self.assertIsNone(web.Deadline().remaining())
+        self.assertFalse(web.Deadline().expired)
+
+
+class AdmissionControlTest(unittest.TestCase):
+    @defer.inlineCallbacks
+    def test_shed(self):
+        release = defer.Deferred()
+
+        class SlowHandler(RequestHandler):
+            @defer.inlineCallbacks
+            def get(self):
+                yield release
+                self.write("slow")
+
+        class HealthHandler(RequestHandler):
+            priority = admission.CRITICAL
+
+            def get(self):
+                self.write("ok")
+
+        app = Application([(r"/slow", SlowHandler),
+                           (r"/health", HealthHandler)],
+                          admission_control={"max_in_flight": 1,
+                                             "retry_after": 5})
+        client = Client(app)
+        slow = client.get("/slow")
+        response = yield client.get("/slow")
+        self.assertEqual(response.get_status(), 503)
+        self.assertEqual(response.headers["Retry-After"], "5")
+        response = yield client.get("/health")
+        self.assertEqual(response.content, b"ok")
+        release.callback(None)
+        self.assertEqual((yield slow).content, b"slow")
+        self.assertEqual(app.admission.stats()["in_flight"], 0)
+        response = yield client.get("/slow")
+        self.assertEqual(response.get_status(), 200)
+
+    @defer.inlineCallbacks
+    def test_route_priority(self):
+        release = defer.Deferred()
+        created = []
+
+        class SlowHandler(RequestHandler):
+            def initialize(self, priority=None):
+                # a handler argument of its own, not the admission one
+                created.append(priority)
+
+            @defer.inlineCallbacks
+            def get(self):
+                yield release
+                self.write("slow")
+
+        app = Application([(r"/slow", SlowHandler, {"priority": "mine"}),
+                           (r"/health", SlowHandler,
+                            {"_priority": admission.CRITICAL})],
+                          admission_control={"max_in_flight": 1})
+        client = Client(app)
+        slow = client.get("/slow")
+        response = yield client.get("/slow")
+        self.assertEqual(response.get_status(), 503)
+        # shed requests don't create their handler
+        self.assertEqual(created, ["mine"])
+        health = client.get("/health")
+        self.assertEqual(created, ["mine", None])
+        release.callback(None)
+        self.assertEqual((yield slow).content, b"slow")
+        self.assertEqual((yield health).content, b"slow")
+
+
+class RateLimitTest(unittest.TestCase):
+    @defer.inlineCallbacks
+    def test_rate_limited(self):
+        class SearchHandler(RequestHandler):
+            @web.rate_limited(rate=1, burst=2)
+            def get(self):
+                self.write("found")
+
+            def post(self):
+                self.write("posted")
+
+        client = Client(Application([(r"/", SearchHandler)]))
+        response = yield client.get("/")
+        self.assertEqual(response.content, b"found")
+        self.assertEqual(response.headers["RateLimit-Remaining"], "1")
+        yield client.get("/")
+        response = yield client.get("/")
+        self.assertEqual(response.get_status(), 429)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        self.assertEqual(response.headers["RateLimit-Remaining"], "0")
+        response = yield client.post("/", body="")
+        self.assertEqual(response.content, b"posted")
+
+    @defer.inlineCallbacks
+    def test_setting(self):
+        class Handler(RequestHandler):
+            def get(self):
+                self.write("ok")
+
+        limiter = ratelimit.RateLimiter(rate=1, key="route")
+        app = Application([(r"/", Handler)], rate_limit=limiter)
+        self.assertIs(app.rate_limiter, limiter)
+        client = Client(app)
+        self.assertEqual((yield client.get("/")).get_status(), 200)
+        self.assertEqual((yield client.get("/")).get_status(), 429)
+        self.assertEqual(limiter.stats()["keys"], 1)
+
+    @defer.inlineCallbacks
+    def test_shed_not_limited(self):
+        release = defer.Deferred()
+
+        class SlowHandler(RequestHandler):
+            @defer.inlineCallbacks
+            def get(self):
+                yield release
+                self.write("slow")
+
+        limiter = ratelimit.RateLimiter(rate=1, burst=5)
+        app = Application([(r"/", SlowHandler)], rate_limit=limiter,
+                          admission_control={"max_in_flight": 1,
+                                             "retry_after": 5})
+        client = Client(app)
+        slow = client.get("/")
+        response = yield client.get("/")
+        self.assertEqual(response.get_status(), 503)
+        self.assertEqual(response.headers["Retry-After"], "5")
+        self.assertNotIn("RateLimit-Remaining", response.headers)
+        self.assertEqual(limiter.stats()["allowed"], 1)
+        release.callback(None)
+        self.assertEqual((yield slow).content, b"slow")
+
+
+class SignedValueTest(unittest.TestCase):
+    secret = "0123456789abcdef"
+
+    def setUp(self):
+        web._verified_values.clear()
+        self.addCleanup(web._verified_values.clear)
+
+    def test_round_trip(self):
+        for version in (1, 2):
+            signed = web.create_signed_value(self.secret, "user", "alice",
+                                             version=version)
+            self.assertEqual(web.decode_signed_value(self.secret, "user",
+                                                     signed), b"alice")
+            web._verified_values.clear()
+            self.assertIsNone(web.decode_signed_value("other secret",
+                                                      "user", signed))
+            self.assertIsNone(web.decode_signed_value(self.secret, "name",
+                                                      signed))
+        self.assertTrue(signed.startswith(b"2|1:0|10:"))
+
+    def test_min_version(self):
+        signed = web.create_signed_value(self.secret, "user", "alice",
+                                         version=1)
+        self.assertIsNone(web.decode_signed_value(self.secret, "user",
+                                                  signed, min_version=2))
+        self.assertEqual(web.decode_signed_value(self.secret, "user",
+                                                 signed), b"alice")
+        # cached values are subject to min_version too
+        self.assertIsNone(web.decode_signed_value(self.secret, "user",
+                                                  signed, min_version=2))
+
+    def test_tampered(self):
+        signed = web.create_signed_value(self.secret, "user", "alice")
+        for tampered in (signed[:-1] + b"0" if signed[-1:] != b"0"
+                         else signed[:-1] + b"1",
+                         signed.replace(b"|8:", b"|9:"),
+                         signed[:-64], b"2|junk", b"|||"):
+            self.assertIsNone(web.decode_signed_value(self.secret, "user",
+                                                      tampered), tampered)
+        self.assertEqual(len(web._verified_values), 0)
+
+    def test_cache(self):
+        signed = web.create_signed_value(self.secret, "user", "alice")
+        web.decode_signed_value(self.secret, "user", signed)
+        with mock.patch("cyclone.web._create_signature_v2") as signature:
+            self.assertEqual(web.decode_signed_value(self.secret, "user",
+                                                     signed), b"alice")
+            self.assertFalse(signature.called)
+            # the age of cached values is still checked
+            with mock.patch("time.time", return_value=time.time() +
+                            32 * 86400):
+                self.assertIsNone(web.decode_signed_value(
+                    self.secret, "user", signed))
+
+    @defer.inlineCallbacks
+    def test_secure_cookie(self):
+        class CookieHandler(RequestHandler):
+            def get(self):
+                self.set_secure_cookie("user", "alice")
+                self.write(self.get_secure_cookie(
+                    "user", self.create_signed_value("user", "bob")))
+
+        app = Application([(r"/", CookieHandler)],
+                          cookie_secret=self.secret)
+        client = Client(app)
+        response = yield client.get("/")
+        self.assertEqual(response.content, b"bob")
+        self.assertEqual(client.cookies.get_secure_cookie("user"), b"alice")
+
+
+class SessionHandlerTest(unittest.TestCase):
+    def make_client(self, **options):
+        class SessionHandler(RequestHandler):
+            def get(self):
+                self.write(repr(sorted(self.session.items())))
+
+            def post(self):
+                action = self.get_argument("action")
+                if action == "login":
+                    self.session.regenerate()
+                    self.session["user"] = self.get_argument("user")
+                elif action == "logout":
+                    self.session.invalidate()
+                elif action == "visit":
+                    self.session["visits"] = self.session.get("visits", 0) + 1
+
+        app = Application([(r"/", SessionHandler)], session=options)
+        return app, Client(app)
+
+    @defer.inlineCallbacks
+    def test_session(self):
+        app, client = self.make_client()
+        response = yield client.get("/")
+        self.assertEqual(response.content, b"[]")
+        self.assertNotIn("Set-Cookie", response.headers)
+        response = yield client.post("/?action=login&user=alice", body="")
+        self.assertIn("httponly", response.headers["Set-Cookie"].lower())
+        session_id = client.cookies["session"].value
+        self.assertEqual(app.session_store.load(session_id),
+                         {"user": "alice"})
+        response = yield client.get("/")
+        self.assertEqual(response.content, b"[('user', 'alice')]")
+        self.assertNotIn("Set-Cookie", response.headers)
+        # saved for another ttl, so is the cookie
+        response = yield client.post("/?action=visit", body="")
+        self.assertIn("expires=", response.headers["Set-Cookie"])
+        self.assertEqual(client.cookies["session"].value, session_id)
+        # a new ID on login
+        yield client.post("/?action=login&user=bob", body="")
+        self.assertNotEqual(client.cookies["session"].value, session_id)
+        self.assertIsNone(app.session_store.load(session_id))
+        yield client.post("/?action=logout", body="")
+        self.assertEqual(client.cookies["session"].value, "")
+        response = yield client.get("/")
+        self.assertEqual(response.content, b"[]")
+
+    @defer.inlineCallbacks
+    def test_unknown_session(self):
+        app, client = self.make_client()
+        response = yield client.get("/", headers={"Cookie": "session=forged"})
+        self.assertEqual(response.content, b"[]")
+        yield client.post("/?action=login&user=alice", body="")
+        self.assertNotEqual(client.cookies["session"].value, "forged")
+
+    @defer.inlineCallbacks
+    def test_persistent(self):
+        persistent = session.SQLiteStore(self.mktemp())
+        self.addCleanup(persistent.pool.stop)
+        app, client = self.make_client(persistent=persistent)
+        yield client.post("/?action=login&user=alice", body="")
+        session_id = client.cookies["session"].value
+        self.assertEqual((yield persistent.get(session_id)),
+                         {"user": "alice"})
+        app.session_store.memory.clear()
+        response = yield client.get("/")
+        self.assertEqual(response.content, b"[('user', 'alice')]")
+        # kept in memory for another ttl, so is the cookie
+        self.assertIn("expires=", response.headers["Set-Cookie"])
+        self.assertEqual(client.cookies["session"].value, session_id)
+        yield persistent.close()
+
+    @defer.inlineCallbacks
+    def test_loaded_before_checks(self):
+        persistent = session.SQLiteStore(self.mktemp())
+        self.addCleanup(persistent.pool.stop)
+
+        class UserHandler(RequestHandler):
+            def get_current_user(self):
+                return self.session.get("user")
+
+            def get(self):
+                self.write("ok")
+
+            def post(self):
+                self.session["user"] = "alice"
+
+        limiter = ratelimit.RateLimiter(rate=1, key="user")
+        app = Application([(r"/", UserHandler)], rate_limit=limiter,
+                          session={"persistent": persistent})
+        client = Client(app)
+        yield client.post("/", body="")
+        app.session_store.memory.clear()
+        self.assertEqual((yield client.get("/")).content, b"ok")
+        # anonymous, then keyed by the user read from the session
+        self.assertEqual(limiter.stats()["keys"], 2)
+        yield persistent.close()
@@ -52,15 +52,16 @@ http://twistedmatrix.com/documents/current/core/howto/threading.html
 
 from http import cookies as http_cookies
 from http import client as http_client
+import asyncio
 import base64
 import binascii
 import calendar
 import datetime
 import email.utils
 import functools
-import gzip
 import hashlib
 import hmac
+import inspect
 import itertools
 import mimetypes
 import numbers
@@ -74,23 +75,40 @@ import traceback
 import types
 from urllib import parse as urllib_parse
 import uuid
+import zlib
 
 import cyclone
+from cyclone import admission
+from cyclone import cache
 from cyclone import escape
+from cyclone import executor
 from cyclone import httpserver
+from cyclone import httputil
 from cyclone import locale
+from cyclone import ratelimit
+from cyclone import session
+from cyclone import static
 from cyclone import template
 from cyclone.escape import utf8, _unicode
 from cyclone.util import ObjectDict
 from cyclone.util import bytes_type
 from cyclone.util import import_object
 from cyclone.util import unicode_type
-from io import BytesIO
 from twisted.python import failure
 from twisted.python import log
 from twisted.internet import defer
+from twisted.internet import error
 from twisted.internet import protocol
-from twisted.internet import reactor
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 class RequestHandler(object):
@@ -106,12 +124,22 @@ class RequestHandler(object):
     XSRF with other means (such as a XSRF token).
     More details on this vulnerability here:
     http://haacked.com/archive/2008/11/20/anatomy-of-a-subtle-json-vulnerability.aspx
+
+    Requests taking longer than request_timeout seconds (by default the
+    request_timeout application setting) have the Deferred they wait on
+    cancelled, and get a 503 error.  Handlers find the time left in
+    ``self.deadline``, a `Deadline`.
     """
     SUPPORTED_METHODS = ("GET", "HEAD", "POST", "DELETE", "PATCH", "PUT",
                          "OPTIONS")
 
     serialize_lists = False
     no_keep_alive = False
+    request_timeout = None
+    cancel_on_disconnect = None
+    priority = admission.NORMAL
+    load_session = True
+    rate_limit = True
     xsrf_cookie_name = "_xsrf"
     _template_loaders = {}  # {path: template.BaseLoader}
     _template_loader_lock = threading.Lock()
@@ -125,6 +153,13 @@ class RequestHandler(object):
         self._finished = False
         self._auto_finish = True
         self._transforms = None  # will be set in _execute
+        self._response_captures = []  # see _lead_or_wait
+        self._pending = None  # Deferred of prepare() or the handler method
+        self._cancelled = False
+        self._timeout_call = None
+        self._session = None
+        self._session_extended = False
+        self.deadline = _NO_DEADLINE
         self.path_args = None
         self.path_kwargs = None
         self.ui = ObjectDict((n, self._ui_method(m)) for n, m in
@@ -139,6 +174,10 @@ class RequestHandler(object):
         self.ui["modules"] = self.ui["_modules"]
         self.clear()
         self.request.connection.no_keep_alive = self.no_keep_alive
+        if "_request_timeout" in kwargs:
+            self.request_timeout = kwargs.pop("_request_timeout")
+        if "_priority" in kwargs:
+            self.priority = kwargs.pop("_priority")
         self.initialize(**kwargs)
 
     def initialize(self, **kwargs):
@@ -234,6 +273,7 @@ class RequestHandler(object):
             if self.request.headers.get("Connection") == "Keep-Alive":
                 self.set_header("Connection", "Keep-Alive")
         self._write_buffer = []
+        self._trailers = []
         self._status_code = 200
         self._reason = http_client.responses[200]
 
@@ -294,6 +334,16 @@ class RequestHandler(object):
         if name in self._headers:
             del self._headers[name]
 
+    def set_trailer(self, name, value):
+        """Adds a trailer field, sent after the body of a chunked response.
+
+        Trailers are only sent when the response uses the chunked transfer
+        encoding, that is when it was flushed before `finish` over
+        HTTP/1.1; otherwise they are dropped.  Announce them by setting
+        the ``Trailer`` header before the first `flush`.
+        """
+        self._trailers.append((name, self._convert_header_value(value)))
+
     def _convert_header_value(self, value):
         if isinstance(value, bytes_type):
             value = value.decode('utf-8')
@@ -374,50 +424,50 @@ class RequestHandler(object):
 
     def get_cookie(self, name, default=None):
         """Gets the value of the cookie with the given name, else default."""
-        if self.request.cookies is not None and name in self.request.cookies:
-            return self.request.cookies[name].value
+        cookies = self.request.cookies
+        if isinstance(cookies, httputil.RequestCookies):
+            return cookies.get_value(name, default)
+        if cookies is not None and name in cookies:
+            return cookies[name].value
         return default
 
     def set_cookie(self, name, value, domain=None, expires=None, path="/",
                    expires_days=None, **kwargs):
         """Sets the given cookie name/value with the given options.
 
-        Additional keyword arguments are set on the Cookie.Morsel directly.
+        Additional keyword arguments are set as cookie attributes, the
+        same way they are on a Cookie.Morsel.
         See http://docs.python.org/library/cookie.html#morsel-objects
         for available attributes.
         """
-        # The cookie library only accepts type str, in both python 2 and 3
         name = escape.native_str(name)
         value = escape.native_str(value)
-        if re.search(r"[\x00-\x20]", name + value):
+        if _INVALID_COOKIE_RE.search(name) or _INVALID_COOKIE_RE.search(value):
             # Don't let us accidentally inject bad stuff
             raise ValueError("Invalid cookie %r: %r" % (name, value))
-        if not hasattr(self, "_new_cookie"):
-            self._new_cookie = http_cookies.SimpleCookie()
-        if name in self._new_cookie:
-            del self._new_cookie[name]
-        self._new_cookie[name] = value
-        morsel = self._new_cookie[name]
+        cookie = _OutgoingCookie(name, value)
         if domain:
-            morsel["domain"] = domain
+            cookie["domain"] = domain
         if expires_days is not None and not expires:
-            expires = datetime.datetime.utcnow() + datetime.timedelta(
-                                                        days=expires_days)
-        if expires:
-            timestamp = calendar.timegm(expires.utctimetuple())
-            morsel["expires"] = email.utils.formatdate(
-                                    timestamp, localtime=False, usegmt=True)
+            cookie["expires"] = _cookie_date(
+                int(time.time() + expires_days * 86400))
+        elif expires:
+            cookie["expires"] = _cookie_date(
+                calendar.timegm(expires.utctimetuple()))
         if path:
-            morsel["path"] = path
+            cookie["path"] = path
         for k, v in kwargs.items():
             if k == 'max_age':
                 k = 'max-age'
-            morsel[k] = v
+            cookie[k] = v
+        if not hasattr(self, "_new_cookie"):
+            self._new_cookie = {}
+        self._new_cookie.pop(name, None)
+        self._new_cookie[name] = cookie
 
     def clear_cookie(self, name, path="/", domain=None):
         """Deletes the cookie with the given name."""
-        expires = datetime.datetime.utcnow() - datetime.timedelta(days=365)
-        self.set_cookie(name, value="", path=path, expires=expires,
+        self.set_cookie(name, value="", path=path, expires_days=-365,
                         domain=domain)
 
     def clear_all_cookies(self):
@@ -425,7 +475,8 @@ class RequestHandler(object):
         for name in self.request.cookies.keys():
             self.clear_cookie(name)
 
-    def set_secure_cookie(self, name, value, expires_days=30, **kwargs):
+    def set_secure_cookie(self, name, value, expires_days=30, version=None,
+                          **kwargs):
         """Signs and timestamps a cookie so it cannot be forged.
 
         You must specify the ``cookie_secret`` setting in your Application
@@ -440,11 +491,14 @@ class RequestHandler(object):
 
         Secure cookies may contain arbitrary byte values, not just unicode
         strings (unlike regular cookies)
+
+        ``version`` is the signed value format, 2 (HMAC-SHA256) by
+        default; 1 is the HMAC-SHA1 format of older versions.
         """
-        self.set_cookie(name, self.create_signed_value(name, value),
+        self.set_cookie(name, self.create_signed_value(name, value, version),
                         expires_days=expires_days, **kwargs)
 
-    def create_signed_value(self, name, value):
+    def create_signed_value(self, name, value, version=None):
         """Signs and timestamps a string so it cannot be forged.
 
         Normally used via set_secure_cookie, but provided as a separate
@@ -453,19 +507,94 @@ class RequestHandler(object):
         """
         self.require_setting("cookie_secret", "secure cookies")
         return create_signed_value(self.application.settings["cookie_secret"],
-                                   name, value)
+                                   name, value, version=version)
 
-    def get_secure_cookie(self, name, value=None, max_age_days=31):
+    def get_secure_cookie(self, name, value=None, max_age_days=31,
+                          min_version=None):
         """Returns the given signed cookie if it validates, or None.
 
         The decoded cookie value is returned as a byte string (unlike
-        `get_cookie`).
+        `get_cookie`).  Both signed value formats are accepted, unless
+        ``min_version`` is 2.  Recently verified values are cached, so
+        reading the same cookie on every request costs little.
         """
         self.require_setting("cookie_secret", "secure cookies")
         if value is None:
             value = self.get_cookie(name)
         return decode_signed_value(self.application.settings["cookie_secret"],
-                                   name, value, max_age_days=max_age_days)
+                                   name, value, max_age_days=max_age_days,
+                                   min_version=min_version)
+
+    @property
+    def session(self):
+        """The `cyclone.session.Session` of this request, a dict.
+
+        Requires the ``session`` application setting.  It is loaded before
+        `prepare` if the request has a session cookie, and is otherwise a
+        new, empty session; changes are saved when the response is
+        finished.  Handlers with ``load_session = False`` don't load it.
+        """
+        if self._session is None:
+            if self.settings.get("session") is None:
+                # an empty dict of options is fine
+                raise Exception("You must define the 'session' setting in "
+                                "your application to use sessions")
+            self._session = session.Session()
+        return self._session
+
+    def _load_session(self):
+        store = self.application.session_store
+        session_id = self.get_cookie(store.cookie_name)
+        if not session_id:
+            return None
+        data = store.load(session_id)
+        if isinstance(data, defer.Deferred):
+            return data.addCallback(self._session_loaded, session_id, True)
+        self._session_loaded(data, session_id)
+
+    def _session_loaded(self, data, session_id, extended=False):
+        if data is not None:
+            self._session = session.Session(session_id, data)
+            # kept in memory for another ttl, see SessionStore.load
+            self._session_extended = extended
+        else:
+            # expired or unknown: start over, with an ID of our own
+            self._session = session.Session()
+
+    def _set_session_cookie(self):
+        # The cookie is set again whenever the store keeps the session for
+        # another ttl, so that it doesn't expire first.
+        s = self._session
+        if s.invalidated:
+            if s.id is None and not s.previous_ids:
+                return
+        elif not s.modified and not self._session_extended:
+            return
+        if self._headers_written:
+            if s.id is None or s.invalidated:
+                log.msg("Cannot set the session cookie after headers "
+                        "written")
+            return
+        store = self.application.session_store
+        if s.invalidated:
+            self.clear_cookie(store.cookie_name)
+        else:
+            if s.id is None:
+                s.id = session.new_session_id()
+            self.set_cookie(store.cookie_name, s.id,
+                            expires_days=store.ttl / 86400.0,
+                            **store.cookie_options)
+
+    def _save_session(self):
+        s = self._session
+        store = self.application.session_store
+        for session_id in s.previous_ids:
+            store.delete(session_id).addErrback(log.err)
+        if s.invalidated:
+            if s.id is not None:
+                store.delete(s.id).addErrback(log.err)
+        elif s.modified and s.id is not None:
+            store.save(s.id, dict(s)).addErrback(log.err)
 
     def redirect(self, url, permanent=False, status=None):
         """Sends a redirect to the given (optionally relative) URL.
@@ -528,15 +657,99 @@ class RequestHandler(object):
         d.addCallbacks(self.finish, self._execute_failure)
         return d
 
-    def _insertAdditionalPageElements(self, html): # pragma: no cover
+    def render_stream(self, template_name, **kwargs):
+        """Renders the template with the given arguments as the response,
+        sending its output as it is rendered.
+
+        The output rendered so far is flushed at each ``{% flush %}`` of
+        the template, so the client gets the start of the page (e.g. its
+        ``<head>``) before the rest is rendered.  Responses flushed before
+        the end are sent with the chunked encoding, and have no ``Etag``.
+
+        The JavaScript and CSS of the UI modules rendered with
+        ``{% module %}`` are resolved before rendering, to be inserted in
+        the ``<head>`` flushed before those modules are rendered; those
+        a module only declares when rendered (``set_resources`` of
+        ``{% module Template(...) %}``) are missing from a flushed head.
+        The end of a flushed chunk which may start a ``</head>`` or
+        ``</body>`` tag is held back until the next one.
+        """
+        tags = [b"</head>", b"</body>"]
+        tail = [b""]
+
+        def write(chunk):
+            chunk = self._insert_page_elements(tail[0] + chunk, tags)
+            held = self._partial_tag_length(chunk, tags)
+            if held:
+                chunk, tail[0] = chunk[:-held], chunk[-held:]
+            else:
+                tail[0] = b""
+            self.write(chunk)
+            self.flush()
+
+        def stream():
+            t = self._load_template(template_name)
+            namespace = self.get_template_namespace()
+            namespace.update(kwargs)
+            for name in t.modules:
+                module = self.application.ui_modules.get(name)
+                if module is not None:
+                    if not hasattr(self, "_active_modules"):
+                        self._active_modules = {}
+                    if name not in self._active_modules:
+                        self._active_modules[name] = module(self)
+            return t.stream(write, **namespace)
+        d = defer.maybeDeferred(stream)
+        d.addCallback(lambda rest: self._insert_page_elements(
+            tail[0] + rest, tags))
+        d.addCallbacks(self.finish, self._execute_failure)
+        return d
+
+    def _insertAdditionalPageElements(self, html):
         """Insert the additional JS and CSS added by the modules on the page"""
+        return self._insert_page_elements(html, [b"</head>", b"</body>"])
+
+    def _insert_page_elements(self, html, tags):
+        # Inserts the elements of the modules before those of the tags
+        # (</head>, </body>) found in html, and removes them from tags.
+        if not getattr(self, "_active_modules", None):
+            return html
+        found = [tag for tag in tags if tag in html]
+        if not found:
+            return html
+        elements = self._page_elements()
+        for tag in found:
+            tags.remove(tag)
+            element = elements[tag]
+            if element:
+                if tag == b"</head>":
+                    loc = html.index(tag)
+                else:
+                    loc = html.rindex(tag)
+                html = html[:loc] + element + html[loc:]
+        return html
+
+    def _partial_tag_length(self, html, tags):
+        # The length of the end of html which may start one of the tags
+        # elements are still to be inserted before.
+        if not tags or not getattr(self, "_active_modules", None):
+            return 0
+        for length in range(max(len(tag) for tag in tags) - 1, 0, -1):
+            for tag in tags:
+                if length < len(tag) and html.endswith(tag[:length]):
+                    return length
+        return 0
+
+    def _page_elements(self):
+        # The additional JS and CSS of the active modules, by the tag they
+        # are inserted before.
         js_embed = []
         js_files = []
         css_embed = []
         css_files = []
         html_heads = []
         html_bodies = []
-        for module in getattr(self, "_active_modules", {}).values():
+        for module in self._active_modules.values():
             embed_part = module.embedded_javascript()
             if embed_part:
                 js_embed.append(utf8(embed_part))
@@ -564,52 +777,42 @@ class RequestHandler(object):
 
         def is_absolute(path):
             return any(path.startswith(x) for x in ["/", "http:", "https:"])
-        if js_files:
-            # Maintain order of JavaScript files given by modules
+
+        def unique_urls(files):
+            # Maintain order of the files given by modules
             paths = []
             unique_paths = set()
-            for path in js_files:
+            for path in files:
+                path = escape.native_str(path)
                 if not is_absolute(path):
                     path = self.static_url(path)
                 if path not in unique_paths:
                     paths.append(path)
                     unique_paths.add(path)
-            js = ''.join('<script src="' + escape.xhtml_escape(p) +
-                         '" type="text/javascript"></script>'
-                         for p in paths)
-            sloc = html.rindex('</body>')
-            html = html[:sloc] + utf8(js) + '\n' + html[sloc:]
+            return paths
+        head = []
+        body = []
+        if js_files:
+            body.append(utf8(''.join(
+                '<script src="' + escape.xhtml_escape(p) +
+                '" type="text/javascript"></script>'
+                for p in unique_urls(js_files))) + b'\n')
         if js_embed:
-            js = '<script type="text/javascript">\n//<![CDATA[\n' + \
-                '\n'.join(js_embed) + '\n//]]>\n</script>'
-            sloc = html.rindex('</body>')
-            html = html[:sloc] + js + '\n' + html[sloc:]
+            body.append(b'<script type="text/javascript">\n//<![CDATA[\n' +
+                        b'\n'.join(js_embed) + b'\n//]]>\n</script>\n')
         if css_files:
-            paths = []
-            unique_paths = set()
-            for path in css_files:
-                if not is_absolute(path):
-                    path = self.static_url(path)
-                if path not in unique_paths:
-                    paths.append(path)
-                    unique_paths.add(path)
-            css = ''.join('<link href="' + escape.xhtml_escape(p) + '" '
-                          'type="text/css" rel="stylesheet"/>'
-                          for p in paths)
-            hloc = html.index('</head>')
-            html = html[:hloc] + utf8(css) + '\n' + html[hloc:]
+            head.append(utf8(''.join(
+                '<link href="' + escape.xhtml_escape(p) + '" '
+                'type="text/css" rel="stylesheet"/>'
+                for p in unique_urls(css_files))) + b'\n')
         if css_embed:
-            css = '<style type="text/css">\n' + '\n'.join(css_embed) + \
-                '\n</style>'
-            hloc = html.index('</head>')
-            html = html[:hloc] + css + '\n' + html[hloc:]
+            head.append(b'<style type="text/css">\n' +
+                        b'\n'.join(css_embed) + b'\n</style>\n')
         if html_heads:
-            hloc = html.index('</head>')
-            html = html[:hloc] + ''.join(html_heads) + '\n' + html[hloc:]
+            head.append(b''.join(html_heads) + b'\n')
         if html_bodies:
-            hloc = html.index('</body>')
-            html = html[:hloc] + ''.join(html_bodies) + '\n' + html[hloc:]
-        return html
+            body.append(b''.join(html_bodies) + b'\n')
+        return {b"</head>": b"".join(head), b"</body>": b"".join(body)}
 
     def render_string(self, template_name, **kwargs):
         """Generate the given template with the given arguments.
@@ -617,6 +820,12 @@ class RequestHandler(object):
         We return the generated string. To generate and write a template
         as a response, use render() above.
         """
+        t = self._load_template(template_name)
+        namespace = self.get_template_namespace()
+        namespace.update(kwargs)
+        return t.generate(**namespace)
+
+    def _load_template(self, template_name):
         # If no template_path is specified, use the path of the calling file
         template_path = self.get_template_path()
         if not template_path:
@@ -631,10 +840,7 @@ class RequestHandler(object):
                 RequestHandler._template_loaders[template_path] = loader
             else:
                 loader = RequestHandler._template_loaders[template_path]
-        t = loader.load(template_name)
-        namespace = self.get_template_namespace()
-        namespace.update(kwargs)
-        return t.generate(**namespace)
+        return loader.load(template_name)
 
     def get_template_namespace(self):
         """Returns a dictionary to be used as the default template namespace.
@@ -681,6 +887,11 @@ class RequestHandler(object):
         chunk = b"".join(self._write_buffer)
         self._write_buffer = []
 
+        if include_footers and self._trailers:
+            for transform in self._transforms:
+                if isinstance(transform, ChunkedTransferEncoding):
+                    transform.trailers = self._trailers
+
         if not self._headers_written:
             self._headers_written = True
             for transform in self._transforms:
@@ -688,10 +899,18 @@ class RequestHandler(object):
                     transform.transform_first_chunk(
                     self._status_code, self._headers, chunk, include_footers)
             headers = self._generate_headers()
+            segments = [headers, chunk]
         else:
-            for transform in self._transforms:  # pragma: no cover
-                chunk = transform.transform_chunk(chunk, include_footers)
             headers = b""
+            if self._transforms:
+                # The last transform (usually the chunked encoding) returns
+                # segments, so the payload is not copied to be framed.
+                for transform in self._transforms[:-1]:
+                    chunk = transform.transform_chunk(chunk, include_footers)
+                segments = self._transforms[-1].transform_chunk_segments(
+                    chunk, include_footers)
+            else:
+                segments = [chunk]
 
         # Ignore the chunk and only write the headers for HEAD requests
         if self.request.method == "HEAD":
@@ -699,8 +918,11 @@ class RequestHandler(object):
                 self.request.write(headers)
             return
 
-        if headers or chunk:
-            self.request.write(headers + chunk)
+        segments = [s for s in segments if s]
+        if len(segments) == 1:
+            self.request.write(segments[0])
+        elif segments:
+            self.request.writeSequence(segments)
 
     def notifyFinish(self):
         """Returns a deferred, which is fired when the request is terminated
@@ -718,6 +940,15 @@ class RequestHandler(object):
         if chunk is not None:
             self.write(chunk)
 
+        if self._session is not None:
+            self._set_session_cookie()
+
+        if self._response_captures:
+            captures, self._response_captures = self._response_captures, []
+            response = self._capture_response()
+            for capture in captures:
+                capture(response)
+
         # Automatically support ETags and add the Content-Length header if
         # we have not flushed any content yet.
         if not self._headers_written:
@@ -742,6 +973,8 @@ class RequestHandler(object):
         self.request.finish()
         self._log()
         self._finished = True
+        if self._session is not None:
+            self._save_session()
         self.on_finish()
 
     def send_error(self, status_code=500, **kwargs):
@@ -769,6 +1002,9 @@ class RequestHandler(object):
                 reason = e.reason
         elif "exception" in kwargs:
             e = kwargs["exception"]
+            if isinstance(e, HTTPError) and getattr(e, "headers", None):
+                for name, value in e.headers.items():
+                    self.set_header(name, value)
             if isinstance(e, HTTPAuthenticationRequired):
                 args = ",".join(['%s="%s"' % (k, v)
                                  for k, v in e.kwargs.items()])
@@ -975,6 +1211,20 @@ class RequestHandler(object):
             self._xsrf_token = token
         return self._xsrf_token
 
+    def check_rate_limit(self, limiter, cost=1):
+        """Takes ``cost`` tokens from this request's bucket in
+        ``limiter``, a `cyclone.ratelimit.RateLimiter`.
+
+        Sets the rate limit headers of the response, and raises a 429
+        `HTTPError` if the bucket is empty.  See `rate_limited`.
+        """
+        limit = limiter.consume(limiter.key(self), cost)
+        headers = limit.headers()
+        for name, value in headers.items():
+            self.set_header(name, value)
+        if not limit.allowed:
+            raise HTTPError(429, headers=headers)
+
     def check_xsrf_cookie(self):
         """Verifies that the '_xsrf' cookie matches the '_xsrf' argument.
 
@@ -1091,6 +1341,37 @@ class RequestHandler(object):
             hasher.update(part)
         return '"' + hasher.hexdigest() + '"'
 
+    def _capture_response(self):
+        """Returns the response being finished as a `CachedResponse`.
+
+        Returns None if it can not be replayed: it was already flushed,
+        or it sets cookies.
+        """
+        if self._headers_written or hasattr(self, "_new_cookie"):
+            return None
+        headers = dict(self._headers)
+        headers.pop("Date", None)
+        etag = None
+        if self._status_code == 200 and "Etag" not in headers:
+            etag = self.compute_etag()
+        return CachedResponse(self._status_code, self._reason, headers,
+                              list(self._list_headers),
+                              b"".join(self._write_buffer), etag)
+
+    def _send_cached_response(self, response):
+        """Finishes the request with a copy of a `CachedResponse`."""
+        self.set_status(response.status_code, response.reason)
+        self._headers.update(response.headers)
+        self._list_headers.extend(response.list_headers)
+        if response.etag is not None:
+            self._headers["Etag"] = response.etag
+            inm = self.request.headers.get("If-None-Match")
+            if inm and inm.find(response.etag) != -1:
+                self.set_status(304)
+                self.finish()
+                return
+        self.finish(response.body)
+
     def _execute(self, transforms, *args, **kwargs):
         """Executes this request with the given output transforms."""
         self._transforms = transforms
@@ -1100,19 +1381,91 @@ class RequestHandler(object):
             self.path_args = [self.decode_argument(arg) for arg in args]
             self.path_kwargs = dict((k, self.decode_argument(v, name=k))
                                     for (k, v) in kwargs.items())
-            # If XSRF cookies are turned on, reject form submissions without
-            # the proper cookie
+            timeout = self.request_timeout
+            if timeout is None:
+                timeout = self.settings.get("request_timeout")
+            cancel_on_disconnect = self.cancel_on_disconnect
+            if cancel_on_disconnect is None:
+                cancel_on_disconnect = self.settings.get(
+                    "cancel_on_disconnect", False)
+            if timeout is not None:
+                from twisted.internet import reactor
+                self.deadline = Deadline(timeout, reactor)
+                self._timeout_call = reactor.callLater(timeout,
+                                                       self._on_timeout)
+            if timeout is not None or cancel_on_disconnect:
+                self.notifyFinish().addCallback(self._on_request_finished,
+                                                cancel_on_disconnect)
+            if self.load_session and self.settings.get("session") is not None:
+                loading = self._load_session()
+                if loading is not None:
+                    # not in memory, go on once it's read
+                    self._pending = loading
+                    loading.addCallbacks(self._execute_prepare,
+                                         self._execute_failure,
+                                         callbackArgs=(args, kwargs))
+                    return
+            self._execute_prepare(None, args, kwargs)
+        except Exception as e:
+            self._handle_request_exception(e)
+
+    def _execute_prepare(self, ign, args, kwargs):
+        try:
+            # After the session is loaded, for checks finding the current
+            # user in it.  If XSRF cookies are turned on, reject form
+            # submissions without the proper cookie
             if self.request.method not in ("GET", "HEAD", "OPTIONS") and \
                     self.application.settings.get("xsrf_cookies"):  # is True
                 if not getattr(self, "no_xsrf", False):
                     self.check_xsrf_cookie()
-            defer.maybeDeferred(self.prepare).addCallbacks(
-                    self._execute_handler,
-                    lambda f: self._handle_request_exception(f.value),
-                    callbackArgs=(args, kwargs))
+            if self.rate_limit and \
+                    self.settings.get("rate_limit") is not None:
+                self.check_rate_limit(self.application.rate_limiter)
+            result = self.prepare()
+            if result is None:
+                # synchronous prepare(), no need for a Deferred
+                self._execute_handler(None, args, kwargs)
+            else:
+                self._pending = self._result_deferred(result, self.prepare)
+                self._pending.addCallbacks(self._execute_handler,
+                                           self._execute_failure,
+                                           callbackArgs=(args, kwargs))
         except Exception as e:
             self._handle_request_exception(e)
 
+    def _on_timeout(self):
+        self._timeout_call = None
+        if self._finished:
+            return
+        log.msg("Request timed out after %ss: %s" % (
+                self.deadline.timeout, self._request_summary()))
+        self._cancel_pending()
+        if self._finished:
+            # the handler answered when its work was cancelled
+            return
+        if not self._headers_written:
+            self.send_error(self.settings.get("request_timeout_status", 503))
+        else:
+            # Too late for an error page, don't let a truncated response
+            # pass for a complete one.
+            self.request.connection.transport.loseConnection()
+
+    def _on_request_finished(self, reason, cancel_on_disconnect):
+        if self._timeout_call is not None:
+            self._timeout_call.cancel()
+            self._timeout_call = None
+        if reason is not None and cancel_on_disconnect and \
+                not self._finished:
+            # connection lost before the response was finished
+            self._cancel_pending()
+        return reason
+
+    def _cancel_pending(self):
+        self._cancelled = True
+        d, self._pending = self._pending, None
+        if d is not None:
+            d.cancel()
+
     def _deferred_handler(self, function, *args, **kwargs):
         try:
             result = function(*args, **kwargs)
@@ -1120,30 +1473,60 @@ class RequestHandler(object):
             return defer.fail(failure.Failure(
                               captureVars=defer.Deferred.debug))
         else:
-            if isinstance(result, defer.Deferred):
-                return result
-            elif isinstance(result, types.GeneratorType):
-                # This may degrade performance a bit, but at least avoid the
-                # server from breaking when someone call yield without
-                # decorating their handler with @inlineCallbacks.
-                log.msg("[warning] %s.%s() returned a generator. "
-                        "Perhaps it should be decorated with "
-                        "@inlineCallbacks." % (self.__class__.__name__,
-                                               self.request.method.lower()))
-                return self._deferred_handler(defer.inlineCallbacks(function),
-                                              *args, **kwargs)
-            elif isinstance(result, failure.Failure):
-                return defer.fail(result)
-            else:
-                return defer.succeed(result)
+            return self._result_deferred(result, function, *args, **kwargs)
+
+    def _result_deferred(self, result, function, *args, **kwargs):
+        """Wraps what ``function(*args, **kwargs)`` returned in a Deferred.
+
+        Coroutines (from ``async def`` methods) are run by `_run_coroutine`.
+        """
+        if isinstance(result, defer.Deferred):
+            return result
+        elif inspect.iscoroutine(result):
+            return _run_coroutine(result)
+        elif isinstance(result, types.GeneratorType):
+            # This may degrade performance a bit, but at least avoid the
+            # server from breaking when someone call yield without
+            # decorating their handler with @inlineCallbacks.
+            name = getattr(function, "__name__", self.request.method.lower())
+            log.msg("[warning] %s.%s() returned a generator. "
+                    "Perhaps it should be decorated with "
+                    "@inlineCallbacks." % (self.__class__.__name__, name))
+            return self._deferred_handler(defer.inlineCallbacks(function),
+                                          *args, **kwargs)
+        elif isinstance(result, failure.Failure):
+            return defer.fail(result)
+        else:
+            return defer.succeed(result)
 
     def _execute_handler(self, r, args, kwargs):
         if not self._finished:
             args = [self.decode_argument(arg) for arg in args]
             kwargs = dict((k, self.decode_argument(v, name=k)) for (k, v) in kwargs.items())
             function = getattr(self, self.request.method.lower(), self.default)
-            d = self._deferred_handler(function, *args, **kwargs)
-            d.addCallbacks(self._execute_success, self._execute_failure)
+            if self.request.method == "GET" and \
+                    self.settings.get("coalesce_requests"):
+                function = functools.partial(
+                    _coalesce, self, function,
+                    self.settings.get("coalesce_vary", _COALESCE_VARY))
+            try:
+                result = function(*args, **kwargs)
+            except Exception:
+                self._execute_failure(failure.Failure(
+                                      captureVars=defer.Deferred.debug))
+            else:
+                if result is None:
+                    # Synchronous handler: finish right away rather than
+                    # through a Deferred.
+                    try:
+                        self._execute_success(None)
+                    except Exception:
+                        log.err()
+                else:
+                    self._pending = self._result_deferred(result, function,
+                                                          *args, **kwargs)
+                    self._pending.addCallbacks(self._execute_success,
+                                               self._execute_failure)
             self.notifyFinish().addCallback(self.on_connection_close)
 
     def _execute_success(self, ign):
@@ -1151,6 +1534,9 @@ class RequestHandler(object):
             return self.finish()
 
     def _execute_failure(self, err):
+        if self._cancelled and err.check(defer.CancelledError):
+            # cancelled by a timeout or a disconnection, already handled
+            return
         return self._handle_request_exception(err)
 
     def _generate_headers(self):
@@ -1230,6 +1616,57 @@ class RequestHandler(object):
             self.clear_header(h)
 
 
+class Deadline(object):
+    """The time by which a request has to be finished.
+
+    Handlers find it in `RequestHandler.deadline`, to pass on to the calls
+    they make so those give up along with the request: `limit` makes a
+    Deferred fail with ``twisted.internet.defer.TimeoutError`` (cancelling
+    it) when the deadline passes, and `remaining` returns the seconds left,
+    e.g. for the timeout option of a client library. ::
+
+        @defer.inlineCallbacks
+        def get(self):
+            rows = yield self.deadline.limit(self.db.runQuery("SELECT ..."))
+
+    Requests without a ``request_timeout`` have a deadline which never
+    expires.
+    """
+    __slots__ = ("timeout", "expires", "_reactor")
+
+    def __init__(self, timeout=None, reactor=None):
+        if timeout is not None and reactor is None:
+            from twisted.internet import reactor
+        self.timeout = timeout
+        self._reactor = reactor
+        self.expires = None if timeout is None else \
+            reactor.seconds() + timeout
+
+    def __repr__(self):
+        return "<%s remaining=%r>" % (self.__class__.__name__,
+                                      self.remaining())
+
+    @property
+    def expired(self):
+        return self.expires is not None and \
+            self._reactor.seconds() >= self.expires
+
+    def remaining(self):
+        """Returns the seconds left, or None if there's no deadline."""
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - self._reactor.seconds())
+
+    def limit(self, d):
+        """Makes Deferred ``d`` time out at the deadline, and returns it."""
+        if self.expires is not None:
+            d.addTimeout(self.remaining(), self._reactor)
+        return d
+
+
+_NO_DEADLINE = Deadline()
+
+
 def asynchronous(method):
     """Wrap request handler methods with this if they are asynchronous.
 
@@ -1259,6 +1696,328 @@ def asynchronous(method):
     return wrapper
 
 
+def _run_coroutine(coro):
+    """Runs ``coro``, returning a Deferred firing with its result.
+
+    On the asyncio reactor the coroutine is run as an asyncio Task, so it
+    can await asyncio-native libraries (and use APIs like
+    ``asyncio.timeout``) as well as Deferreds.  Otherwise it is driven by
+    ``Deferred.fromCoroutine`` and may only await Deferreds.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # Startup code, called by the asyncio reactor before it starts the
+        # loop, still has to run on it.
+        reactor = sys.modules.get("twisted.internet.reactor")
+        loop = getattr(reactor, "_asyncioEventloop", None)
+        if loop is None:
+            return defer.Deferred.fromCoroutine(coro)
+    task = loop.create_task(_run_on_loop(coro, loop))
+    return defer.Deferred.fromFuture(task)
+
+
+async def _run_on_loop(coro, loop):
+    """Drives ``coro`` from an asyncio Task of ``loop``, awaiting a future
+    in place of each pending Deferred the coroutine awaits."""
+    send, value = coro.send, None
+    while True:
+        try:
+            waiting = send(value)
+        except StopIteration as e:
+            return e.value
+        send, value = coro.send, None
+        try:
+            if isinstance(waiting, defer.Deferred):
+                try:
+                    await _deferred_future(waiting, loop)
+                except asyncio.CancelledError:
+                    # the coroutine gets the CancelledError of the Deferred
+                    waiting.cancel()
+            else:
+                # an asyncio future (or None), meant for the Task
+                value = await _to_task(waiting)
+        except BaseException as e:
+            send, value = coro.throw, e
+
+
+@types.coroutine
+def _to_task(value):
+    return (yield value)
+
+
+def _deferred_future(d, loop):
+    """Returns a future of ``loop`` done when ``d`` fires.
+
+    Unlike `Deferred.asFuture`, ``d`` keeps its result, for the coroutine
+    awaiting it to read once resumed.
+    """
+    future = loop.create_future()
+
+    def fired(result):
+        if not future.done():
+            future.set_result(None)
+        return result
+    d.addBoth(fired)
+    return future
+
+
+class CachedResponse(object):
+    """A finished response, as stored by `cached_response`.
+
+    The status, headers (but ``Date``) and body are those set by the
+    handler, before output transforms (compression, chunking) applied.
+    ``etag`` is the one computed for the body, if the handler did not set
+    its own.  ``created`` and ``expires`` are timestamps.
+    """
+    __slots__ = ("status_code", "reason", "headers", "list_headers", "body",
+                 "etag", "created", "expires")
+
+    def __init__(self, status_code, reason, headers, list_headers, body,
+                 etag=None, created=None, expires=None):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.list_headers = list_headers
+        self.body = body
+        self.etag = etag
+        self.created = time.time() if created is None else created
+        self.expires = expires
+
+    @property
+    def size(self):
+        """Approximate memory use in bytes, for the cache byte budget."""
+        return len(self.body) + sum(
+            len(n) + len(v) for n, v in itertools.chain(
+                self.headers.items(), self.list_headers))
+
+
+# Statuses which may be cached without explicit freshness information,
+# see http://tools.ietf.org/html/rfc7231#section-6.1
+_CACHEABLE_STATUSES = frozenset([200, 203, 204, 300, 301, 404, 405, 410,
+                                 414, 501])
+
+
+# Request headers a response is assumed to depend on when coalescing
+_COALESCE_VARY = ("Cookie", "Authorization", "Accept", "Accept-Language")
+
+
+def _response_cache_key(request, vary):
+    return (request.method, request.host, request.path, request.query) + \
+        tuple(request.headers.get(name) for name in vary)
+
+
+def _lead_or_wait(handler, flights, key, run, keep=None):
+    """Runs ``run`` for ``handler`` unless the same ``key`` is in flight.
+
+    The first request for a key runs, and its finished response is handed
+    to the requests arriving meanwhile, which replay it instead of running
+    too.  ``keep(response)`` may return None to prevent that, in which
+    case (or if the response could not be captured, or the first request
+    timed out or was cancelled) they run anyway.
+    """
+    if key in flights:
+        def waited(response):
+            if response is None:
+                return run()
+            return handler._send_cached_response(response)
+        return flights.wait(key).addCallback(waited)
+
+    def capture(response):
+        if handler._cancelled:
+            # an error page for this request only, don't hand it on
+            response = None
+        if response is not None and keep is not None:
+            response = keep(response)
+        flights.done(key, response)
+
+    def released(ign):
+        # The connection was closed before the response finished
+        if capture in handler._response_captures:
+            handler._response_captures.remove(capture)
+            flights.done(key, None)
+        return ign
+
+    flights.start(key)
+    handler._response_captures.append(capture)
+    handler.notifyFinish().addBoth(released)
+    return run()
+
+
+def _coalesce(handler, method, vary, *args, **kwargs):
+    key = ("coalesce",) + _response_cache_key(handler.request, vary)
+    return _lead_or_wait(
+        handler, handler.application._response_flights, key,
+        lambda: handler._deferred_handler(method, *args, **kwargs))
+
+
+def coalesced(method=None, vary=_COALESCE_VARY):
+    """Makes identical concurrent GET requests share one execution.
+
+    While a request runs the decorated method, identical requests (same
+    host, path, query string and ``vary`` request headers, by default
+    ``Cookie``, ``Authorization``, ``Accept`` and ``Accept-Language``)
+    wait for it and are sent a copy of its status, headers and body. ::
+
+        class FeedHandler(web.RequestHandler):
+            @web.coalesced
+            @defer.inlineCallbacks
+            def get(self):
+                items = yield self.db.feed()
+                self.write({"items": items})
+
+    Nothing is kept once the response is finished; see `cached_response`
+    for that.  Responses which set cookies or are flushed before they
+    finish are not shared, the waiting requests run the method instead.
+    The ``coalesce_requests`` application setting does the same for all
+    GET requests, with the headers in the ``coalesce_vary`` setting.
+    """
+    if method is None:
+        return functools.partial(coalesced, vary=vary)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.request.method != "GET" or \
+                self.settings.get("coalesce_requests"):
+            # already coalesced by _execute_handler
+            return method(self, *args, **kwargs)
+        return _coalesce(self, method, vary, self, *args, **kwargs)
+    return wrapper
+
+
+def cached_response(ttl, vary=None, stale_while_revalidate=0):
+    """Caches the responses of a GET handler method for ``ttl`` seconds. ::
+
+        class HomeHandler(web.RequestHandler):
+            @web.cached_response(ttl=30, vary=["Accept-Language"])
+            @defer.inlineCallbacks
+            def get(self):
+                posts = yield self.db.latest_posts()
+                self.render("home.html", posts=posts)
+
+    Responses are kept in the ``response_cache`` of the application,
+    keyed by method, host, path, query string and the value of each
+    request header listed in ``vary``.  Hits are replayed without running
+    the method (``prepare`` still runs), so add ``Cookie`` to ``vary``
+    for pages which depend on the current user.  Only responses finished
+    in one go (not flushed), which set no cookie, have a cacheable status
+    and no ``Cache-Control: no-store``, ``no-cache`` or ``private`` are
+    stored.
+
+    Concurrent misses wait for the single request regenerating the
+    response instead of running the method too.  With
+    ``stale_while_revalidate``, an expired response is still served, for
+    that many seconds, to the requests arriving while it is regenerated.
+    Other methods than GET and HEAD are not cached.
+    """
+    vary = tuple(vary or ())
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.request.method not in ("GET", "HEAD"):
+                return method(self, *args, **kwargs)
+            app = self.application
+            store = app.response_cache
+            flights = app._response_flights
+            key = _response_cache_key(self.request, vary)
+
+            def run():
+                return self._deferred_handler(method, self, *args, **kwargs)
+
+            def keep(response):
+                cache_control = response.headers.get(
+                    "Cache-Control", "").lower()
+                if response.status_code not in _CACHEABLE_STATUSES or \
+                        "no-store" in cache_control or \
+                        "no-cache" in cache_control or \
+                        "private" in cache_control:
+                    return None
+                response.expires = response.created + ttl
+                defer.maybeDeferred(
+                    store.set, key, response,
+                    ttl + stale_while_revalidate).addErrback(log.err)
+                return response
+
+            def lookup(response):
+                if response is not None and (response.expires > time.time()
+                                             or key in flights):
+                    # fresh, or stale and already being regenerated
+                    return self._send_cached_response(response)
+                return _lead_or_wait(self, flights, key, run, keep)
+
+            return defer.maybeDeferred(store.get, key).addCallback(lookup)
+        return wrapper
+    return decorator
+
+
+def run_on_executor(method=None, pool="default"):
+    """Runs the decorated method in a thread of the named pool.
+
+    The method returns a Deferred firing with its result in the reactor
+    thread. ::
+
+        class ReportHandler(web.RequestHandler):
+            @web.run_on_executor(pool="reports")
+            def build_report(self, day):
+                return legacy_reports.build(day)  # blocks
+
+            @defer.inlineCallbacks
+            def get(self, day):
+                report = yield self.build_report(day)
+                self.write(report)
+
+    Pools are `cyclone.executor.ThreadPool` instances, configured with the
+    ``thread_pools`` application setting; there is always a ``default``
+    one.  The method runs outside of the reactor thread, so it must not
+    write the response or otherwise use the handler.  When the pool queue
+    is full the request fails with 503.
+    """
+    if method is None:
+        return functools.partial(run_on_executor, pool=pool)
+
+    def rejected(reason):
+        reason.trap(executor.RejectedError)
+        raise HTTPError(503, "%s", reason.getErrorMessage())
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            threads = self.application.thread_pools[pool]
+        except KeyError:
+            raise KeyError("No %r pool in the thread_pools setting" % pool)
+        return threads.submit(method, self, *args, **kwargs).addErrback(
+            rejected)
+    return wrapper
+
+
+def rate_limited(method=None, limiter=None, cost=1, **options):
+    """Rate limits the decorated method with token buckets.
+
+    The options are those of `cyclone.ratelimit.RateLimiter`, whose
+    buckets the method's requests take ``cost`` tokens from; or
+    ``limiter`` is a limiter shared with other methods. ::
+
+        class SearchHandler(web.RequestHandler):
+            @web.rate_limited(rate=2, burst=10, key="user")
+            def get(self):
+                ...
+
+    Requests finding their bucket empty fail with 429, and responses carry
+    rate limit headers; see `RequestHandler.check_rate_limit`.
+    """
+    if limiter is None:
+        limiter = ratelimit.RateLimiter(**options)
+    if method is None:
+        return functools.partial(rate_limited, limiter=limiter, cost=cost)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self.check_rate_limit(limiter, cost)
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
 def removeslash(method):
     """Use this decorator to remove trailing slashes from the request path.
 
@@ -1343,7 +2102,40 @@ class Application(protocol.ServerFactory):
     (this is configurable with the static_url_prefix setting),
     and we will serve /favicon.ico and /robots.txt from the same directory.
     A custom subclass of StaticFileHandler can be specified with the
-    static_handler_class setting.
+    static_handler_class setting.  With the static_precompress setting,
+    compressible files under static_path get ``.gz``/``.br`` siblings at
+    startup, which are sent to clients that accept those encodings.  The
+    static_cache_size setting (in bytes) keeps small static files in memory,
+    checking them for changes every static_cache_interval seconds.
+    The versions used by static_url are hashed when first used, unless the
+    static_manifest setting names a JSON file of prebuilt hashes (see
+    `cyclone.static`) or is True to hash the whole static_path at startup.
+
+    Responses of handler methods decorated with `cached_response` are kept
+    in the store given by the response_cache setting, by default a
+    `cyclone.cache.LRUCache` of response_cache_size bytes (64MB).  With the
+    coalesce_requests setting, identical concurrent GET requests share one
+    execution (see `coalesced`).
+
+    The request_timeout setting bounds how long requests may take, and
+    cancel_on_disconnect stops the work of requests whose client went away;
+    see `RequestHandler`.  The admission_control setting, the options of a
+    `cyclone.admission.AdmissionController` (or one), sheds requests with
+    a 503 under overload; it is kept in the admission attribute.  The
+    rate_limit setting, the options of a `cyclone.ratelimit.RateLimiter`
+    (or one), rate limits every request but those of handlers with
+    ``rate_limit = False``; it is kept in the rate_limiter attribute.  The session setting, the options of a
+    `cyclone.session.SessionStore` (or one), enables
+    `RequestHandler.session`; it is kept in the session_store attribute.
+
+    The thread_pools setting configures the `cyclone.executor.ThreadPool`
+    instances that methods decorated with `run_on_executor` run on.  It maps
+    pool names to their options, e.g. ``{"db": {"size": 4, "max_queue":
+    50}}``, or to pools.  They are kept in the thread_pools attribute, with
+    a ``default`` pool of 10 threads added if missing.  The process_pools
+    setting does the same for `cyclone.executor.ProcessPool` instances, for
+    CPU-bound work, which are warmed up when the application starts
+    listening and kept in the process_pools attribute.
 
     It is also possible to customize the error pages the application generates
     in case it does not find any handler for the incoming request by using the
@@ -1363,7 +2155,15 @@ class Application(protocol.ServerFactory):
         if transforms is None:
             self.transforms = []
             if settings.get("gzip"):
-                self.transforms.append(GZipContentEncoding)
+                gzip_options = dict(
+                    level=settings.get("gzip_level"),
+                    wbits=settings.get("gzip_wbits"),
+                    min_length=settings.get("gzip_min_length"))
+                if any(v is not None for v in gzip_options.values()):
+                    self.transforms.append(functools.partial(
+                        GZipContentEncoding, **gzip_options))
+                else:
+                    self.transforms.append(GZipContentEncoding)
             self.transforms.append(ChunkedTransferEncoding)
         else:
             self.transforms = transforms
@@ -1372,6 +2172,32 @@ class Application(protocol.ServerFactory):
         self.error_handler = error_handler or ErrorHandler
         self.default_host = default_host
         self.settings = ObjectDict(settings)
+        self.response_cache = settings.get("response_cache") or \
+            cache.LRUCache(settings.get("response_cache_size",
+                                        64 * 1024 * 1024),
+                           sizeof=lambda response: response.size)
+        self._response_flights = cache.SingleFlight()
+        self.thread_pools = {}
+        for name, pool in settings.get("thread_pools", {}).items():
+            if not isinstance(pool, executor.ThreadPool):
+                pool = executor.ThreadPool(name, **pool)
+            self.thread_pools[name] = pool
+        if "default" not in self.thread_pools:
+            self.thread_pools["default"] = executor.ThreadPool("default")
+        self.process_pools = {}
+        for name, pool in settings.get("process_pools", {}).items():
+            if not isinstance(pool, executor.ProcessPool):
+                pool = executor.ProcessPool(name, **pool)
+            self.process_pools[name] = pool
+        self.admission = settings.get("admission_control")
+        if isinstance(self.admission, dict):
+            self.admission = admission.AdmissionController(**self.admission)
+        self.rate_limiter = settings.get("rate_limit")
+        if isinstance(self.rate_limiter, dict):
+            self.rate_limiter = ratelimit.RateLimiter(**self.rate_limiter)
+        self.session_store = settings.get("session")
+        if isinstance(self.session_store, dict):
+            self.session_store = session.SessionStore(**self.session_store)
         self.ui_modules = {"linkify": _linkify,
                            "xsrf_form_html": _xsrf_form_html,
                            "Template": TemplateModule}
@@ -1387,6 +2213,20 @@ class Application(protocol.ServerFactory):
                                                 StaticFileHandler)
             static_handler_args = settings.get("static_handler_args", {})
             static_handler_args["path"] = path
+            if settings.get("static_precompress"):
+                static.precompress(path)
+                static_handler_args.setdefault("precompressed", True)
+            manifest = settings.get("static_manifest")
+            if manifest is True:
+                manifest = static.build_manifest(path)
+            elif manifest:
+                manifest = static.load_manifest(manifest)
+            if manifest:
+                static_handler_class.load_manifest(path, manifest)
+            if settings.get("static_cache_size"):
+                static_handler_args.setdefault("cache", static.StaticFileCache(
+                    settings["static_cache_size"],
+                    check_interval=settings.get("static_cache_interval", 2.0)))
             for pattern in [re.escape(static_url_prefix) + r"(.*)",
                             r"/(favicon\.ico)", r"/(robots\.txt)"]:
                 handlers.insert(0, (pattern, static_handler_class,
@@ -1425,6 +2265,7 @@ class Application(protocol.ServerFactory):
                     try:
                         handler = import_object(handler)
                     except ImportError as e:
+                        from twisted.internet import reactor
                         reactor.callWhenRunning(log.msg,
                             "Unable to load handler '%s' for "
                             "'%s': %s" % (handler, pattern, e))
@@ -1488,21 +2329,33 @@ class Application(protocol.ServerFactory):
                 except TypeError:
                     pass
 
+    def startFactory(self):
+        for pool in self.process_pools.values():
+            pool.start().addErrback(log.err)
+        if self.admission is not None:
+            self.admission.start()
+
+    def stopFactory(self):
+        if self.admission is not None:
+            self.admission.stop()
+
     def __call__(self, request):
         """Called by HTTPServer to execute the request."""
         transforms = [t(request) for t in self.transforms]
-        handler = None
+        handler_class = None
+        handler_kwargs = {}
         args = []
         kwargs = {}
         handlers = self._get_host_handlers(request)
         if not handlers:
-            handler = RedirectHandler(self, request,
-                                      url="http://" + self.default_host + "/")
+            handler_class = RedirectHandler
+            handler_kwargs = dict(url="http://" + self.default_host + "/")
         else:
             for spec in handlers:
                 match = spec.regex.match(request.path)
                 if match:
-                    handler = spec.handler_class(self, request, **spec.kwargs)
+                    handler_class = spec.handler_class
+                    handler_kwargs = spec.kwargs
                     if spec.regex.groups:
                         # None-safe wrapper around url_unescape to handle
                         # unmatched optional groups correctly
@@ -1523,16 +2376,25 @@ class Application(protocol.ServerFactory):
                         else:
                             args = [unquote(s) for s in match.groups()]
                     break
-            if not handler:
-                handler = self.error_handler(self, request, status_code=404)
-
-        # In debug mode, re-compile templates and reload static files on every
-        # request so you don't need to restart to see changes
+            if not handler_class:
+                handler_class = self.error_handler
+                handler_kwargs = dict(status_code=404)
+
+        # Shed before the handler (and its initialize()) costs anything
+        if self.admission is not None and not self.admission.admit(
+                request, handler_kwargs.get("_priority",
+                                            handler_class.priority)):
+            handler_class = _OverloadedHandler
+            handler_kwargs = dict(retry_after=self.admission.retry_after)
+        handler = handler_class(self, request, **handler_kwargs)
+
+        # In debug mode, re-compile templates on every request so you don't
+        # need to restart to see changes (static file versions are checked
+        # by StaticFileHandler.get_version)
         if self.settings.get("debug"):
             with RequestHandler._template_loader_lock:
                 for loader in RequestHandler._template_loaders.values():
                     loader.reset()
-            StaticFileHandler.reset()
 
         handler._execute(transforms, *args, **kwargs)
         return handler
@@ -1583,12 +2445,15 @@ class HTTPError(Exception):
         to pass in the status line along with ``status_code``.  Normally
         determined automatically from ``status_code``, but can be used
         to use a non-standard numeric code.
+    :arg dict headers: Keyword-only argument.  Headers to set on the error
+        response, e.g. ``Retry-After``.
     """
     def __init__(self, status_code, log_message=None, *args, **kwargs):
         self.status_code = status_code
         self.log_message = log_message
         self.args = args
         self.reason = kwargs.get("reason", None)
+        self.headers = kwargs.get("headers", None)
 
     def __str__(self):
         if self.log_message:
@@ -1617,6 +2482,8 @@ class HTTPAuthenticationRequired(HTTPError):
 
 class ErrorHandler(RequestHandler):
     """Generates an error response with status_code for all requests."""
+    load_session = False
+
     def initialize(self, status_code):
         self.set_status(status_code)
 
@@ -1630,6 +2497,19 @@ class ErrorHandler(RequestHandler):
         pass
 
 
+class _OverloadedHandler(ErrorHandler):
+    """Sheds a request turned away by the admission controller."""
+    rate_limit = False
+
+    def initialize(self, retry_after):
+        ErrorHandler.initialize(self, 503)
+        self.retry_after = retry_after
+
+    def write_error(self, status_code, **kwargs):
+        self.set_header("Retry-After", self.retry_after)
+        ErrorHandler.write_error(self, status_code, **kwargs)
+
+
 class RedirectHandler(RequestHandler):
     """Redirects the client to the given URL for all GET requests.
 
@@ -1665,20 +2545,54 @@ class StaticFileHandler(RequestHandler):
     want browsers to cache a file indefinitely, send them to, e.g.,
     /static/images/myimage.png?v=xxx. Override ``get_cache_time`` method for
     more fine-grained cache control.
+
+    If the "precompressed" argument is true, a ``.br`` or ``.gz`` sibling of
+    the requested file is sent instead when the client accepts that content
+    encoding (see `cyclone.static`).
+
+    ``Range`` requests (honoring ``If-Range``) are answered with a single
+    range or a ``multipart/byteranges`` body; ranges apply to the encoded
+    file when a precompressed sibling is sent.
     """
     CACHE_MAX_AGE = 86400 * 365 * 10  # 10 years
-
+    PRECOMPRESSED_ENCODINGS = ("br", "gzip")
+    # Files at least this big are streamed from disk (with sendfile when
+    # possible) instead of being read in memory; they are not compressed
+    # on the fly, so precompress large text assets.
+    STREAM_MIN_SIZE = 1024 * 1024
+    # Larger multi-range requests get the whole file instead
+    MAX_RANGES = 16
+    load_session = False
+
+    # abs_path -> md5 hex digest (or None).  load_manifest swaps in a new
+    # dict and single key updates are atomic, so no lock is needed.
     _static_hashes = {}
-    _lock = threading.Lock()  # protects _static_hashes
+    _static_stamps = {}  # abs_path -> (mtime, size), debug mode only
 
-    def initialize(self, path, default_filename=None):
+    def initialize(self, path, default_filename=None, precompressed=False,
+                   cache=None):
         self.root = "%s%s" % (os.path.abspath(path), os.path.sep)
         self.default_filename = default_filename
+        self.precompressed = precompressed
+        self.cache = cache
 
     @classmethod
     def reset(cls):
-        with cls._lock:
-            cls._static_hashes = {}
+        cls._static_hashes = {}
+        cls._static_stamps = {}
+
+    @classmethod
+    def load_manifest(cls, static_path, manifest):
+        """Adds the version hashes of a manifest to the ones known.
+
+        ``manifest`` maps paths relative to ``static_path`` to hashes, as
+        returned by `cyclone.static.build_manifest`.  `Application` calls
+        this at startup, see the ``static_manifest`` setting.
+        """
+        hashes = dict(cls._static_hashes)
+        for path, hsh in manifest.items():
+            hashes[os.path.join(static_path, path)] = hsh
+        cls._static_hashes = hashes
 
     def head(self, path):
         self.get(path, include_body=False)
@@ -1690,26 +2604,46 @@ class StaticFileHandler(RequestHandler):
         # it needs to be temporarily added back for requests to root/
         if not (abspath + os.path.sep).startswith(self.root):
             raise HTTPError(403, "%s is not in root static directory", path)
-        if os.path.isdir(abspath) and self.default_filename is not None:
-            # need to look at the request.path here for when path is empty
-            # but there is some prefix to the path that was already
-            # trimmed by the routing
-            if not self.request.path.endswith("/"):
-                self.redirect("%s/" % self.request.path)
-            abspath = os.path.join(abspath, self.default_filename)
-        if not os.path.exists(abspath):
-            raise HTTPError(404)
-        if not os.path.isfile(abspath):
-            raise HTTPError(403, "%s is not a file", path)
-
-        stat_result = os.stat(abspath)
-        modified = datetime.datetime.fromtimestamp(stat_result[stat.ST_MTIME])
-
-        self.set_header("Last-Modified", modified)
-
-        mime_type, encoding = mimetypes.guess_type(abspath)
+        entry = None
+        if self.cache is not None:
+            entry = self.cache.get(abspath)
+        if entry is None:
+            if os.path.isdir(abspath) and self.default_filename is not None:
+                # need to look at the request.path here for when path is
+                # empty but there is some prefix to the path that was
+                # already trimmed by the routing
+                if not self.request.path.endswith("/"):
+                    self.redirect("%s/" % self.request.path)
+                abspath = os.path.join(abspath, self.default_filename)
+                if self.cache is not None:
+                    entry = self.cache.get(abspath)
+        if entry is None:
+            if not os.path.exists(abspath):
+                raise HTTPError(404)
+            if not os.path.isfile(abspath):
+                raise HTTPError(403, "%s is not a file", path)
+            entry = self.load_file(abspath)
+
+        modified = entry.modified
+        mime_type = entry.mime_type
+        # Header values are rendered once per file and cached with it
+        self._headers["Last-Modified"] = entry.last_modified
         if mime_type:
-            self.set_header("Content-Type", mime_type)
+            self._headers["Content-Type"] = mime_type
+
+        if self.precompressed:
+            # The body depends on Accept-Encoding even when we end up
+            # sending the original file.
+            self.set_header("Vary", "Accept-Encoding")
+            content_encoding, sidecar = self.get_precompressed_path(
+                entry.abspath, entry.stat_result, entry.sidecars)
+            if content_encoding:
+                self.set_header("Content-Encoding", content_encoding)
+                entry = None
+                if self.cache is not None:
+                    entry = self.cache.get(sidecar)
+                if entry is None:
+                    entry = self.load_file(sidecar)
 
         cache_time = self.get_cache_time(path, modified, mime_type)
 
@@ -1720,28 +2654,226 @@ class StaticFileHandler(RequestHandler):
 
         self.set_extra_headers(path)
 
-        # Check the If-Modified-Since, and don't send the result if the
-        # content has not been modified
+        etag = entry.etag
+        if etag is not None:
+            self._headers["Etag"] = etag
+
+        # Check If-None-Match (or else If-Modified-Since), and don't send
+        # the result if the content has not been modified
+        inm_value = self.request.headers.get("If-None-Match")
         ims_value = self.request.headers.get("If-Modified-Since")
-        if ims_value is not None:
+        if inm_value is not None:
+            if etag is not None and (inm_value.strip() == "*" or
+                                     inm_value.find(etag) != -1):
+                self.set_status(304)
+                return
+        elif ims_value is not None:
             date_tuple = email.utils.parsedate(ims_value)
             if_since = datetime.datetime.fromtimestamp(time.mktime(date_tuple))
             if if_since >= modified:
                 self.set_status(304)
                 return
 
-        with open(abspath, "rb") as file:
-            data = file.read()
-            if include_body:
-                self.write(data)
+        size = entry.stat_result.st_size
+        self.set_header("Accept-Ranges", "bytes")
+        if not include_body:
+            assert self.request.method == "HEAD"
+            self.set_header("Content-Length", size)
+            return
+
+        ranges = self.get_request_ranges(size, etag, modified)
+        if ranges is None:
+            return self.send_file(entry, [(b"", 0, size)])
+        elif not ranges:
+            self.set_status(416)
+            self.set_header("Content-Range", "bytes */%d" % size)
+            return
+
+        self.set_status(206)
+        if len(ranges) == 1:
+            start, stop = ranges[0]
+            self.set_header("Content-Range",
+                            "bytes %d-%d/%d" % (start, stop - 1, size))
+            return self.send_file(entry, [(b"", start, stop)])
+
+        boundary = uuid.uuid4().hex
+        part_type = self._headers.get("Content-Type")
+        self.set_header("Content-Type",
+                        "multipart/byteranges; boundary=%s" % boundary)
+        parts = []
+        for start, stop in ranges:
+            # each delimiter after the first ends the previous part's data
+            header = "%s--%s\r\n" % ("\r\n" if parts else "", boundary)
+            if part_type:
+                header += "Content-Type: %s\r\n" % part_type
+            header += "Content-Range: bytes %d-%d/%d\r\n\r\n" % (
+                start, stop - 1, size)
+            parts.append((utf8(header), start, stop))
+        return self.send_file(entry, parts,
+                              utf8("\r\n--%s--\r\n" % boundary))
+
+    def send_file(self, entry, parts, trailer=b""):
+        """Sends windows of a `cyclone.static.StaticFile` as the body.
+
+        ``parts`` is a list of ``(prefix, start, stop)`` tuples: each
+        ``prefix`` is written before the bytes in ``[start, stop)``, and
+        ``trailer`` after the last window.  Cached content is sliced in
+        memory.  Otherwise bodies smaller than ``STREAM_MIN_SIZE`` are
+        read with ``os.pread`` and buffered like any other response;
+        larger ones are streamed from disk (with sendfile when possible)
+        and the returned Deferred fires when the last byte has been
+        handed to the transport, or the connection was lost, which stops
+        sending the remaining windows.
+        """
+        if entry.content is not None:
+            content = entry.content
+            for prefix, start, stop in parts:
+                self.write(prefix + content[start:stop])
+            self.write(trailer)
+            return
+
+        abspath = entry.abspath
+        length = len(trailer) + sum(len(prefix) + stop - start
+                                    for prefix, start, stop in parts)
+        if length < self.STREAM_MIN_SIZE:
+            with open(abspath, "rb") as file:
+                fd = file.fileno()
+                for prefix, start, stop in parts:
+                    self.write(prefix + os.pread(fd, stop - start, start))
+            self.write(trailer)
+            return
+
+        # Large bodies are streamed rather than buffered, so the headers
+        # go out first with the final Content-Length.
+        self.set_header("Content-Length", length)
+        self.flush()
+        file = open(abspath, "rb")
+
+        @defer.inlineCallbacks
+        def stream():
+            try:
+                for prefix, start, stop in parts:
+                    if prefix:
+                        self.request.write(prefix)
+                    yield self.request.sendfile(file, start, stop - start)
+                if trailer:
+                    self.request.write(trailer)
+            except error.ConnectionLost:
+                # nobody to answer, nor to send the other windows to
+                pass
+            finally:
+                file.close()
+        return stream()
+
+    def get_request_ranges(self, size, etag, modified):
+        """Returns the byte ranges requested for a file of ``size`` bytes.
+
+        Returns ``None`` to send the whole file: there is no (valid)
+        ``Range`` header, it asks for more than ``MAX_RANGES`` windows, or
+        the ``If-Range`` validator does not match the current ``etag`` or
+        ``modified`` date.  An empty list means no range is satisfiable.
+        """
+        range_header = self.request.headers.get("Range")
+        if range_header is None:
+            return None
+        if_range = self.request.headers.get("If-Range")
+        if if_range is not None:
+            if_range = if_range.strip()
+            if if_range.startswith(('"', "W/")):
+                # only strong comparison is allowed for ranges
+                if etag is None or if_range != etag:
+                    return None
             else:
-                assert self.request.method == "HEAD"
-                self.set_header("Content-Length", len(data))
+                date_tuple = email.utils.parsedate(if_range)
+                if date_tuple is None or datetime.datetime.fromtimestamp(
+                        time.mktime(date_tuple)) != modified:
+                    return None
+        ranges = httputil.parse_byte_ranges(range_header, size)
+        if ranges is not None and len(ranges) > self.MAX_RANGES:
+            return None
+        return ranges
 
     def set_extra_headers(self, path):
         """For subclass to add extra headers to the response"""
         pass
 
+    def load_file(self, abspath):
+        """Returns a `cyclone.static.StaticFile` for the file at ``abspath``.
+
+        With a ``cache``, files small enough for it are read in memory
+        and added to it.  The cache is shared, so the rendered headers
+        (`get_etag` in particular) are those of the handler which loaded
+        the file first.
+        """
+        cache = self.cache
+        stat_result = os.stat(abspath)
+        content = None
+        if cache is not None and \
+                stat_result.st_size <= cache.max_file_size and \
+                stat_result.st_size < self.STREAM_MIN_SIZE:
+            with open(abspath, "rb") as file:
+                stat_result = os.fstat(file.fileno())
+                content = file.read()
+        modified = datetime.datetime.fromtimestamp(stat_result[stat.ST_MTIME])
+        mime_type, encoding = mimetypes.guess_type(abspath)
+        etag = self.get_etag(stat_result)
+        if etag is not None:
+            etag = self._convert_header_value(etag)
+        entry = static.StaticFile(
+            abspath, stat_result, mime_type, modified,
+            self._convert_header_value(modified), etag, content)
+        if content is not None:
+            cache.put(entry)
+        return entry
+
+    def get_etag(self, stat_result):
+        """Returns the ETag for a file, computed from its ``os.stat`` result.
+
+        The default uses the modification time and size so the file does
+        not have to be read.  Override to return ``None`` to disable ETags.
+        """
+        return '"%x-%x"' % (int(stat_result.st_mtime * 1000000),
+                            stat_result.st_size)
+
+    def get_precompressed_path(self, abspath, stat_result, sidecars=None):
+        """Returns a ``(content_encoding, path)`` tuple for the file to send.
+
+        Looks for a precompressed sibling of ``abspath`` (``app.js.br``,
+        ``app.js.gz``) in a content coding accepted by the client, and
+        ignores siblings older than the original file.  Returns
+        ``(None, abspath)`` if there is no usable sibling.
+
+        ``sidecars``, the `cyclone.static.StaticFile.sidecars` of a cached
+        file, keeps what was found, so siblings are only looked up again
+        when the cache checks the file.
+
+        Siblings can be generated with ``python -m cyclone.static
+        precompress`` or the ``static_precompress`` application setting.
+        """
+        accepted = httputil.parse_accept_encoding(
+            self.request.headers.get("Accept-Encoding"))
+        candidates = [(accepted.get(coding, accepted.get("*", 0.0)), coding)
+                      for coding in self.PRECOMPRESSED_ENCODINGS]
+        # Highest q-value first; ties keep PRECOMPRESSED_ENCODINGS order
+        candidates.sort(key=lambda c: -c[0])
+        for qvalue, coding in candidates:
+            if qvalue <= 0:
+                break
+            if sidecars is not None and coding in sidecars:
+                sidecar = sidecars[coding]
+            else:
+                sidecar = abspath + static.SIDECAR_EXTENSIONS[coding]
+                try:
+                    if os.stat(sidecar).st_mtime < stat_result.st_mtime:
+                        sidecar = None
+                except OSError:
+                    sidecar = None
+                if sidecars is not None:
+                    sidecars[coding] = sidecar
+            if sidecar is not None:
+                return coding, sidecar
+        return None, abspath
+
     def get_cache_time(self, path, modified, mime_type):
         """Override to customize cache control behavior.
 
@@ -1781,22 +2913,35 @@ class StaticFileHandler(RequestHandler):
         ``settings`` is the `Application.settings` dictionary and ``path``
         is the relative location of the requested asset on the filesystem.
         The returned value should be a string, or ``None`` if no version
-        could be determined.
+        could be determined.  Hashes come from the manifest loaded at
+        startup; files missing from it are hashed on first use.
         """
         abs_path = os.path.join(settings["static_path"], path)
-        with cls._lock:
-            hashes = cls._static_hashes
-            if abs_path not in hashes:
-                try:
-                    f = open(abs_path, "rb")
-                    hashes[abs_path] = hashlib.md5(f.read()).hexdigest()
-                    f.close()
-                except Exception:
-                    log.msg("Could not open static file %r" % path)
-                    hashes[abs_path] = None
-            hsh = hashes.get(abs_path)
-            if hsh:
-                return hsh[:5]
+        hashes = cls._static_hashes
+        if settings.get("debug"):
+            # Files change under a debug server: hash them again when
+            # their modification time or size is not the one last seen.
+            try:
+                st = os.stat(abs_path)
+                stamp = (st.st_mtime, st.st_size)
+            except OSError:
+                stamp = None
+            if cls._static_stamps.get(abs_path, False) != stamp:
+                cls._static_stamps[abs_path] = stamp
+                hashes.pop(abs_path, None)
+        try:
+            hsh = hashes[abs_path]
+        except KeyError:
+            # Not in the manifest: hash it now.  Racing threads may both
+            # do it, with the same result.
+            try:
+                hsh = static.file_hash(abs_path)
+            except Exception:
+                log.msg("Could not open static file %r" % path)
+                hsh = None
+            hashes[abs_path] = hsh
+        if hsh:
+            return hsh[:5]
         return None
 
     def parse_url_path(self, url_path):
@@ -1841,9 +2986,67 @@ class OutputTransform(object):
     def transform_chunk(self, chunk, finishing):
         return chunk
 
+    def transform_chunk_segments(self, chunk, finishing):
+        """Like `transform_chunk`, but returns a list of byte strings.
+
+        The last transform of a response is asked for segments, which are
+        handed to the transport as they are rather than concatenated.
+        """
+        return [self.transform_chunk(chunk, finishing)]
+
+
+class _ZlibCompressor(object):
+    """Streaming deflate compressor producing gzip framed output."""
+    def __init__(self, level, wbits, mem_level):
+        self._obj = zlib.compressobj(level, zlib.DEFLATED, 16 + wbits,
+                                     mem_level)
+
+    def compress(self, data, finishing):
+        data = self._obj.compress(data)
+        if finishing:
+            return data + self._obj.flush(zlib.Z_FINISH)
+        return data + self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+
+class _BrotliCompressor(object):
+    def __init__(self, quality):
+        self._obj = brotli.Compressor(quality=quality)
+
+    def compress(self, data, finishing):
+        data = self._obj.process(data)
+        if finishing:
+            return data + self._obj.finish()
+        return data + self._obj.flush()
+
+
+class _ZstdCompressor(object):
+    def __init__(self, level):
+        self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data, finishing):
+        data = self._obj.compress(data)
+        if finishing:
+            return data + self._obj.flush(
+                zstandard.COMPRESSOBJ_FLUSH_FINISH)
+        return data + self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
 
 class GZipContentEncoding(OutputTransform):
-    """Applies the gzip content encoding to the response.
+    """Applies a compressed content encoding to the response.
+
+    The coding is negotiated from the ``Accept-Encoding`` request header,
+    honoring q-values.  ``gzip`` is always available; ``br`` and ``zstd``
+    are offered as well when the ``brotli`` and ``zstandard`` modules can
+    be imported.  When the client rates several codings equally, the
+    order of `CODINGS` decides.
+
+    Compression runs on a single streaming compressor per response.  The
+    output is only sync-flushed when the handler explicitly calls
+    ``flush()``, so a response written in one go is compressed as a whole.
+
+    The level, window size and minimum length may be tuned per application
+    with the ``gzip_level``, ``gzip_wbits`` and ``gzip_min_length`` settings,
+    or by overriding the class attributes in a subclass.
 
     See http://www.w3.org/Protocols/rfc2616/rfc2616-sec14.html#sec14.11
     """
@@ -1851,53 +3054,111 @@ class GZipContentEncoding(OutputTransform):
         "text/plain", "text/html", "text/css", "text/xml",
         "application/javascript", "application/x-javascript",
         "application/xml", "application/atom+xml",
-        "text/javascript", "application/json", "application/xhtml+xml"])
-    MIN_LENGTH = 5
+        "text/javascript", "application/json", "application/xhtml+xml",
+        "image/svg+xml"])
+    # Below this size the gzip framing overhead and the extra CPU are not
+    # worth it: the response would most likely fit in a single packet anyway.
+    MIN_LENGTH = 1024
+    CODINGS = ("br", "zstd", "gzip")
+    GZIP_LEVEL = 6
+    GZIP_WBITS = zlib.MAX_WBITS
+    GZIP_MEM_LEVEL = 8
+    BROTLI_QUALITY = 4
+    ZSTD_LEVEL = 3
+
+    def __init__(self, request, level=None, wbits=None, min_length=None):
+        if level is not None:
+            self.GZIP_LEVEL = level
+        if wbits is not None:
+            self.GZIP_WBITS = wbits
+        if min_length is not None:
+            self.MIN_LENGTH = min_length
+        self._compressor = None
+        self._coding = None
+        if request.supports_http_1_1():
+            self._coding = self.select_coding(
+                request.headers.get("Accept-Encoding"))
 
-    def __init__(self, request):
-        self._gzipping = request.supports_http_1_1() and \
-            "gzip" in request.headers.get("Accept-Encoding", [])
+    @classmethod
+    def available_codings(cls):
+        """Returns the codings of `CODINGS` that can be produced here."""
+        available = {"gzip": True, "br": brotli is not None,
+                     "zstd": zstandard is not None}
+        return [c for c in cls.CODINGS if available.get(c)]
+
+    @classmethod
+    def select_coding(cls, accept_encoding):
+        """Returns the best coding for the given ``Accept-Encoding`` value.
+
+        Returns ``None`` if the client does not accept any coding we can
+        produce.
+        """
+        if not accept_encoding:
+            return None
+        accepted = httputil.parse_accept_encoding(accept_encoding)
+        default = accepted.get("*", 0.0)
+        best, best_q = None, 0.0
+        for coding in cls.available_codings():
+            qvalue = accepted.get(coding, default)
+            if coding == "gzip":
+                qvalue = max(qvalue, accepted.get("x-gzip", 0.0))
+            if qvalue > best_q:
+                best, best_q = coding, qvalue
+        return best
+
+    def _create_compressor(self):
+        if self._coding == "br":
+            return _BrotliCompressor(self.BROTLI_QUALITY)
+        elif self._coding == "zstd":
+            return _ZstdCompressor(self.ZSTD_LEVEL)
+        return _ZlibCompressor(self.GZIP_LEVEL, self.GZIP_WBITS,
+                               self.GZIP_MEM_LEVEL)
 
     def transform_first_chunk(self, status_code, headers, chunk, finishing):
-        if 'Vary' in headers:
-            headers['Vary'] += ', Accept-Encoding'
-        else:
-            headers['Vary'] = 'Accept-Encoding'
-        if self._gzipping:
+        vary = headers.get("Vary")
+        if not vary:
+            headers["Vary"] = "Accept-Encoding"
+        elif "accept-encoding" not in vary.lower():
+            headers["Vary"] = vary + ", Accept-Encoding"
+        if self._coding:
             ctype = _unicode(headers.get("Content-Type", "")).split(";")[0]
-            self._gzipping = (ctype in self.CONTENT_TYPES) and \
-                (not finishing or len(chunk) >= self.MIN_LENGTH) and \
-                (finishing or "Content-Length" not in headers) and \
-                ("Content-Encoding" not in headers)
-        if self._gzipping:
-            headers["Content-Encoding"] = "gzip"
-            self._gzip_value = BytesIO()
-            self._gzip_file = gzip.GzipFile(mode="w", fileobj=self._gzip_value)
+            if (ctype not in self.CONTENT_TYPES or
+                    (finishing and len(chunk) < self.MIN_LENGTH) or
+                    (not finishing and "Content-Length" in headers) or
+                    "Content-Encoding" in headers or
+                    # byte ranges refer to the identity encoding
+                    "Content-Range" in headers):
+                self._coding = None
+        if self._coding:
+            headers["Content-Encoding"] = self._coding
+            self._compressor = self._create_compressor()
             chunk = self.transform_chunk(chunk, finishing)
             if "Content-Length" in headers:
                 headers["Content-Length"] = str(len(chunk))
         return status_code, headers, chunk
 
     def transform_chunk(self, chunk, finishing):
-        if self._gzipping:
-            self._gzip_file.write(chunk)
+        if self._compressor is not None:
+            if not chunk and not finishing:
+                # Nothing new to send; don't emit an empty sync block
+                return chunk
+            chunk = self._compressor.compress(chunk, finishing)
             if finishing:
-                self._gzip_file.close()
-            else:
-                self._gzip_file.flush()
-            chunk = self._gzip_value.getvalue()
-            self._gzip_value.truncate(0)
-            self._gzip_value.seek(0)
+                self._compressor = None
         return chunk
 
 
 class ChunkedTransferEncoding(OutputTransform):
     """Applies the chunked transfer encoding to the response.
 
+    ``trailers``, a list of ``(name, value)`` pairs, are sent after the
+    last chunk (see `RequestHandler.set_trailer`).
+
     See http://www.w3.org/Protocols/rfc2616/rfc2616-sec3.html#sec3.6.1
     """
     def __init__(self, request):
         self._chunking = request.supports_http_1_1()
+        self.trailers = None
 
     def transform_first_chunk(self, status_code, headers, chunk, finishing):
         # 304 responses have no body (not even a zero-length body), and so
@@ -1913,14 +3174,27 @@ class ChunkedTransferEncoding(OutputTransform):
 
     def transform_chunk(self, block, finishing):
         if self._chunking:
-            # Don't write out empty chunks because that means END-OF-STREAM
-            # with chunked encoding
-            if block:
-                block = "%s\r\n%s\r\n" % (utf8("%x" % len(block)), block)
-            if finishing:
-                block = "%s0\r\n\r\n" % block
+            return b"".join(self.transform_chunk_segments(block, finishing))
         return block
 
+    def transform_chunk_segments(self, block, finishing):
+        if not self._chunking:
+            return [block]
+        # Don't write out empty chunks because that means END-OF-STREAM
+        # with chunked encoding
+        if block:
+            segments = [b"%x\r\n" % len(block), block, b"\r\n"]
+        else:
+            segments = []
+        if finishing:
+            if self.trailers:
+                segments.append(b"0\r\n" + b"".join(
+                    utf8(name) + b": " + utf8(value) + b"\r\n"
+                    for name, value in self.trailers) + b"\r\n")
+            else:
+                segments.append(b"0\r\n\r\n")
+        return segments
+
 
 def authenticated(method):
     """Decorate methods with this to require that the user be logged in."""
@@ -2164,37 +3438,128 @@ class URLSpec(object):
 url = URLSpec
 
 
-def _time_independent_equals(a, b) -> bool:
-    if len(a) != len(b):
-        return False
-    result = 0
-    for x, y in zip(a, b):
-        result |= x ^ y
-    return result == 0
+_INVALID_COOKIE_RE = re.compile(r"[\x00-\x20]")
+_COOKIE_ATTRIBUTES = http_cookies.Morsel._reserved  # name: spelling
+_COOKIE_FLAGS = dict((name, _COOKIE_ATTRIBUTES[name])
+                     for name in http_cookies.Morsel._flags)
 
 
-def create_signed_value(secret, name, value):
-    timestamp = utf8(str(int(time.time())))
-    value = base64.b64encode(utf8(value))
-    signature = _create_signature(secret, name, value, timestamp)
-    value = b"|".join([value, timestamp, signature])
-    return value
+class _OutgoingCookie(dict):
+    """A cookie set by a response: a Cookie.Morsel, without the cost.
 
+    Its attributes are the items, as on a Morsel, and `OutputString`
+    serializes it the same way, byte for byte.
+    """
+    __slots__ = ("key", "value", "coded_value")
+
+    def __init__(self, key, value):
+        if key.lower() in _COOKIE_ATTRIBUTES:
+            raise http_cookies.CookieError(
+                "Attempt to set a reserved key %r" % (key,))
+        if not http_cookies._is_legal_key(key):
+            raise http_cookies.CookieError("Illegal key %r" % (key,))
+        self.key = key
+        self.value = value
+        self.coded_value = http_cookies._quote(value)
+
+    def __setitem__(self, name, value):
+        name = name.lower()
+        if name not in _COOKIE_ATTRIBUTES:
+            raise http_cookies.CookieError("Invalid attribute %r" % (name,))
+        dict.__setitem__(self, name, value)
+
+    def __missing__(self, name):
+        return ""
+
+    def OutputString(self, attrs=None):
+        result = [self.key + "=" + self.coded_value]
+        for name, value in sorted(self.items()):
+            if value == "" or (attrs is not None and name not in attrs):
+                continue
+            if name in _COOKIE_FLAGS:
+                if value:
+                    result.append(_COOKIE_FLAGS[name])
+            elif name == "expires" and isinstance(value, int):
+                result.append("expires=" + http_cookies._getdate(value))
+            elif name == "max-age" and isinstance(value, int):
+                result.append("Max-Age=%d" % value)
+            elif name == "comment" and isinstance(value, str):
+                result.append("Comment=" + http_cookies._quote(value))
+            else:
+                result.append("%s=%s" % (_COOKIE_ATTRIBUTES[name], value))
+        return "; ".join(result)
 
-def decode_signed_value(secret, name, value, max_age_days=31) -> bytes:
+
+@functools.lru_cache(maxsize=64)
+def _cookie_date(timestamp):
+    # Cookies set within the same second expire at the same time.
+    return email.utils.formatdate(timestamp, localtime=False, usegmt=True)
+
+
+# Signed values are ``2|1:0|10:<timestamp>|<name>|<base64 value>|<signature>``
+# (each field prefixed with its length, the one before the timestamp being
+# a key version, reserved), signed with HMAC-SHA256.  Version 1 values,
+# ``<base64 value>|<timestamp>|<HMAC-SHA1 signature>``, are still read.
+DEFAULT_SIGNED_VALUE_VERSION = 2
+DEFAULT_SIGNED_VALUE_MIN_VERSION = 1
+
+# (secret, name, signed value): (version, timestamp, value) of the values
+# verified recently, so reading the same cookie again on later requests
+# skips the HMAC and base64 decoding.  Only values with a valid signature
+# get in, and their age is checked on every read.
+_verified_values = cache.LRUCache(maxsize=1000)
+
+
+def create_signed_value(secret, name, value, version=None):
+    if version is None:
+        version = DEFAULT_SIGNED_VALUE_VERSION
+    timestamp = utf8(str(int(time.time())))
+    value = base64.b64encode(utf8(value))
+    if version == 1:
+        signature = _create_signature(secret, name, value, timestamp)
+        return b"|".join([value, timestamp, signature])
+    elif version == 2:
+        to_sign = b"|".join([b"2", b"1:0", _format_field(timestamp),
+                             _format_field(name), _format_field(value), b""])
+        return to_sign + _create_signature_v2(secret, to_sign)
+    raise ValueError("Unsupported signed value version %r" % version)
+
+
+def decode_signed_value(secret, name, value, max_age_days=31,
+                        min_version=None) -> bytes:
     if not value:
         return None
-    parts = utf8(value).split(b"|")
+    value = utf8(value)
+    key = (secret, name, value)
+    verified = _verified_values.get(key)
+    if verified is None:
+        if value.startswith(b"2|"):
+            verified = _decode_signed_value_v2(secret, name, value)
+        else:
+            verified = _decode_signed_value_v1(secret, name, value)
+        if verified is None:
+            return None
+        _verified_values.set(key, verified)
+    version, timestamp, decoded = verified
+    if min_version is None:
+        min_version = DEFAULT_SIGNED_VALUE_MIN_VERSION
+    if version < min_version:
+        return None
+    if timestamp < time.time() - max_age_days * 86400:
+        log.msg("Expired cookie %r" % value)
+        return None
+    return decoded
+
+
+def _decode_signed_value_v1(secret, name, value):
+    parts = value.split(b"|")
     if len(parts) != 3:
         return None
     signature = _create_signature(secret, name, parts[0], parts[1])
-    if not _time_independent_equals(parts[2], signature):
+    if not hmac.compare_digest(parts[2], signature):
         log.msg("Invalid cookie signature %r" % value)
         return None
     timestamp = int(parts[1])
-    if timestamp < time.time() - max_age_days * 86400:
-        log.msg("Expired cookie %r" % value)
-        return None
     if timestamp > time.time() + 31 * 86400:
         # _cookie_signature does not hash a delimiter between the
         # parts of the cookie, so an attacker could transfer trailing
@@ -2207,13 +3572,57 @@ def decode_signed_value(secret, name, value, max_age_days=31) -> bytes:
         log.msg("Tampered cookie %r" % value)
         return None
     try:
-        return base64.b64decode(parts[0])
+        return (1, timestamp, base64.b64decode(parts[0]))
     except Exception:
         return None
 
 
+def _decode_signed_value_v2(secret, name, value):
+    try:
+        key_version, rest = _consume_field(value[2:])
+        timestamp, rest = _consume_field(rest)
+        name_field, rest = _consume_field(rest)
+        value_field, signature = _consume_field(rest)
+    except ValueError:
+        return None
+    signed = value[:-len(signature)] if signature else value
+    if not hmac.compare_digest(signature,
+                               _create_signature_v2(secret, signed)):
+        log.msg("Invalid cookie signature %r" % value)
+        return None
+    if name_field != utf8(name):
+        return None
+    timestamp = int(timestamp)
+    if timestamp > time.time() + 31 * 86400:
+        log.msg("Cookie timestamp in future; possible tampering %r" % value)
+        return None
+    try:
+        return (2, timestamp, base64.b64decode(value_field))
+    except Exception:
+        return None
+
+
+def _format_field(s):
+    s = utf8(s)
+    return utf8("%d:" % len(s)) + s
+
+
+def _consume_field(s):
+    length, sep, rest = s.partition(b":")
+    if not sep or not length.isdigit():
+        raise ValueError("Malformed signed value field")
+    n = int(length)
+    if rest[n:n + 1] != b"|":
+        raise ValueError("Malformed signed value field")
+    return rest[:n], rest[n + 1:]
+
+
 def _create_signature(secret: str, *parts) -> bytes:
     hash = hmac.new(utf8(secret), digestmod=hashlib.sha1)
     for part in parts:
         hash.update(utf8(part))
     return utf8(hash.hexdigest())
+
+
+def _create_signature_v2(secret: str, s: bytes) -> bytes:
+    return utf8(hmac.new(utf8(secret), s, hashlib.sha256).hexdigest())
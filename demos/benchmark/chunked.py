@@ -0,0 +1,125 @@
+# coding: utf-8
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Throughput of long-lived chunked (streaming) responses.
+#
+#   python chunked.py [-n 20000] [-s 512]
+#
+# First times the chunk framing alone (formatting into one string versus
+# the segment list handed to the transport), then streams -n chunks of -s
+# bytes from a handler that flushes after every write, over loopback.
+
+import getopt
+import sys
+import time
+
+from twisted.internet import defer
+from twisted.internet import protocol
+from twisted.internet import reactor
+
+from cyclone import web
+
+
+class _Request(object):
+    def supports_http_1_1(self):
+        return True
+
+
+def format_framing(block):
+    # What the transform used to do, minus the str/bytes mixup.
+    return b"%s\r\n%s\r\n" % (("%x" % len(block)).encode(), block)
+
+
+def framing(n, size):
+    block = b"x" * size
+    t = web.ChunkedTransferEncoding(_Request())
+    t.transform_first_chunk(200, {}, b"", False)
+    for label, fn in (("%-formatting", format_framing),
+                      ("joined", lambda b: t.transform_chunk(b, False)),
+                      ("segments",
+                       lambda b: t.transform_chunk_segments(b, False))):
+        start = time.perf_counter()
+        for i in range(n):
+            fn(block)
+        elapsed = time.perf_counter() - start
+        print("  %-14s %8.0f ns/chunk" % (label, elapsed / n * 1e9))
+
+
+class StreamHandler(web.RequestHandler):
+    def get(self):
+        n = int(self.get_argument("n"))
+        block = b"x" * int(self.get_argument("s"))
+        for i in range(n):
+            self.write(block)
+            self.flush()
+
+
+class _Counter(protocol.Protocol):
+    def __init__(self, request, finished):
+        self.request = request
+        self.finished = finished
+        self.received = 0
+
+    def connectionMade(self):
+        self.transport.write(self.request)
+
+    def dataReceived(self, data):
+        self.received += len(data)
+
+    def connectionLost(self, reason):
+        self.finished.callback(self.received)
+
+
+@defer.inlineCallbacks
+def streaming(n, size):
+    app = web.Application([(r"/", StreamHandler)])
+    port = reactor.listenTCP(0, app, interface="127.0.0.1")
+    request = ("GET /?n=%d&s=%d HTTP/1.1\r\nHost: localhost\r\n"
+               "Connection: close\r\n\r\n" % (n, size)).encode()
+    try:
+        for i in range(3):
+            finished = defer.Deferred()
+            start = time.perf_counter()
+            yield protocol.ClientCreator(
+                reactor, _Counter, request, finished).connectTCP(
+                "127.0.0.1", port.getHost().port)
+            received = yield finished
+            elapsed = time.perf_counter() - start
+            print("  run %d: %d bytes in %.3fs, %.1f MB/s, %.0f chunks/s" % (
+                  i + 1, received, elapsed, received / elapsed / 1e6,
+                  n / elapsed))
+    finally:
+        port.stopListening()
+        reactor.stop()
+
+
+def main():
+    n = 20000
+    size = 512
+    opts, args = getopt.getopt(sys.argv[1:], "n:s:")
+    for o, a in opts:
+        if o == "-n":
+            n = int(a)
+        elif o == "-s":
+            size = int(a)
+
+    print("framing %d chunks of %d bytes" % (n, size))
+    framing(n, size)
+    print("streaming %d chunks of %d bytes" % (n, size))
+    reactor.callWhenRunning(streaming, n, size)
+    reactor.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# coding: utf-8
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Bytes saved versus CPU time spent by the response compression transform.
+#
+#   python compression.py [-n 200]
+#
+# Compares the old GzipFile-per-response approach with the zlib based
+# GZipContentEncoding at several levels, plus brotli/zstd when installed.
+
+import getopt
+import gzip
+import io
+import sys
+import time
+
+from cyclone import escape
+from cyclone.httputil import HTTPHeaders
+from cyclone.web import GZipContentEncoding
+
+
+def sample_payloads():
+    html = "".join("<tr><td>%d</td><td>row %d</td><td>%s</td></tr>\n" %
+                   (i, i, "x" * (i % 40)) for i in range(2000))
+    html = "<html><body><table>%s</table></body></html>" % html
+    data = [{"id": i, "name": "user%d" % i, "active": i % 3 == 0}
+            for i in range(2000)]
+    return [
+        ("small json (200B)", escape.utf8(escape.json_encode(data[:4]))),
+        ("html (%dKB)" % (len(html) // 1024), escape.utf8(html)),
+        ("json (%dKB)" % (len(escape.json_encode(data)) // 1024),
+         escape.utf8(escape.json_encode(data))),
+    ]
+
+
+def old_gzip(body, chunks):
+    # The pre-zlib transform: GzipFile + flush() after every chunk.
+    value = io.BytesIO()
+    f = gzip.GzipFile(mode="w", fileobj=value)
+    out = []
+    for chunk in chunks[:-1]:
+        f.write(chunk)
+        f.flush()
+        out.append(value.getvalue())
+        value.truncate(0)
+        value.seek(0)
+    f.write(chunks[-1])
+    f.close()
+    out.append(value.getvalue())
+    return b"".join(out)
+
+
+class _Request(object):
+    def __init__(self, coding):
+        self.headers = HTTPHeaders({"Accept-Encoding": coding})
+
+    def supports_http_1_1(self):
+        return True
+
+
+def transform(coding, **kwargs):
+    request = _Request(coding)
+
+    def run(body, chunks):
+        t = GZipContentEncoding(request, min_length=0, **kwargs)
+        headers = {"Content-Type": "text/html"}
+        out = [t.transform_first_chunk(200, headers, chunks[0],
+                                       len(chunks) == 1)[2]]
+        for i, chunk in enumerate(chunks[1:]):
+            out.append(t.transform_chunk(chunk, i == len(chunks) - 2))
+        return b"".join(out)
+    return run
+
+
+def measure(fn, body, chunks, n):
+    start = time.process_time()
+    for i in range(n):
+        out = fn(body, chunks)
+    elapsed = time.process_time() - start
+    return len(out), elapsed / n
+
+
+def main():
+    n = 200
+    opts, args = getopt.getopt(sys.argv[1:], "n:")
+    for o, a in opts:
+        if o == "-n":
+            n = int(a)
+
+    candidates = [("GzipFile (old)", old_gzip)]
+    for level in (1, 6, 9):
+        candidates.append(("gzip level %d" % level,
+                           transform("gzip", level=level)))
+    available = GZipContentEncoding.available_codings()
+    if "br" in available:
+        candidates.append(("brotli", transform("br")))
+    if "zstd" in available:
+        candidates.append(("zstd", transform("zstd")))
+
+    for name, body in sample_payloads():
+        print("%s, %d bytes" % (name, len(body)))
+        step = len(body) // 8 + 1
+        flushed = [body[i:i + step] for i in range(0, len(body), step)]
+        for label, whole in (("one write", [body]),
+                             ("%d flushes" % len(flushed), flushed)):
+            for cname, fn in candidates:
+                size, cpu = measure(fn, body, whole, n)
+                print("  %-10s %-16s %8d bytes  saved %5.1f%%  %8.1fus" % (
+                      label, cname, size, 100.0 * (len(body) - size) /
+                      len(body), cpu * 1e6))
+        print("")
+
+
+if __name__ == "__main__":
+    main()
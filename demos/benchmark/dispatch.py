@@ -0,0 +1,97 @@
+# coding: utf-8
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Per-request dispatch overhead of the different handler styles.
+#
+#   python dispatch.py [-n 20000]
+#
+# Requests go through Application.__call__ and the handler's _execute,
+# over an in-memory transport; handlers complete without waiting on the
+# reactor, so what's measured is the framework overhead of each style.
+
+import getopt
+import sys
+import time
+
+from twisted.internet import defer
+from twisted.test import proto_helpers
+
+from cyclone import httpserver
+from cyclone import web
+
+
+class SyncHandler(web.RequestHandler):
+    def get(self):
+        self.write("hello")
+
+
+class DeferredHandler(web.RequestHandler):
+    def get(self):
+        return defer.succeed("hello").addCallback(self.write)
+
+
+class InlineCallbacksHandler(web.RequestHandler):
+    @defer.inlineCallbacks
+    def get(self):
+        value = yield defer.succeed("hello")
+        self.write(value)
+
+
+class AsyncDefHandler(web.RequestHandler):
+    async def get(self):
+        value = await defer.succeed("hello")
+        self.write(value)
+
+
+class AsyncPrepareHandler(SyncHandler):
+    async def prepare(self):
+        pass
+
+
+def run(app, path, n):
+    connection = httpserver.HTTPConnection()
+    connection.factory = app
+    connection.transport = proto_helpers.StringTransport()
+    connection.connectionMade()
+    start = time.perf_counter()
+    for i in range(n):
+        request = httpserver.HTTPRequest("GET", path, connection=connection,
+                                         remote_ip="127.0.0.1")
+        connection._request = request
+        app(request)
+        connection.transport.clear()
+    return (time.perf_counter() - start) / n
+
+
+def main():
+    n = 20000
+    opts, args = getopt.getopt(sys.argv[1:], "n:")
+    for o, a in opts:
+        if o == "-n":
+            n = int(a)
+
+    handlers = [("sync", SyncHandler),
+                ("Deferred", DeferredHandler),
+                ("inlineCallbacks", InlineCallbacksHandler),
+                ("async def", AsyncDefHandler),
+                ("async prepare()", AsyncPrepareHandler)]
+    app = web.Application([("/%d" % i, h) for i, (name, h)
+                           in enumerate(handlers)])
+    for i, (name, handler) in enumerate(handlers):
+        run(app, "/%d" % i, n // 10)  # warm up
+        print("%-16s %6.1fus/request" % (name, run(app, "/%d" % i, n) * 1e6))
+
+
+if __name__ == "__main__":
+    main()
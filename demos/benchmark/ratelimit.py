@@ -0,0 +1,60 @@
+# coding: utf-8
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Memory and speed of cyclone.ratelimit with many distinct keys.
+#
+#   python ratelimit.py [-n 1000000]
+#
+# Fills a RateLimiter with n client addresses, then reports the memory it
+# holds per key (excluding the key strings, which the requests own) and
+# the cost of consume() for known keys.
+
+import getopt
+import sys
+import time
+import tracemalloc
+
+from cyclone import ratelimit
+
+
+def main():
+    n = 1000000
+    opts, args = getopt.getopt(sys.argv[1:], "n:")
+    for o, a in opts:
+        if o == "-n":
+            n = int(a)
+
+    keys = ["10.%d.%d.%d" % (i >> 16 & 255, i >> 8 & 255, i & 255)
+            for i in range(n)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    limiter = ratelimit.RateLimiter(rate=10, max_keys=n)
+    start = time.perf_counter()
+    for key in keys:
+        limiter.consume(key)
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print("%d keys: %.1fMB, %.0f bytes/key, %.2fus/new key" % (
+        len(limiter), size / 1e6, float(size) / n, elapsed / n * 1e6))
+
+    start = time.perf_counter()
+    for key in keys:
+        limiter.consume(key)
+    elapsed = time.perf_counter() - start
+    print("consume(): %.2fus/known key" % (elapsed / n * 1e6))
+
+
+if __name__ == "__main__":
+    main()
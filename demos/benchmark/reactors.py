@@ -0,0 +1,177 @@
+# coding: utf-8
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Compares reactors on a hello world and on server-sent events fan-out.
+#
+#   python reactors.py [-n 20000] [-c 50] [-s 500] [-e 200] [epoll asyncio..]
+#
+# Each reactor (epoll, asyncio and uvloop by default, those that can't be
+# installed are skipped) runs in its own process, serving and loading the
+# server over loopback: -n hello world requests over -c keep-alive
+# connections, then -e events broadcast to -s SSE subscribers.
+
+import getopt
+import subprocess
+import sys
+import time
+
+from cyclone import runner
+
+
+def serve(reactor_name, n, connections, subscribers, events):
+    reactor = runner.install_reactor(reactor_name)
+
+    from twisted.internet import defer
+    from twisted.internet import protocol
+
+    from cyclone import sse
+    from cyclone import web
+
+    class HelloHandler(web.RequestHandler):
+        def get(self):
+            self.write("Hello, world")
+
+    class EventsHandler(sse.SSEHandler):
+        clients = []
+        bound = None
+
+        def bind(self):
+            self.clients.append(self)
+            if len(self.clients) == subscribers:
+                self.bound.callback(None)
+
+        def unbind(self):
+            self.clients.remove(self)
+
+    class HelloClient(protocol.Protocol):
+        def connectionMade(self):
+            self.buffer = b""
+            self.transport.write(b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n")
+
+        def dataReceived(self, data):
+            self.buffer += data
+            if self.buffer.endswith(b"Hello, world"):
+                self.buffer = b""
+                self.factory.requests -= 1
+                if self.factory.requests > 0:
+                    self.transport.write(
+                        b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n")
+                elif not self.factory.finished.called:
+                    self.factory.finished.callback(None)
+
+    class EventsClient(protocol.Protocol):
+        def connectionMade(self):
+            self.received = 0
+            self.tail = b""
+            self.transport.write(b"GET /events HTTP/1.1\r\n"
+                                 b"Host: localhost\r\n\r\n")
+
+        def dataReceived(self, data):
+            data = self.tail + data
+            self.received += data.count(b"\n\n")
+            self.tail = data[-1:]
+            if self.received == events:
+                self.factory.pending -= 1
+                if self.factory.pending == 0:
+                    self.factory.finished.callback(None)
+
+    @defer.inlineCallbacks
+    def bench():
+        app = web.Application([(r"/", HelloHandler),
+                               (r"/events", EventsHandler)])
+        port = reactor.listenTCP(0, app, interface="127.0.0.1",
+                                 backlog=1024)
+        address = port.getHost()
+        try:
+            factory = protocol.ClientFactory()
+            factory.protocol = HelloClient
+            factory.requests = n
+            factory.finished = defer.Deferred()
+            start = time.perf_counter()
+            for i in range(connections):
+                reactor.connectTCP(address.host, address.port, factory)
+            yield factory.finished
+            elapsed = time.perf_counter() - start
+            print("hello %.0f" % (n / elapsed))
+
+            factory = protocol.ClientFactory()
+            factory.protocol = EventsClient
+            factory.pending = subscribers
+            factory.finished = defer.Deferred()
+            EventsHandler.bound = defer.Deferred()
+            for i in range(subscribers):
+                reactor.connectTCP(address.host, address.port, factory)
+            yield EventsHandler.bound
+            start = time.perf_counter()
+            for i in range(events):
+                for client in EventsHandler.clients:
+                    client.sendEvent("event %d" % i)
+                if i % 10 == 9:
+                    # Let the transports drain, as a real publisher would.
+                    d = defer.Deferred()
+                    reactor.callLater(0, d.callback, None)
+                    yield d
+            yield factory.finished
+            elapsed = time.perf_counter() - start
+            print("sse %.0f" % (subscribers * events / elapsed))
+        finally:
+            port.stopListening()
+            reactor.stop()
+
+    reactor.callWhenRunning(bench)
+    reactor.run()
+
+
+def main():
+    n = 20000
+    connections = 50
+    subscribers = 500
+    events = 200
+    child = None
+    opts, args = getopt.getopt(sys.argv[1:], "n:c:s:e:r:")
+    for o, a in opts:
+        if o == "-n":
+            n = int(a)
+        elif o == "-c":
+            connections = int(a)
+        elif o == "-s":
+            subscribers = int(a)
+        elif o == "-e":
+            events = int(a)
+        elif o == "-r":
+            child = a
+
+    if child is not None:
+        serve(child, n, connections, subscribers, events)
+        return
+
+    print("%d requests over %d connections, %d events to %d subscribers" % (
+          n, connections, events, subscribers))
+    print("%-10s %14s %16s" % ("reactor", "hello req/s", "sse events/s"))
+    for name in args or ("epoll", "asyncio", "uvloop"):
+        p = subprocess.run([sys.executable, __file__, "-r", name,
+                            "-n", str(n), "-c", str(connections),
+                            "-s", str(subscribers), "-e", str(events)],
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if p.returncode != 0:
+            error = p.stderr.decode().strip().splitlines()
+            print("%-10s %s" % (name, error[-1] if error else "failed"))
+            continue
+        results = dict(line.split() for line in p.stdout.decode().split("\n")
+                       if line)
+        print("%-10s %14s %16s" % (name, results["hello"], results["sse"]))
+
+
+if __name__ == "__main__":
+    main()
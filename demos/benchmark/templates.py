@@ -0,0 +1,98 @@
+# coding: utf-8
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Template rendering speed.
+#
+#   python templates.py [-n 5000]
+#
+# Renders a small template (a greeting) and a large one (a page extending
+# a layout, with a 100 rows table), with Template.generate, and reports the
+# peak memory allocated by a render.
+
+import getopt
+import sys
+import time
+import tracemalloc
+
+from cyclone import template
+
+LAYOUT = """<html>
+  <head><title>{% block title %}Untitled{% end %}</title></head>
+  <body>
+    <div id="header">{{ user }}</div>
+    {% block body %}{% end %}
+    <div id="footer">&copy; {{ year }}</div>
+  </body>
+</html>"""
+
+PAGE = """{% extends "layout.html" %}
+{% block title %}Orders of {{ user }}{% end %}
+{% block body %}
+  <table>
+    {% for order in orders %}
+    <tr class="{{ 'odd' if order['id'] % 2 else 'even' }}">
+      <td>{{ order['id'] }}</td>
+      <td>{{ order['item'] }}</td>
+      <td>{{ "%.2f" % order['price'] }}</td>
+      {% if order['shipped'] %}<td>shipped</td>{% else %}<td>pending</td>{% end %}
+    </tr>
+    {% end %}
+  </table>
+{% end %}"""
+
+
+def timeit(function, n):
+    function()
+    start = time.perf_counter()
+    for i in range(n):
+        function()
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def peak_memory(function):
+    tracemalloc.start()
+    try:
+        function()
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        function()
+        return tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    n = 5000
+    opts, args = getopt.getopt(sys.argv[1:], "n:")
+    for o, a in opts:
+        if o == "-n":
+            n = int(a)
+
+    small = template.Template("<p>Hello, {{ name }}!</p>", name="small.html")
+    loader = template.DictLoader({"layout.html": LAYOUT, "page.html": PAGE})
+    large = loader.load("page.html")
+    orders = [{"id": i, "item": "item <%d>" % i, "price": i * 1.5,
+               "shipped": i % 3 == 0} for i in range(100)]
+
+    render_small = lambda: small.generate(name="world")
+    render_large = lambda: large.generate(user="alice", year=2024,
+                                          orders=orders)
+    print("small: %6.1fus %7d bytes" % (timeit(render_small, n),
+                                        peak_memory(render_small)))
+    print("large: %6.1fus %7d bytes" % (timeit(render_large, n // 10),
+                                        peak_memory(render_large)))
+
+
+if __name__ == "__main__":
+    main()